@@ -0,0 +1,189 @@
+# backend/batch.py
+import os
+import threading
+import time
+import uuid
+
+from backend import deadlines, job_queue, run_pipeline, scheduler
+
+# Progress of a batch is kept in memory for BATCH_TTL seconds after it finished; one that
+# never reports finishing (e.g. queue mode without polling) is dropped after BATCH_MAX_AGE.
+# It is not persisted: only the API process that created a batch knows it, and forgets it
+# on restart. Per-document job ids (job_ids()) outlive it in queue mode.
+BATCH_TTL = float(os.getenv("BATCH_TTL", "86400"))
+BATCH_MAX_AGE = float(os.getenv("BATCH_MAX_AGE", str(7 * 86400)))
+
+_batches = {}
+_batches_lock = threading.Lock()
+
+
+def _expire(now):
+    # Caller holds _batches_lock
+    for batch_id, batch in list(_batches.items()):
+        if (batch["finished_at"] and batch["finished_at"] + BATCH_TTL < now) \
+                or batch["created_at"] + BATCH_MAX_AGE < now:
+            del _batches[batch_id]
+
+
+def create_batch(sessions, override=False, tenant=None):
+    """
+    Register a batch and submit every document to the pipeline scheduler's backfill lane.
+
+    The scheduler runs documents of one session in order, so the first document
+    still builds the session JSON and later merges never race on it; different
+    sessions run in parallel, fairly shared with interactive uploads and other
+    tenants. In queue mode (PIPELINE_MODE=queue) the documents are enqueued for
+    worker processes instead, grouped by session.
+
+    Args:
+        sessions: {session_name: [{"document", "filename"}, ...]} (files already in storage)
+        override: passed through to run_full_pipeline for conflict resolution
+        tenant: tenant charged for the batch (default: each session is its own tenant)
+    Returns:
+        batch id
+    """
+    batch_id = uuid.uuid4().hex[:12]
+    batch = {
+        "batch_id": batch_id,
+        "created_at": time.time(),
+        "finished_at": None,
+        "sessions": {
+            name: {
+                "documents": {d["document"]: {"status": "queued"} for d in documents},
+            }
+            for name, documents in sessions.items()
+        },
+    }
+    with _batches_lock:
+        _expire(batch["created_at"])
+        _batches[batch_id] = batch
+
+    if job_queue.QUEUE_MODE:
+        queue = job_queue.get_queue()
+        for name, documents in sessions.items():
+            for doc in documents:
+                job_id = queue.enqueue(job_queue.document_job(
+                    name, doc["document"], doc["filename"], override, tenant=tenant, lane="backfill",
+                ), group=name)
+                _set_status(batch_id, name, doc["document"], status="queued", job_id=job_id)
+    else:
+        pipeline = scheduler.get_scheduler()
+        for name, documents in sessions.items():
+            for doc in documents:
+                future = pipeline.submit(_run_document, batch_id, name, doc, override,
+                                         tenant=tenant or name, session=name, lane="backfill")
+                _set_status(batch_id, name, doc["document"], job_id=future.job_id)
+                future.add_done_callback(_on_cancel(batch_id, name, doc["document"]))
+
+    print(f"📦 Batch {batch_id} queued: {len(sessions)} sessions")
+    return batch_id
+
+
+def _set_status(batch_id, session_name, document, **fields):
+    with _batches_lock:
+        batch = _batches.get(batch_id)
+        if batch is None:
+            return  # expired
+        batch["sessions"][session_name]["documents"][document].update(fields)
+        if all(
+            d["status"] in ("success", "failed")
+            for s in batch["sessions"].values()
+            for d in s["documents"].values()
+        ):
+            batch["finished_at"] = time.time()
+
+
+def _on_cancel(batch_id, session_name, document):
+    # A document cancelled while queued (or waiting for budget) never gets back into _run_document
+    def callback(future):
+        if future.cancelled() or isinstance(future.exception(), deadlines.Cancelled):
+            _set_status(batch_id, session_name, document, status="failed", error="cancelled", finished_at=time.time())
+    return callback
+
+
+def _run_document(batch_id, session_name, doc, override):
+    _set_status(batch_id, session_name, doc["document"], status="running", started_at=time.time())
+    try:
+        run_pipeline.run_document(session_name, doc["document"], doc["filename"], override)
+    except scheduler.BudgetExceeded as e:
+        # The scheduler re-queues the document once the tenant's budget refills
+        _set_status(batch_id, session_name, doc["document"], status="queued", error=str(e))
+        raise
+    except deadlines.Cancelled:
+        _set_status(batch_id, session_name, doc["document"], status="failed", error="cancelled", finished_at=time.time())
+        raise
+    except Exception as e:
+        _set_status(batch_id, session_name, doc["document"], status="failed", error=str(e), finished_at=time.time())
+        raise
+    _set_status(batch_id, session_name, doc["document"], status="success", error=None, finished_at=time.time())
+
+
+_JOB_STATUS = {"queued": "queued", "leased": "running", "cancelling": "running",
+               "succeeded": "success", "failed": "failed", "cancelled": "failed"}
+
+
+def _refresh_from_queue(batch_id):
+    if not job_queue.QUEUE_MODE:
+        return
+    with _batches_lock:
+        batch = _batches.get(batch_id)
+        pending = [
+            (name, doc, info["job_id"])
+            for name, session in (batch or {}).get("sessions", {}).items()
+            for doc, info in session["documents"].items()
+            if info.get("job_id") and info["status"] not in ("success", "failed")
+        ]
+    queue = job_queue.get_queue() if pending else None
+    for name, doc, job_id in pending:
+        job = queue.get(job_id)
+        if job:
+            _set_status(batch_id, name, doc, status=_JOB_STATUS.get(job["status"], "queued"),
+                        attempts=job["attempts"], error=job["error"])
+
+
+def job_ids(batch_id):
+    """{session_name: {document: job_id}} of a batch ({} if unknown)."""
+    with _batches_lock:
+        batch = _batches.get(batch_id) or {"sessions": {}}
+        return {
+            name: {doc: info.get("job_id") for doc, info in session["documents"].items()}
+            for name, session in batch["sessions"].items()
+        }
+
+
+def get_batch_progress(batch_id):
+    """
+    Aggregate progress for a batch, or None if the id is unknown.
+    """
+    _refresh_from_queue(batch_id)
+    with _batches_lock:
+        _expire(time.time())
+        batch = _batches.get(batch_id)
+        if batch is None:
+            return None
+
+        totals = {"queued": 0, "running": 0, "success": 0, "failed": 0}
+        sessions = []
+        for name, session in batch["sessions"].items():
+            counts = {"queued": 0, "running": 0, "success": 0, "failed": 0}
+            for doc in session["documents"].values():
+                counts[doc["status"]] += 1
+                totals[doc["status"]] += 1
+            sessions.append({
+                "session_name": name,
+                **counts,
+                "documents": [{"document": d, **info} for d, info in session["documents"].items()],
+            })
+
+        total = sum(totals.values())
+        done = totals["success"] + totals["failed"]
+        return {
+            "batch_id": batch_id,
+            "status": "completed" if batch["finished_at"] else ("running" if done or totals["running"] else "queued"),
+            "total_documents": total,
+            **totals,
+            "progress": round(done / total, 4) if total else 1.0,
+            "created_at": batch["created_at"],
+            "finished_at": batch["finished_at"],
+            "sessions": sessions,
+        }
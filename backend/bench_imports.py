@@ -0,0 +1,59 @@
+# backend/bench_imports.py
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def time_import(module, runs=5):
+    """
+    Measure cold-start import latency of `module` in fresh interpreters.
+
+    Returns:
+        dict with wall-clock samples (seconds) and the slowest imports
+        reported by `python -X importtime` on the last run
+    """
+    samples = []
+    stderr = ""
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=BASE_DIR, capture_output=True, text=True,
+        )
+        samples.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+        stderr = proc.stderr
+
+    slowest = []
+    for line in stderr.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if m:
+            slowest.append((int(m.group(2)), m.group(4)))
+    slowest.sort(reverse=True)
+
+    return {
+        "module": module,
+        "runs": runs,
+        "median_s": statistics.median(samples),
+        "min_s": min(samples),
+        "max_s": max(samples),
+        "top_imports": [{"module": name, "cumulative_ms": us / 1000} for us, name in slowest[:15]],
+    }
+
+
+# CLI support
+if __name__ == "__main__":
+    modules = sys.argv[1:] or ["main", "backend.run_pipeline", "backend.code1", "backend.code2"]
+    for module in modules:
+        report = time_import(module)
+        print(f"\n⏱️  import {module}: median {report['median_s']*1000:.0f} ms "
+              f"(min {report['min_s']*1000:.0f}, max {report['max_s']*1000:.0f}, {report['runs']} runs)")
+        for entry in report["top_imports"]:
+            print(f"   {entry['cumulative_ms']:8.1f} ms  {entry['module']}")
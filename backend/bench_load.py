@@ -0,0 +1,378 @@
+# backend/bench_load.py
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# Allow running as a script (python backend/bench_load.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+BASE_DIR = Path(__file__).parent.parent
+LAG_INTERVAL = 0.05
+
+
+class StubLLM:
+    """
+    Stand-in for the OpenAI client: sleeps like a real call (lognormal latency
+    around `latency_ms`) and fills a fraction of the requested fields.
+    Blocking on purpose, like the real synchronous client.
+    """
+
+    def __init__(self, latency_ms=1500.0, jitter=0.3, fill_rate=0.3, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.fill_rate = fill_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        with self._lock:
+            self.calls += 1
+            rng = random.Random(self._rng.random())
+        time.sleep(rng.lognormvariate(0, self.jitter) * self.latency_ms / 1000)
+        prompt = messages[-1]["content"]
+        block = prompt.rsplit("Field Descriptions:", 1)[-1]
+        paths = [line[2:].split(": ", 1)[0] for line in block.splitlines() if line.startswith("- ")]
+        values = {path: f"stub {model}" for path in paths if rng.random() < self.fill_rate}
+        message = SimpleNamespace(content=json.dumps(values))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def make_pdf(lines):
+    """Smallest valid single-page PDF showing the given text lines (Helvetica)."""
+    text = "\n".join(
+        f"BT /F1 10 Tf 50 {780 - 14 * i} Td ({line.replace(chr(92), '').replace('(', '').replace(')', '')}) Tj ET"
+        for i, line in enumerate(lines)
+    )
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(text)} >>\nstream\n{text}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = "%PDF-1.4\n"
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+def synthetic_document(rng, session_name, index):
+    """A small KYC-style PDF with per-document values so documents are not identical."""
+    return make_pdf([
+        f"Investor: {session_name.replace('_', ' ').title()} Holdings LLC",
+        f"Document {index}",
+        f"Company Number: MU{rng.randrange(10**5, 10**6)}",
+        f"Date of Incorporation: {rng.randrange(1, 28):02d}-Jan-{rng.randrange(1990, 2024)}",
+        f"Tax Identification Number (TIN): {rng.randrange(10**8, 10**9)}",
+        f"Registered Address: {rng.randrange(1, 999)} Main Street, Port Louis",
+        "Passport: M12345678  Nationality: Mauritian",
+        "Authorized Signatory: John Doe",
+    ])
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}  # endpoint -> list of (latency_s, ok)
+        self.lags = []
+
+    def add(self, endpoint, latency, ok):
+        self.samples.setdefault(endpoint, []).append((latency, ok))
+
+    async def monitor_lag(self, stop):
+        """Sample how late a sleep wakes up on the app's event loop."""
+        loop = asyncio.get_running_loop()
+        while not stop.is_set():
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(max(0.0, loop.time() - start - LAG_INTERVAL))
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[k]
+
+
+async def send(client, recorder, endpoint, method, path, data=None, files=None):
+    start = time.perf_counter()
+    ok = False
+    try:
+        response = await client.request(method, path, data=data, files=files)
+        ok = response.status_code < 400
+        if ok and endpoint == "upload_process":
+            # The endpoint answers 200 even when the pipeline failed for a document
+            ok = all(r["status"] != "failed" for r in response.json()["results"])
+            if not ok:
+                print(f"⚠️ {path}: {[r.get('error') for r in response.json()['results'] if r['status'] == 'failed']}")
+        elif not ok:
+            print(f"⚠️ {method} {path} → {response.status_code} {response.text[:200]}")
+    except Exception as e:
+        print(f"⚠️ {method} {path} → {type(e).__name__}: {e}")
+    recorder.add(endpoint, time.perf_counter() - start, ok)
+
+
+async def synthetic_user(client, recorder, rng, session_name, uploads, read_ratio):
+    await send(client, recorder, "create_session", "POST", "/api/sessions/create", data={"session_name": session_name})
+    for i in range(uploads):
+        files = [("files", (f"{session_name}_doc{i}.pdf", synthetic_document(rng, session_name, i), "application/pdf"))]
+        await send(client, recorder, "upload_process", "POST", f"/api/sessions/{session_name}/upload_process",
+                   data={"override": "false"}, files=files)
+        while rng.random() < read_ratio:
+            if rng.random() < 0.5:
+                await send(client, recorder, "get_session", "GET", f"/api/sessions/{session_name}")
+            else:
+                await send(client, recorder, "list_sessions", "GET", "/api/sessions")
+
+
+def load_log(path):
+    """
+    Request log records, one JSON object per line:
+    {"t": 0.5, "method": "POST", "path": "/api/sessions/s1/upload_process", "endpoint": "upload_process",
+     "form": {"override": "false"}, "files": [{"name": "a.pdf", "path": "local/a.pdf"}]}
+    Lines that are not request records are ignored.
+    """
+    records, ignored = [], 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                ignored += 1
+                continue
+            if not isinstance(record, dict) or "method" not in record or "path" not in record:
+                ignored += 1
+                continue
+            records.append(record)
+    if ignored:
+        print(f"ℹ️ Ignored {ignored} line(s) of {path} that are not request records")
+    return sorted(records, key=lambda r: r.get("t", 0))
+
+
+def _replay_files(record, rng):
+    files = []
+    for spec in record.get("files", []):
+        if spec.get("path"):
+            content = Path(spec["path"]).read_bytes()
+        else:
+            content = synthetic_document(rng, spec["name"], 0)
+        files.append((spec.get("field", "files"), (spec["name"], content, spec.get("content_type", "application/pdf"))))
+    return files or None
+
+
+async def replay(client, recorder, records, concurrency, speed, rng, create_sessions):
+    if create_sessions:
+        # Sessions the log uploads to without creating them
+        sessions = {r["path"].split("/")[3] for r in records
+                    if r["path"].startswith("/api/sessions/") and r["path"].endswith("/upload_process")}
+        create = [r["form"].get("session_name") for r in records
+                  if r["path"] == "/api/sessions/create" and r.get("form")]
+        for session_name in sessions - set(create):
+            await send(client, recorder, "create_session", "POST", "/api/sessions/create",
+                       data={"session_name": session_name})
+
+    gate = asyncio.Semaphore(concurrency)
+    start = time.perf_counter()
+
+    async def one(record):
+        delay = record.get("t", 0) / speed - (time.perf_counter() - start) if speed else 0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        async with gate:
+            endpoint = record.get("endpoint") or (
+                "upload_process" if record["path"].endswith("/upload_process") else f"{record['method']} {record['path']}"
+            )
+            await send(client, recorder, endpoint, record["method"], record["path"],
+                       record.get("form"), _replay_files(record, rng))
+
+    await asyncio.gather(*(one(r) for r in records))
+
+
+def install_stub(args):
+    from backend import code2
+    stub = StubLLM(args.llm_latency_ms, args.llm_jitter, args.fill_rate, args.seed)
+    code2.get_client = lambda: stub
+    return stub
+
+
+async def drive(args, client, recorder):
+    rng = random.Random(args.seed)
+    if args.log:
+        await replay(client, recorder, load_log(args.log), args.concurrency, args.speed, rng,
+                     not args.url or args.create_sessions)
+        return
+    gate = asyncio.Semaphore(args.concurrency)
+    run_id = f"{int(time.time()) % 100000}"
+
+    async def user(i):
+        async with gate:
+            await synthetic_user(client, recorder, rng, f"load_{run_id}_{i}", args.uploads, args.read_ratio)
+
+    await asyncio.gather(*(user(i) for i in range(args.sessions)))
+
+
+async def run_in_process(args, recorder):
+    import httpx
+    import main
+    stop = asyncio.Event()
+    lag = asyncio.create_task(recorder.monitor_lag(stop))
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=None) as client:
+        await drive(args, client, recorder)
+    stop.set()
+    await lag
+
+
+async def run_over_http(args, recorder, base_url, server_loop=None):
+    import httpx
+    stop = threading.Event()
+    lag = None
+    if server_loop is not None:
+        lag = asyncio.run_coroutine_threadsafe(recorder.monitor_lag(_ThreadEvent(stop)), server_loop)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+        await drive(args, client, recorder)
+    stop.set()
+    if lag is not None:
+        await asyncio.wrap_future(lag)
+
+
+class _ThreadEvent:
+    """threading.Event with the is_set() interface monitor_lag expects."""
+
+    def __init__(self, event):
+        self._event = event
+
+    def is_set(self):
+        return self._event.is_set()
+
+
+def start_server(port):
+    """Run uvicorn on localhost in a background thread; returns (server, its event loop)."""
+    import uvicorn
+    import main
+    config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")
+    server = uvicorn.Server(config)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(server.serve(),), daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, loop, thread
+
+
+def report(recorder, elapsed, stub=None):
+    rows = []
+    for endpoint, samples in sorted(recorder.samples.items()):
+        latencies = [s[0] * 1000 for s in samples]
+        errors = sum(1 for s in samples if not s[1])
+        rows.append({
+            "endpoint": endpoint,
+            "requests": len(samples),
+            "error_rate": errors / len(samples),
+            "p50_ms": _percentile(latencies, 50),
+            "p95_ms": _percentile(latencies, 95),
+            "p99_ms": _percentile(latencies, 99),
+            "max_ms": max(latencies),
+        })
+    total = sum(r["requests"] for r in rows)
+    lags = [l * 1000 for l in recorder.lags]
+    summary = {
+        "elapsed_s": elapsed,
+        "requests": total,
+        "throughput_rps": total / elapsed if elapsed else 0.0,
+        "uploads_per_min": sum(r["requests"] for r in rows if r["endpoint"] == "upload_process") / elapsed * 60
+        if elapsed else 0.0,
+        "error_rate": sum(r["error_rate"] * r["requests"] for r in rows) / total if total else 0.0,
+        "loop_lag_ms": {"p50": _percentile(lags, 50), "p99": _percentile(lags, 99), "max": max(lags, default=0.0)}
+        if lags else None,
+        "llm_calls": stub.calls if stub else None,
+        "endpoints": rows,
+    }
+
+    print(f"\n{'endpoint':32} {'reqs':>6} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for r in rows:
+        print(f"{r['endpoint'][:32]:32} {r['requests']:>6} {100 * r['error_rate']:>6.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['max_ms']:>9.1f}")
+    print(f"\n📊 {total} requests in {elapsed:.1f}s → {summary['throughput_rps']:.2f} req/s, "
+          f"{summary['uploads_per_min']:.1f} uploads/min, {100 * summary['error_rate']:.1f}% errors")
+    if summary["loop_lag_ms"]:
+        lag = summary["loop_lag_ms"]
+        print(f"   event-loop lag: p50 {lag['p50']:.1f} ms, p99 {lag['p99']:.1f} ms, max {lag['max']:.1f} ms")
+    if stub:
+        print(f"   stub LLM calls: {stub.calls}")
+    return summary
+
+
+def main(args):
+    # Keep load-test sessions and indexes out of the real samples/ tree unless told otherwise
+    if not args.url and not args.keep_env:
+        scratch = Path(tempfile.mkdtemp(prefix="loadtest_"))
+        os.environ.setdefault("STORAGE_URL", f"file://{scratch / 'sessions'}")
+        os.environ.setdefault("DEDUP_DB", str(scratch / "dedup.sqlite3"))
+        os.environ.setdefault("PROFILE_DB", str(scratch / "profiles.sqlite3"))
+        os.environ.setdefault("JOB_QUEUE_URL", f"sqlite:///{scratch / 'jobs.sqlite3'}")
+        print(f"🧪 Scratch storage: {scratch}")
+
+    recorder = Recorder()
+    stub = None if args.url else install_stub(args)
+    start = time.perf_counter()
+    if args.url:
+        asyncio.run(run_over_http(args, recorder, args.url))
+    elif args.port:
+        server, loop, thread = start_server(args.port)
+        asyncio.run(run_over_http(args, recorder, f"http://127.0.0.1:{args.port}", loop))
+        server.should_exit = True
+        thread.join()
+    else:
+        asyncio.run(run_in_process(args, recorder))
+    summary = report(recorder, time.perf_counter() - start, stub)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=4)
+    return summary
+
+
+# CLI support
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP load test of the FastAPI app with a stubbed LLM")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--port", type=int, help="serve the app with uvicorn on localhost:PORT (default: in-process ASGI)")
+    target.add_argument("--url", help="drive an already running node (its own LLM config applies; no lag metric)")
+    parser.add_argument("--log", help="replay a JSONL request log instead of the synthetic mix")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor for log timestamps (0 = no delays)")
+    parser.add_argument("--sessions", type=int, default=20, help="synthetic sessions (one virtual user each)")
+    parser.add_argument("--uploads", type=int, default=3, help="uploads per synthetic session")
+    parser.add_argument("--read-ratio", type=float, default=0.5, help="chance of another read request after each upload")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent virtual users / in-flight replay requests")
+    parser.add_argument("--llm-latency-ms", type=float, default=1500.0, help="median stub LLM latency")
+    parser.add_argument("--llm-jitter", type=float, default=0.3, help="lognormal sigma of the stub latency")
+    parser.add_argument("--fill-rate", type=float, default=0.3, help="share of requested fields the stub fills")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--create-sessions", action="store_true",
+                        help="with --url and --log: create the sessions the log uploads to without creating them")
+    parser.add_argument("--keep-env", action="store_true", help="use the configured STORAGE_URL / databases as-is")
+    parser.add_argument("--json", help="also write the summary to this file")
+    main(parser.parse_args())
@@ -0,0 +1,115 @@
+# backend/bench_routing.py
+import argparse
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Allow running as a script (python backend/bench_routing.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import classifier, code2, templates
+
+BASE_DIR = Path(__file__).parent.parent
+
+
+def find_documents(paths):
+    """All code1_output.txt files under the given files/folders."""
+    found = []
+    for p in map(Path, paths):
+        if p.is_file():
+            found.append(p)
+        elif p.is_dir():
+            found.extend(sorted(p.rglob("code1_output.txt")))
+    return found
+
+
+def simulated_latency_ms(tokens, ms_per_1k_tokens, call_overhead_ms):
+    return call_overhead_ms + tokens / 1000 * ms_per_1k_tokens
+
+
+def compare(paths, template_id=None, ms_per_1k_tokens=400.0, call_overhead_ms=800.0, live=False):
+    """
+    Compare routed vs unrouted extraction over existing code1 outputs.
+
+    Prompt tokens are measured exactly; LLM latency is simulated from tokens
+    (or measured with live=True, which calls the real API twice per document).
+    """
+    template = templates.get_template(template_id)
+    routes = classifier.load_routes()
+    rows = []
+    for doc in find_documents(paths):
+        text = doc.read_text(encoding="utf-8")
+        start = time.perf_counter()
+        label, _ = classifier.classify_text(text)
+        classify_ms = (time.perf_counter() - start) * 1000
+        fields = classifier.route_fields(label, template, routes)
+
+        unrouted_tokens = code2.estimate_tokens(code2.build_prompt(text, template))
+        routed_tokens = 0 if fields == [] else code2.estimate_tokens(code2.build_prompt(text, template, fields))
+        row = {
+            "document": doc.parent.name,
+            "label": label,
+            "fields": len(template.fields) if fields is None else len(fields),
+            "classify_ms": classify_ms,
+            "unrouted_tokens": unrouted_tokens,
+            "routed_tokens": routed_tokens,
+            "unrouted_ms": simulated_latency_ms(unrouted_tokens, ms_per_1k_tokens, call_overhead_ms),
+            "routed_ms": classify_ms + (0 if fields == [] else
+                                        simulated_latency_ms(routed_tokens, ms_per_1k_tokens, call_overhead_ms)),
+        }
+        if live:
+            row["unrouted_ms"], row["routed_ms"] = _run_live(doc, template.template_id, fields, label, routes)
+        rows.append(row)
+    return rows
+
+
+def _run_live(doc, template_id, fields, label, routes):
+    timings = []
+    for routed in (False, True):
+        with tempfile.TemporaryDirectory() as tmp:
+            shutil.copy(doc, Path(tmp) / "code1_output.txt")
+            start = time.perf_counter()
+            if routed:
+                model = classifier.MODEL_TIERS.get(routes[label]["model_tier"])
+                code2.process(tmp, template_id, fields=fields, model=model)
+            else:
+                code2.process(tmp, template_id)
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def print_report(rows):
+    if not rows:
+        print("No code1_output.txt files found")
+        return
+    print(f"\n{'document':30} {'label':22} {'fields':>6} {'tokens unrouted→routed':>24} {'ms unrouted→routed':>20}")
+    for r in rows:
+        print(f"{r['document'][:30]:30} {r['label']:22} {r['fields']:>6} "
+              f"{r['unrouted_tokens']:>11} → {r['routed_tokens']:<10} {r['unrouted_ms']:>9.0f} → {r['routed_ms']:<8.0f}")
+
+    total_unrouted = sum(r["unrouted_ms"] for r in rows) / 1000
+    total_routed = sum(r["routed_ms"] for r in rows) / 1000
+    tokens_unrouted = sum(r["unrouted_tokens"] for r in rows)
+    tokens_routed = sum(r["routed_tokens"] for r in rows)
+    skipped = sum(1 for r in rows if r["routed_tokens"] == 0)
+    print(f"\n📊 {len(rows)} documents, {skipped} skipped the LLM")
+    print(f"   prompt tokens: {tokens_unrouted} → {tokens_routed} "
+          f"({100 * (1 - tokens_routed / max(tokens_unrouted, 1)):.1f}% fewer)")
+    print(f"   throughput: {len(rows) / total_unrouted * 60:.1f} → {len(rows) / max(total_routed, 1e-9) * 60:.1f} docs/min "
+          f"(classifier median {statistics.median(r['classify_ms'] for r in rows):.2f} ms)")
+
+
+# CLI support
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare routed vs unrouted extraction throughput")
+    parser.add_argument("paths", nargs="*", default=[str(BASE_DIR / "samples")])
+    parser.add_argument("--template", default=None)
+    parser.add_argument("--ms-per-1k-tokens", type=float, default=400.0)
+    parser.add_argument("--call-overhead-ms", type=float, default=800.0)
+    parser.add_argument("--live", action="store_true", help="call the real LLM instead of simulating latency")
+    args = parser.parse_args()
+    print_report(compare(args.paths, args.template, args.ms_per_1k_tokens, args.call_overhead_ms, args.live))
@@ -0,0 +1,201 @@
+# backend/classifier.py
+import json
+import math
+import os
+import re
+import sys
+from pathlib import Path
+
+# Allow running as a script (python backend/classifier.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import templates
+
+ROUTING_CONFIG = os.getenv("ROUTING_CONFIG", "")
+MIN_SCORE = float(os.getenv("CLASSIFIER_MIN_SCORE", "2.0"))
+# Routing drops fields, so anything short of a clear winner gets the full extraction:
+# the best label must beat the runner-up by MIN_RATIO, and long texts (often several
+# documents scanned together) are never routed
+MIN_RATIO = float(os.getenv("CLASSIFIER_MIN_RATIO", "1.5"))
+MAX_ROUTED_CHARS = int(os.getenv("CLASSIFIER_MAX_ROUTED_CHARS", "30000"))
+
+# Lexical features per label: (phrase, weight). Phrases are matched case-insensitively.
+KEYWORDS = {
+    "subscription_booklet": [
+        ("subscription agreement", 3), ("subscription booklet", 3), ("subscriber", 1),
+        ("commitment amount", 2), ("accredited investor", 2), ("qualified purchaser", 2),
+        ("qualified client", 2), ("share class", 2), ("limited partnership agreement", 2),
+        ("form pf", 2), ("erisa", 2), ("benefit plan investor", 2), ("finra", 1),
+    ],
+    "tax_form": [
+        ("form w-9", 4), ("form w-8", 4), ("w-8ben", 4), ("w-8ben-e", 4), ("w-9", 2), ("w-8", 2),
+        ("taxpayer identification number", 3), ("internal revenue service", 2),
+        ("backup withholding", 3), ("beneficial owner", 1), ("fatca", 2), ("chapter 3 status", 3),
+    ],
+    "kyc_id": [
+        ("passport", 3), ("driver's license", 3), ("driving licence", 3), ("national id", 3),
+        ("date of birth", 1), ("nationality", 2), ("proof of address", 3), ("utility bill", 3),
+        ("certificate of incorporation", 3), ("memorandum", 2), ("articles of association", 3),
+        ("register of directors", 3), ("register of members", 3), ("beneficial owners", 2),
+        ("politically exposed", 3), ("know your customer", 3), ("kyc", 2), ("incorporated", 1),
+    ],
+    "bank_confirmation": [
+        ("bank confirmation", 4), ("account number", 2), ("iban", 3), ("swift", 3), ("bic", 1),
+        ("aba", 2), ("routing number", 3), ("for further credit", 3), ("wire instructions", 3),
+        ("beneficiary bank", 3), ("account name", 2), ("bank letter", 3),
+    ],
+}
+
+# Label → form sections it can plausibly fill ("*" = every field) and model tier.
+# Section names match any component of a field path in the template.
+DEFAULT_ROUTES = {
+    "subscription_booklet": {"sections": ["*"], "model_tier": "full"},
+    "tax_form": {
+        "sections": [
+            "investorFullLegalName_ID", "Address (Registered)", "Address (Mailing)",
+            "investorEINTAX_ID", "investorSSN_ID", "countryofincorporation/domicile",
+            "Date of Birth", "Investor Eligibility", "Self_certification",
+        ],
+        "model_tier": "light",
+    },
+    "kyc_id": {
+        "sections": [
+            "investorFullLegalName_ID", "Type of Subscriber", "Address (Registered)", "Address (Mailing)",
+            "Date of Birth", "investorInceptionDate_ID", "Entity Representative", "Co-Investor",
+            "InvestorOccupation_ID", "InvestorNatureofbusiness_ID", "principle_place_of_business",
+            "countryofincorporation/domicile", "authorized_signatory_fields_IDs", "PEP_IDs",
+            "Directors_id", "Beneficial_owners_ids",
+        ],
+        "model_tier": "light",
+    },
+    "bank_confirmation": {
+        "sections": ["investorFullLegalName_ID", "Wiring Details", "USD/EUR/GBP_IDs"],
+        "model_tier": "light",
+    },
+    "other": {"sections": [], "model_tier": "light"},
+}
+
+MODEL_TIERS = {
+    "full": os.getenv("LLM_MODEL_FULL", "gpt-4o"),
+    "light": os.getenv("LLM_MODEL_LIGHT", "gpt-4o-mini"),
+}
+
+_PATTERNS = {
+    label: [(re.compile(r"(?<!\w)" + re.escape(phrase) + r"(?!\w)"), weight) for phrase, weight in phrases]
+    for label, phrases in KEYWORDS.items()
+}
+
+
+def load_routes():
+    """Routing table, optionally overridden per label by the JSON file in ROUTING_CONFIG."""
+    routes = {label: dict(route) for label, route in DEFAULT_ROUTES.items()}
+    if ROUTING_CONFIG:
+        with open(ROUTING_CONFIG, "r", encoding="utf-8") as f:
+            for label, route in json.load(f).items():
+                routes.setdefault(label, {"sections": [], "model_tier": "light"}).update(route)
+    return routes
+
+
+def classify_text(text):
+    """
+    Score the document against every label with weighted keyword counts.
+
+    Returns:
+        (label, scores) — label is "other" when no label reaches MIN_SCORE
+    """
+    lowered = text.lower()
+    # Dampen long documents so a booklet's incidental mentions don't dominate short letters
+    length_norm = 1 + math.log10(1 + len(lowered) / 5000)
+    scores = {}
+    for label, patterns in _PATTERNS.items():
+        score = 0.0
+        for pattern, weight in patterns:
+            hits = len(pattern.findall(lowered))
+            if hits:
+                score += weight * (1 + math.log(hits))
+        scores[label] = round(score / length_norm, 3)
+
+    label = max(scores, key=scores.get)
+    if scores[label] < MIN_SCORE:
+        label = "other"
+    return label, scores
+
+
+def fallback_reason(label, scores, text):
+    """Why the classification should not narrow extraction, or None when routing is safe."""
+    if label == "other":
+        return "no label reached the minimum score"
+    runner_up = max((s for l, s in scores.items() if l != label), default=0.0)
+    if runner_up and scores[label] < runner_up * MIN_RATIO:
+        return f"runner-up score {runner_up} too close to {scores[label]}"
+    if len(text) > MAX_ROUTED_CHARS:
+        return f"text longer than {MAX_ROUTED_CHARS} characters"
+    return None
+
+
+def route_fields(label, template, routes=None):
+    """
+    Field paths of `template` a label may fill; None means every field.
+    """
+    routes = routes or load_routes()
+    sections = routes.get(label, routes["other"])["sections"]
+    if "*" in sections:
+        return None
+    return [f["path"] for f in template.fields if any(_in_section(f["path"], s) for s in sections)]
+
+
+def _in_section(path, section):
+    # Section names may themselves contain dots (e.g. "wiringDetails.BankName")
+    wrapped = f".{path}."
+    return f".{section}." in wrapped
+
+
+def process(output_folder, template_id=None):
+    """
+    Classify code1_output.txt and decide which fields and model tier code2 should use.
+
+    Args:
+        output_folder: Folder containing code1_output.txt
+        template_id: form template; defaults to the one bound to the session folder
+    Returns:
+        dict with label, scores, model, fields (None = all fields, [] = skip LLM) and
+        fallback (why a low-confidence label got the full extraction, else None);
+        also saved as classifier_output.json
+    """
+    output_folder = Path(output_folder)
+    input_text_path = output_folder / "code1_output.txt"
+    if not input_text_path.exists():
+        raise FileNotFoundError(f"{input_text_path} not found. Run code1 first.")
+
+    with open(input_text_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    template = templates.get_template(template_id or templates.session_template_id(output_folder.parent))
+    routes = load_routes()
+    label, scores = classify_text(text)
+    fallback = fallback_reason(label, scores, text)
+    if fallback:
+        result = {"label": label, "scores": scores, "model": MODEL_TIERS["full"], "fields": None}
+    else:
+        route = routes.get(label, routes["other"])
+        result = {
+            "label": label,
+            "scores": scores,
+            "model": MODEL_TIERS.get(route["model_tier"], route["model_tier"]),
+            "fields": route_fields(label, template, routes),
+        }
+    result["fallback"] = fallback
+
+    with open(output_folder / "classifier_output.json", "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=4, ensure_ascii=False)
+
+    n_fields = "all" if result["fields"] is None else len(result["fields"])
+    note = f" (full extraction: {fallback})" if fallback else ""
+    print(f"🏷️ Classified as '{label}' → {n_fields} fields, model {result['model']}{note}")
+    return result
+
+
+# CLI support
+if __name__ == "__main__":
+    process(sys.argv[1])
@@ -1,7 +1,22 @@
 # backend/code1.py
-from markitdown import MarkItDown
+import threading
 from pathlib import Path
 
+_converter = None
+_converter_lock = threading.Lock()
+
+def get_converter():
+    """
+    Return a shared MarkItDown instance.
+    markitdown[all] pulls in every converter, so it is imported on first use only.
+    """
+    global _converter
+    with _converter_lock:
+        if _converter is None:
+            from markitdown import MarkItDown
+            _converter = MarkItDown(enable_plugins=False)
+        return _converter
+
 def process(input_file, output_folder):
     """
     Extract text from document and save to code1_output.txt
@@ -14,8 +29,7 @@ def process(input_file, output_folder):
     output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
 
-    md = MarkItDown(enable_plugins=False)
-    result = md.convert(input_file)
+    result = get_converter().convert(input_file)
 
     output_file = output_folder / "code1_output.txt"
     with open(output_file, "w", encoding="utf-8") as f:
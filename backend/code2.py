@@ -1,50 +1,39 @@
 # backend/code2.py
 import os
 import json
+import threading
+import sys
 from pathlib import Path
-from dotenv import load_dotenv
-from openai import OpenAI
 
-def process(output_folder):
-    """
-    Parse code1_output.txt and fill form_keys.json using GPT.
+# Allow running as a script (python backend/codeN.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
 
-    Args:
-        output_folder: Folder containing code1_output.txt
-    Returns:
-        Path to code2_output_filled_form_keys.json
-    """
-    output_folder = Path(output_folder)
-    input_text_path = output_folder / "code1_output.txt"
-    output_file_path = output_folder / "code2_output_filled_form_keys.json"
-    
-    if not input_text_path.exists():
-        raise FileNotFoundError(f"{input_text_path} not found. Run code1 first.")
-    
-    # Load input text
-    with open(input_text_path, "r", encoding="utf-8") as f:
-        document_text = f.read()
-    
-    # Load form keys
-    form_keys_path = Path(__file__).parent.parent / "form_keys.json"
-    with open(form_keys_path, "r", encoding="utf-8") as f:
-        form_keys = json.load(f)
-    
-    # Flatten fields for GPT (path + description)
-    def collect_fields(form_dict, parent=""):
-        fields = []
-        for k, v in form_dict.items():
-            path = f"{parent}.{k}" if parent else k
-            if isinstance(v, dict) and "description" in v and "value" in v:
-                fields.append({"path": path, "description": v["description"]})
-            elif isinstance(v, dict):
-                fields.extend(collect_fields(v, path))
-        return fields
+from backend import deadlines, scheduler, templates
 
-    field_descriptions = collect_fields(form_keys)
+_client = None
+_client_lock = threading.Lock()
 
-    # === SUPER OPTIMIZED GPT PROMPT === #
-    prompt = f"""
+def get_client():
+    """
+    Return a shared OpenAI client, importing openai/dotenv on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            from dotenv import load_dotenv
+            from openai import OpenAI
+            load_dotenv()
+            # Per-attempt I/O timeout; the whole call is also bounded by deadlines.LLM_TIMEOUT
+            _client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), timeout=deadlines.LLM_TIMEOUT,
+                             max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")))
+        return _client
+
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gpt-4o")
+OUTPUT_FILE = "code2_output.json"
+
+# === SUPER OPTIMIZED GPT PROMPT === #
+PROMPT_TEMPLATE = """
 You are given:
 1. A markdown text extracted from a scanned investment subscription document.
 2. A list of fields with descriptions from a standardized subscription form.
@@ -73,36 +62,104 @@ Markdown Text:
 ---
 
 Field Descriptions:
-"""
+{field_block}"""
 
-    for field in field_descriptions:
-        prompt += f'- {field["path"]}: {field["description"]}\n'
 
-    # === OpenAI Call ===
-    load_dotenv()
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+def estimate_tokens(text):
+    """Token count for `text` (tiktoken when installed, ~4 chars/token otherwise)."""
+    try:
+        import tiktoken
+        return len(tiktoken.get_encoding("o200k_base").encode(text))
+    except ImportError:
+        return max(1, len(text) // 4)
 
-    response = client.chat.completions.create(
-        model="gpt-4o",  # Change if needed
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0,
-        response_format={"type": "json_object"}
-    )
 
-    content = response.choices[0].message.content.strip()
-    try:
-        extracted_values = json.loads(content)
-    except json.JSONDecodeError as e:
-        print("❌ GPT response invalid JSON:", e)
-        print("Raw:", content)
-        raise
+def build_prompt(document_text, template, fields=None):
+    """Prompt for the given document; `fields` restricts the field list (None = all fields)."""
+    field_block = template.prompt_block if fields is None else template.prompt_block_for(fields)
+    return PROMPT_TEMPLATE.format(document_text=document_text, field_block=field_block)
+
+
+def process(output_folder, template_id=None, fields=None, model=None, known_values=None,
+            known_method="profile", document_text=None):
+    """
+    Parse code1_output.txt and fill form_keys.json using GPT.
+
+    Args:
+        output_folder: Folder containing code1_output.txt
+        template_id: form template to fill; defaults to the one bound to the session folder
+        fields: field paths to ask the LLM for (None = all; empty = skip the LLM call)
+        model: model name for the call (defaults to LLM_MODEL / gpt-4o)
+        known_values: {path: value} already known (e.g. investor profile); prefilled and not asked
+        known_method: extraction method recorded on prefilled fields
+        document_text: text to send instead of code1_output.txt (e.g. only the changed hunks)
+    Returns:
+        Path to code2_output.json
+    """
+    output_folder = Path(output_folder)
+    input_text_path = output_folder / "code1_output.txt"
+    output_file_path = output_folder / OUTPUT_FILE
+    
+    if not input_text_path.exists():
+        raise FileNotFoundError(f"{input_text_path} not found. Run code1 first.")
+    
+    # Load input text
+    if document_text is None:
+        with open(input_text_path, "r", encoding="utf-8") as f:
+            document_text = f.read()
+    
+    # Compiled template (schema + field-description block cached per template)
+    template = templates.get_template(template_id or templates.session_template_id(output_folder.parent))
+    form_keys = template.new_form()
+
+    known_values = known_values or {}
+    if known_values:
+        pool = [f["path"] for f in template.fields] if fields is None else fields
+        fields = [path for path in pool if path not in known_values]
+
+    if fields is not None and not fields:
+        print("⏭️ No relevant fields for this document → skipping LLM call")
+        extracted_values = {}
+    else:
+        prompt = build_prompt(document_text, template, fields)
+        # Per-tenant LLM token budget (raises scheduler.BudgetExceeded before spending anything)
+        estimated = estimate_tokens(prompt)
+        scheduler.charge(estimated)
+
+        # === OpenAI Call ===
+        client = get_client()
+
+        def record(response):
+            usage = getattr(response, "usage", None)
+            scheduler.record_usage(estimated, getattr(usage, "total_tokens", None))
+
+        # An abandoned call (deadline / cancel) ends on the client's own I/O timeout;
+        # if it still completes, its tokens are charged to the tenant then
+        response = deadlines.call_with_deadline(lambda: client.chat.completions.create(
+            model=model or DEFAULT_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0,
+            response_format={"type": "json_object"}
+        ), deadlines.LLM_TIMEOUT, "code2", on_abandoned_result=record)
+        record(response)
+
+        content = response.choices[0].message.content.strip()
+        try:
+            extracted_values = json.loads(content)
+        except json.JSONDecodeError as e:
+            print("❌ GPT response invalid JSON:", e)
+            print("Raw:", content)
+            raise
 
     # Apply values back to form_keys
     def apply_values(form_dict, values, parent=""):
         for k, v in form_dict.items():
             path = f"{parent}.{k}" if parent else k
-            if isinstance(v, dict) and "description" in v and "value" in v:
+            if isinstance(v, dict) and "value" in v:
                 v["value"] = values.get(path, "")
+                if not v["value"] and known_values.get(path):
+                    v["value"] = known_values[path]
+                    v["method"] = known_method
             elif isinstance(v, dict):
                 apply_values(v, values, path)
 
@@ -116,5 +173,4 @@ Field Descriptions:
 
 # Subprocess compatible
 if __name__ == "__main__":
-    import sys
     process(sys.argv[1])
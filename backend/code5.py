@@ -1,14 +1,67 @@
 # backend/code5.py
 import json
+import sys
 from pathlib import Path
 
-def process(output_folder, investor_type):
+# Allow running as a script (python backend/codeN.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import templates
+
+DEFAULT_INVESTOR_TYPE = "Trade Booking (Initial Subs)"
+
+# "Type of Subscriber" check field → investor type in mandatory.json
+SUBSCRIBER_TYPES = {
+    "individualcheck_ID": "Individual",
+    "jointtenantscheck_ID": "Individual",
+    "corporationcheck_ID": "Corporation/LLC",
+    "limitedliabilitycompanycheck_ID": "Corporation/LLC",
+    "trustcheck_ID": "Trust/Non-Profit Organisations",
+    "partenershipcheck_ID": "Partnership",
+    "fundsoffundscheck_ID": "Fund/Fund of Funds",
+    "IndividualRetirementAccount_ID": "IRA",
+    "keoghplancheck_ID": "IRA",
+}
+
+
+def _checked(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "y", "x", "1", "checked")
+    return bool(value)
+
+
+def _find_group(node, name):
+    """First nested dict stored under key `name` (sections nest the form)."""
+    if not isinstance(node, dict):
+        return None
+    if isinstance(node.get(name), dict):
+        return node[name]
+    for child in node.values():
+        found = _find_group(child, name)
+        if found is not None:
+            return found
+    return None
+
+
+def infer_investor_type(form_filled, known_types):
+    """Investor type from the ticked "Type of Subscriber" box; DEFAULT_INVESTOR_TYPE if none maps."""
+    for key, node in (_find_group(form_filled, "Type of Subscriber") or {}).items():
+        investor_type = SUBSCRIBER_TYPES.get(key)
+        if investor_type in known_types and isinstance(node, dict) and _checked(node.get("value")):
+            return investor_type
+    return DEFAULT_INVESTOR_TYPE
+
+
+def process(output_folder, investor_type=None, template_id=None):
     """
     Extract mandatory fields from filled form and map values according to mandatory.json
 
     Args:
         output_folder: folder containing code2_output.json (filled form)
-        investor_type: string, one of keys from mandatory.json["Type of Investors"]
+        investor_type: string, one of keys from mandatory.json["Type of Investors"];
+            None infers it from the form's "Type of Subscriber" (no prompt)
+        template_id: form template; defaults to the one bound to the session folder
 
     Returns:
         Path to code5_output_mandatory_form_key_mapping.json
@@ -16,15 +69,9 @@ def process(output_folder, investor_type):
     output_folder = Path(output_folder)
     output_file = output_folder / "code5_output_mandatory_form_key_mapping.json"
 
-    # Load mandatory.json
-    mandatory_file = Path("mandatory.json")
-    with open(mandatory_file, "r", encoding="utf-8") as f:
-        mandatory_data = json.load(f)["Type of Investors"]
-
-    if investor_type not in mandatory_data:
-        raise ValueError(f"Investor type '{investor_type}' not found in mandatory.json")
-
-    mandatory_fields = mandatory_data[investor_type]
+    # Load mandatory.json of the session's template
+    template = templates.get_template(template_id or templates.session_template_id(output_folder.parent))
+    mandatory_data = template.mandatory.get("Type of Investors", {})
 
     # Load filled form (from code2_output.json)
     form_filled_file = output_folder / "code2_output.json"
@@ -34,6 +81,14 @@ def process(output_folder, investor_type):
     with open(form_filled_file, "r", encoding="utf-8") as f:
         form_filled = json.load(f)
 
+    if investor_type is None:
+        investor_type = infer_investor_type(form_filled, mandatory_data)
+        print(f"🔹 Investor type inferred from the form: {investor_type}")
+    if investor_type not in mandatory_data:
+        raise ValueError(f"Investor type '{investor_type}' not found in mandatory.json")
+
+    mandatory_fields = mandatory_data[investor_type]
+
     # Recursive function to map mandatory keys to filled values
     def map_mandatory(mand_node, form_node):
         result = {}
@@ -44,10 +99,10 @@ def process(output_folder, investor_type):
             else:
                 # val is either "" or a string pointing to form_keys key
                 if isinstance(val, str) and val != "":
-                    # Handle nested keys with dot notation
+                    # Handle nested keys with dot notation, below whichever section holds them
                     keys = val.split(".")
-                    temp = form_node
-                    for k in keys:
+                    temp = _find_group(form_node, keys[0]) or {}
+                    for k in keys[1:]:
                         temp = temp.get(k, {})
                     value = temp.get("value", "")
                     result[key] = {"value": value}
@@ -68,7 +123,6 @@ def process(output_folder, investor_type):
 
 # CLI support
 if __name__ == "__main__":
-    import sys
     folder = sys.argv[1]
-    investor_type = sys.argv[2]
+    investor_type = sys.argv[2] if len(sys.argv) > 2 else None
     process(folder, investor_type)
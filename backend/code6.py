@@ -1,7 +1,6 @@
 # backend/code6.py
 import json
 from pathlib import Path
-import shutil
 from collections import defaultdict
 
 def update_form(filled_form, form_key, value):
@@ -139,13 +138,7 @@ def process(doc_folder):
     with open(code6_file, "w", encoding="utf-8") as f:
         json.dump(combined_data, f, indent=4, ensure_ascii=False)
     print(f"✅ Mandatory + optional fields saved → {code6_file.name}")
-
-    # Save session-level JSON if first document
-    session_folder = doc_folder.parent
-    session_final = session_folder / f"final_{session_folder.name}_form_keys_filled.json"
-    if not session_final.exists():
-        shutil.copy(code6_file, session_final)
-        print(f"🆕 First document → session-level form created at {session_final.name}")
+    # The session-level JSON is created by code7 when this document is merged
 
 # CLI support
 if __name__ == "__main__":
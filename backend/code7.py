@@ -1,22 +1,150 @@
 # backend/code7.py
+import copy
 import json
+import sys
 from pathlib import Path
 from typing import Optional
 
-def merge_pdf_into_session(new_pdf_folder: str, session_json_file: str, override: Optional[bool] = None):
+# Allow running as a script (python backend/code7.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import versions
+
+# Default confidence per extraction method (a field node may carry its own "confidence")
+METHOD_CONFIDENCE = {"user": 1.0, "rule": 0.9, "profile": 0.8, "llm": 0.7}
+POLICIES = ("confidence", "latest", "first")
+LEGACY_DOCUMENT = "_legacy_session"
+
+
+def provenance_path(session_json_file) -> Path:
+    """Sidecar file holding per-field provenance for a session JSON."""
+    session_json_file = Path(session_json_file)
+    return session_json_file.with_name(f"{session_json_file.stem}_provenance.json")
+
+
+def iter_value_nodes(form, parent=""):
+    """Yield (path, node) for every {"value": ...} leaf of a nested form."""
+    for k, v in form.items():
+        path = f"{parent}.{k}" if parent else k
+        if isinstance(v, dict) and "value" in v:
+            yield path, v
+        elif isinstance(v, dict):
+            yield from iter_value_nodes(v, path)
+
+
+def _add_missing_keys(target, source):
+    """Copy keys present in source but absent in target (structure only, values reset)."""
+    for k, v in source.items():
+        if k not in target:
+            target[k] = copy.deepcopy(v)
+            for _, node in iter_value_nodes({k: target[k]}):
+                node["value"] = ""
+        elif isinstance(v, dict) and isinstance(target[k], dict) and "value" not in v:
+            _add_missing_keys(target[k], v)
+
+
+def _resolve(candidates, policy):
+    """Pick the winning candidate for a field under the given merge policy."""
+    if not candidates:
+        return None
+    if policy == "first":
+        return min(candidates, key=lambda c: c["seq"])
+    if policy == "latest":
+        return max(candidates, key=lambda c: c["seq"])
+    return max(candidates, key=lambda c: (c["confidence"], c["seq"]))
+
+
+def _load_provenance(session_json_file, session_data):
+    prov_file = provenance_path(session_json_file)
+    if prov_file.exists():
+        with open(prov_file, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    # Session created before provenance tracking: treat its values as one user-confirmed source
+    provenance = {"seq": 0, "policy": "confidence", "policies": {}, "fields": {}}
+    if session_data is not None:
+        provenance["seq"] = 1
+        for path, node in iter_value_nodes(session_data):
+            if node.get("value"):
+                provenance["fields"][path] = [{
+                    "document": LEGACY_DOCUMENT, "method": "user",
+                    "confidence": METHOD_CONFIDENCE["user"], "value": node["value"], "seq": 1,
+                }]
+    return provenance
+
+
+def _save(session_json_file, session_data, provenance, changed):
+    session_json_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(session_json_file, "w", encoding="utf-8") as f:
+        json.dump(session_data, f, indent=4, ensure_ascii=False)
+    with open(provenance_path(session_json_file), "w", encoding="utf-8") as f:
+        json.dump(provenance, f, indent=4, ensure_ascii=False)
+    # Session version (ETags / ?since= deltas) moves with every write of the session JSON
+    return versions.bump(session_json_file.parent, changed)
+
+
+def _field_policy(provenance, path):
+    """Policy a field was last merged under (sessions from before per-field policies: the session's)."""
+    return provenance.get("policies", {}).get(path) or provenance.get("policy", "confidence")
+
+
+def _recompute(session_data, provenance, paths, policy=None):
+    """
+    Re-resolve only the given field paths; returns the paths whose value changed.
+    An explicit policy is recorded for those fields; otherwise each keeps its own.
+    """
+    nodes = dict(iter_value_nodes(session_data))
+    policies = provenance.setdefault("policies", {})
+    changed = []
+    for path in paths:
+        node = nodes.get(path)
+        if node is None:
+            continue
+        if policy is not None:
+            policies[path] = policy
+        winner = _resolve(provenance["fields"].get(path, []), _field_policy(provenance, path))
+        value = winner["value"] if winner else ""
+        if node.get("value") != value:
+            node["value"] = value
+            changed.append(path)
+    return changed
+
+
+def merge_pdf_into_session(new_pdf_folder: str, session_json_file: str, override: Optional[bool] = None,
+                           policy: Optional[str] = None, method: str = "llm",
+                           confidence: Optional[float] = None):
     """
     Merge a newly processed PDF into session-level final JSON.
 
+    Every non-empty value is recorded in a provenance sidecar
+    (final_{session}_form_keys_filled_provenance.json) with its source document,
+    extraction method and confidence. Only fields this document contributes are
+    re-resolved, so re-processing a document replaces its own contributions
+    without re-merging the rest of the session; it keeps its original place
+    (seq) in the merge order. The policy is recorded per field it resolved, so
+    a later merge under another policy leaves the other fields as they were.
+
     Rules:
     1. Empty keys in session → auto-fill from new doc
-    2. Conflicting keys → override depends on 'override' flag:
-       - If override=True → always override conflicting values
-       - If override=False → always preserve session values
+    2. Conflicting keys → resolved by 'policy':
+       - "confidence" → highest confidence wins (latest on ties)
+       - "latest" → newest contribution wins
+       - "first" → earliest contribution wins
+       If policy is None it follows the 'override' flag:
+       - If override=True → "latest" (always override conflicting values)
+       - If override=False → "first" (always preserve session values)
        - If override=None → ask the user once per document
+
+    Returns:
+        list of field paths whose session value changed
     """
     new_pdf_folder = Path(new_pdf_folder)
     session_json_file = Path(session_json_file)
 
+    if policy is not None and policy not in POLICIES:
+        raise ValueError(f"Unknown merge policy '{policy}', expected one of {POLICIES}")
+
     # Pick the correct JSON: final_output from code6
     new_file = new_pdf_folder / "final_output_form_keys_filled.json"
     if not new_file.exists():
@@ -29,89 +157,149 @@ def merge_pdf_into_session(new_pdf_folder: str, session_json_file: str, override
     with open(new_file, "r", encoding="utf-8") as f:
         new_pdf_data = json.load(f)
 
-    # If session JSON exists, merge into it
-    if session_json_file.exists():
+    first_document = not session_json_file.exists()
+    if first_document:
+        session_data = copy.deepcopy(new_pdf_data)
+        for _, node in iter_value_nodes(session_data):
+            node["value"] = ""
+    else:
         with open(session_json_file, "r", encoding="utf-8") as f:
             session_data = json.load(f)
 
-        # Detect conflicts
-        conflicts_exist = False
-
-        def detect_conflicts(target, source):
-            nonlocal conflicts_exist
-            for k, v in source.items():
-                if k in target:
-                    if isinstance(v, dict) and "value" in v:
-                        if target[k].get("value") and v.get("value") and target[k]["value"] != v["value"]:
-                            conflicts_exist = True
-                    elif isinstance(v, dict):
-                        detect_conflicts(target[k], v)
-
-        detect_conflicts(session_data, new_pdf_data)
-
-        # Ask user if override not provided
-        if override is None and conflicts_exist:
-            while True:
-                choice = input(
-                    "\n⚠️ Conflicting keys detected! "
-                    "Do you want to override session values with new document's values? (yes/no): "
-                ).strip().lower()
-                if choice in ["yes", "y", "no", "n"]:
-                    override_conflicts = choice in ["yes", "y"]
-                    break
-                print("❌ Invalid input, please type 'yes' or 'no'.")
+    provenance = _load_provenance(session_json_file, None if first_document else session_data)
+    document = new_pdf_folder.name
+
+    # Drop this document's previous contributions (re-processing), remembering its place
+    previous = [c["seq"] for candidates in provenance["fields"].values()
+                for c in candidates if c["document"] == document]
+    touched = set()
+    for path, candidates in provenance["fields"].items():
+        kept = [c for c in candidates if c["document"] != document]
+        if len(kept) != len(candidates):
+            provenance["fields"][path] = kept
+            touched.add(path)
+    if previous:
+        seq = min(previous)
+    else:
+        provenance["seq"] += 1
+        seq = provenance["seq"]
+
+    # Record new contributions
+    new_values = {}
+    for path, node in iter_value_nodes(new_pdf_data):
+        if not node.get("value"):
+            continue
+        node_method = node.get("method", method)
+        new_values[path] = node["value"]
+        provenance["fields"].setdefault(path, []).append({
+            "document": document,
+            "method": node_method,
+            "confidence": float(node.get("confidence", confidence if confidence is not None
+                                         else METHOD_CONFIDENCE.get(node_method, 0.5))),
+            "value": node["value"],
+            "seq": seq,
+        })
+        touched.add(path)
+
+    if policy is None:
+        if override is True:
+            policy = "latest"
+        elif override is False:
+            policy = "first"
         else:
-            override_conflicts = override if override is not None else True
-
-        # Merge logic
-        def merge_dicts(target, source):
-            for k, v in source.items():
-                if k in target:
-                    if isinstance(v, dict) and "value" in v:
-                        existing_val = target[k].get("value")
-                        new_val = v.get("value")
-                        # Empty session → fill
-                        if not existing_val and new_val:
-                            target[k]["value"] = new_val
-                        # Conflict → decide based on override
-                        elif existing_val and new_val and existing_val != new_val:
-                            if override_conflicts:
-                                target[k]["value"] = new_val
-                    elif isinstance(v, dict):
-                        merge_dicts(target[k], v)
-                else:
-                    target[k] = v  # new key, add directly
-
-        merge_dicts(session_data, new_pdf_data)
-
-        # Save merged session JSON
-        with open(session_json_file, "w", encoding="utf-8") as f:
-            json.dump(session_data, f, indent=4, ensure_ascii=False)
-        print(f"✅ Merged '{new_pdf_folder.name}' into session JSON: {session_json_file.name}")
+            current = dict(iter_value_nodes(session_data))
+            conflicts_exist = any(
+                path in current and current[path].get("value") and current[path]["value"] != value
+                for path, value in new_values.items()
+            )
+            policy = "confidence"
+            if conflicts_exist:
+                while True:
+                    choice = input(
+                        "\n⚠️ Conflicting keys detected! "
+                        "Do you want to override session values with new document's values? (yes/no): "
+                    ).strip().lower()
+                    if choice in ["yes", "y", "no", "n"]:
+                        policy = "latest" if choice in ["yes", "y"] else "first"
+                        break
+                    print("❌ Invalid input, please type 'yes' or 'no'.")
 
+    _add_missing_keys(session_data, new_pdf_data)
+    changed = _recompute(session_data, provenance, sorted(touched), policy)
+
+    version = _save(session_json_file, session_data, provenance, changed)
+    if first_document:
+        print(f"🆕 Created session JSON from '{document}': {session_json_file.name}")
     else:
-        # First document → create session JSON
-        session_json_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(session_json_file, "w", encoding="utf-8") as f:
-            json.dump(new_pdf_data, f, indent=4, ensure_ascii=False)
-        print(f"🆕 Created session JSON from '{new_pdf_folder.name}': {session_json_file.name}")
+        print(f"✅ Merged '{document}' into session JSON: {session_json_file.name} "
+              f"({len(changed)} fields changed, policy={policy}, version {version})")
+    return changed
+
+
+def remove_document_from_session(document: str, session_json_file: str, policy: Optional[str] = None):
+    """
+    Withdraw one document's contributions and re-resolve only the fields it supplied,
+    each under the policy it was last merged with (or `policy` if given).
+
+    Returns:
+        list of field paths whose session value changed
+    """
+    session_json_file = Path(session_json_file)
+    if not session_json_file.exists():
+        return []
+
+    with open(session_json_file, "r", encoding="utf-8") as f:
+        session_data = json.load(f)
+    provenance = _load_provenance(session_json_file, session_data)
+    if policy is not None and policy not in POLICIES:
+        raise ValueError(f"Unknown merge policy '{policy}', expected one of {POLICIES}")
+
+    touched = []
+    for path, candidates in provenance["fields"].items():
+        kept = [c for c in candidates if c["document"] != document]
+        if len(kept) != len(candidates):
+            provenance["fields"][path] = kept
+            touched.append(path)
+
+    changed = _recompute(session_data, provenance, touched, policy)
+    _save(session_json_file, session_data, provenance, changed)
+    print(f"🗑️ Removed '{document}' from session JSON: {len(changed)} fields recomputed")
+    return changed
+
+
+def get_field_provenance(session_json_file: str):
+    """Return {path: {"value", "source": winning candidate, "candidates": [...]}} for a session."""
+    session_json_file = Path(session_json_file)
+    if not session_json_file.exists():
+        return {}
+    with open(session_json_file, "r", encoding="utf-8") as f:
+        session_data = json.load(f)
+    provenance = _load_provenance(session_json_file, session_data)
+    return {
+        path: {"value": node.get("value", ""),
+               "policy": _field_policy(provenance, path),
+               "source": _resolve(provenance["fields"].get(path, []), _field_policy(provenance, path)),
+               "candidates": provenance["fields"].get(path, [])}
+        for path, node in iter_value_nodes(session_data)
+    }
 
 
 # CLI support for subprocess
 if __name__ == "__main__":
-    import sys
     if len(sys.argv) < 3:
-        print("Usage: python code7.py <new_pdf_folder> <session_json_file> [override: yes/no]")
+        print("Usage: python code7.py <new_pdf_folder> <session_json_file> [override: yes/no | policy]")
         sys.exit(1)
 
     new_pdf_folder = sys.argv[1]
     session_json_file = sys.argv[2]
     override_arg = sys.argv[3].lower() if len(sys.argv) > 3 else None
+    override_flag = None
+    policy_arg = None
     if override_arg in ["yes", "y"]:
         override_flag = True
     elif override_arg in ["no", "n"]:
         override_flag = False
-    else:
-        override_flag = None
+    elif override_arg in POLICIES:
+        policy_arg = override_arg
 
-    merge_pdf_into_session(new_pdf_folder, session_json_file, override_flag)
+    merge_pdf_into_session(new_pdf_folder, session_json_file, override_flag, policy_arg)
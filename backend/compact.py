@@ -0,0 +1,191 @@
+# backend/compact.py
+import json
+import os
+import re
+import sys
+from collections import Counter
+from pathlib import Path
+
+# Allow running as a script (python backend/compact.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import code2
+
+BOILERPLATE_CONFIG = os.getenv("BOILERPLATE_CONFIG", "")
+REPEAT_MIN = int(os.getenv("COMPACTION_REPEAT_MIN", "3"))
+OUTPUT_FILE = "code1_output_compact.txt"
+
+# Boilerplate paragraphs (case-insensitive); extend with a JSON list of regexes in BOILERPLATE_CONFIG.
+DEFAULT_BOILERPLATE = [
+    r"\bdocusign envelope id\b",
+    r"\ball rights reserved\b",
+    r"\bfor internal use only\b",
+    r"\bthis (?:document|communication|e-?mail)\b.{0,80}\b(?:confidential|privileged)\b",
+    r"\bthe information contained (?:herein|in this (?:document|communication))\b",
+]
+
+# Repeated-line detection only considers short lines without values: "Label: value" lines,
+# table rows and checkboxes are never dropped, even when repeated verbatim. Lines are
+# compared exactly (page numbers are removed separately, before this step).
+_MAX_REPEAT_LEN = 120
+_MIN_REPEAT_LEN = 4
+_PAGE_NUMBER = re.compile(r"^(?:-\s*\d{1,4}\s*-|page\s+\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?|\d{1,4}\s*(?:of|/)\s*\d{1,4})$",
+                          re.IGNORECASE)
+_CHECKBOX = re.compile(r"[☐☑☒✓✔✗✘]|\[[ xX]\]")
+_TABLE_SEPARATOR = re.compile(r"^:?-{3,}:?$")
+_FIELD_LINE = re.compile(r"^[^:|]{1,40}:\s*\S")
+
+
+def load_patterns():
+    """Boilerplate patterns: defaults plus the JSON list in BOILERPLATE_CONFIG."""
+    patterns = list(DEFAULT_BOILERPLATE)
+    if BOILERPLATE_CONFIG:
+        with open(BOILERPLATE_CONFIG, "r", encoding="utf-8") as f:
+            patterns += json.load(f)
+    return [re.compile(p, re.IGNORECASE) for p in patterns]
+
+
+def _repeat_key(line):
+    # Lines are already whitespace-normalized; digits are kept so distinct values never collide
+    return line.lower()
+
+
+def _repeatable(line):
+    return _MIN_REPEAT_LEN <= len(line) <= _MAX_REPEAT_LEN and not _carries_values(line)
+
+
+def _carries_values(line):
+    return bool(line.startswith("|") or _CHECKBOX.search(line) or _FIELD_LINE.match(line))
+
+
+def _compact_table(rows):
+    """Strip cell padding, drop empty rows and columns that are empty in every row."""
+    cells = [[c.strip() for c in row.strip().strip("|").split("|")] for row in rows]
+    width = max(len(r) for r in cells)
+    cells = [r + [""] * (width - len(r)) for r in cells]
+    is_sep = [all(_TABLE_SEPARATOR.match(c) or not c for c in r) and any(r) for r in cells]
+    keep_cols = [i for i in range(width) if any(r[i] for r, sep in zip(cells, is_sep) if not sep)]
+    out = []
+    for r, sep in zip(cells, is_sep):
+        if sep:
+            out.append("|" + "|".join("---" for _ in keep_cols) + "|")
+        elif any(r[i] for i in keep_cols):
+            out.append("| " + " | ".join(r[i] for i in keep_cols) + " |")
+    return out, len(rows) - len(out)
+
+
+def compact_text(text, patterns=None):
+    """
+    Deterministically shrink code1 markdown without touching value-bearing text.
+
+    Returns:
+        (compacted text, {rule: lines removed})
+    """
+    patterns = load_patterns() if patterns is None else patterns
+    removed = Counter()
+
+    # 1. Whitespace: collapse runs of spaces/tabs, strip line ends
+    pages = [[re.sub(r"[ \t ]+", " ", line).strip() for line in page.split("\n")]
+             for page in text.split("\f")]
+
+    # 2. Page numbers
+    for page in pages:
+        for i, line in enumerate(page):
+            if line and _PAGE_NUMBER.match(line):
+                page[i] = ""
+                removed["page_numbers"] += 1
+
+    # 3. Lines repeated across pages (headers/footers); a single page counts occurrences instead
+    counts = Counter()
+    for page in pages:
+        keys = [_repeat_key(line) for line in page if _repeatable(line)]
+        counts.update(set(keys) if len(pages) > 1 else keys)
+    seen = set()
+    lines = []
+    for page in pages:
+        for line in page:
+            if _repeatable(line) and counts[_repeat_key(line)] >= REPEAT_MIN:
+                key = _repeat_key(line)
+                if key in seen:
+                    removed["repeated_lines"] += 1
+                    continue
+                seen.add(key)
+            lines.append(line)
+
+    # 4. Markdown tables
+    out, table = [], []
+    for line in lines + [""]:
+        if line.startswith("|"):
+            table.append(line)
+            continue
+        if table:
+            rows, dropped = _compact_table(table)
+            out += rows
+            removed["table_rows"] += dropped
+            table = []
+        out.append(line)
+    out.pop()
+
+    # 5. Boilerplate paragraphs, then blank-line runs. A matching paragraph that
+    #    also holds "Label: value" lines, table rows or checkboxes only loses the matching lines.
+    paragraphs = re.split(r"\n\s*\n", "\n".join(out))
+    kept = []
+    for para in paragraphs:
+        para = para.strip("\n")
+        if not para.strip():
+            continue
+        if any(p.search(para) for p in patterns):
+            para_lines = para.split("\n")
+            if not any(_carries_values(line) for line in para_lines):
+                removed["boilerplate"] += len(para_lines)
+                continue
+            para_lines = [line for line in para_lines if not any(p.search(line) for p in patterns)]
+            removed["boilerplate"] += para.count("\n") + 1 - len(para_lines)
+            para = "\n".join(para_lines)
+            if not para.strip():
+                continue
+        kept.append(para)
+    return "\n\n".join(kept) + "\n", dict(removed)
+
+
+def process(output_folder):
+    """
+    Compact code1_output.txt for the LLM prompt.
+
+    Args:
+        output_folder: Folder containing code1_output.txt
+    Returns:
+        dict with the compacted text and token stats; the text is saved as
+        code1_output_compact.txt and the stats as compaction_stats.json
+    """
+    output_folder = Path(output_folder)
+    input_text_path = output_folder / "code1_output.txt"
+    if not input_text_path.exists():
+        raise FileNotFoundError(f"{input_text_path} not found. Run code1 first.")
+
+    with open(input_text_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    compacted, removed = compact_text(text)
+    stats = {
+        "chars_before": len(text),
+        "chars_after": len(compacted),
+        "tokens_before": code2.estimate_tokens(text),
+        "tokens_after": code2.estimate_tokens(compacted),
+        "removed": removed,
+    }
+
+    with open(output_folder / OUTPUT_FILE, "w", encoding="utf-8") as f:
+        f.write(compacted)
+    with open(output_folder / "compaction_stats.json", "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=4, ensure_ascii=False)
+
+    saved = 1 - stats["tokens_after"] / max(stats["tokens_before"], 1)
+    print(f"🗜️ Compacted prompt text: {stats['tokens_before']} → {stats['tokens_after']} tokens (-{saved:.0%})")
+    return {"text": compacted, **stats}
+
+
+# CLI support
+if __name__ == "__main__":
+    process(sys.argv[1])
@@ -0,0 +1,247 @@
+# backend/deadlines.py
+import contextvars
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+CONVERT_TIMEOUT = float(os.getenv("CONVERT_TIMEOUT", "300"))  # 0 = convert in-process, no deadline
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+POLL_INTERVAL = 0.25
+
+# Cancellation is cooperative: the job runner installs a threading.Event with
+# cancel_scope(), stages call check() at their boundaries, and the waits below
+# (child-process conversion, LLM call) poll it so a cancelled job lets go of its
+# worker within POLL_INTERVAL even in the middle of a stage. Conversion children are
+# kept warm (run_in_warm_process): the converter is built once per child, and a
+# child is only replaced after it was killed.
+
+_cancel_event = contextvars.ContextVar("cancel_event", default=None)
+
+
+class StageTimeout(Exception):
+    def __init__(self, stage, timeout):
+        super().__init__(f"Stage '{stage}' exceeded its {timeout:g}s deadline")
+        self.stage = stage
+        self.timeout = timeout
+
+
+class Cancelled(Exception):
+    pass
+
+
+@contextmanager
+def cancel_scope(event):
+    """Make `event` the cancellation signal for pipeline code run in this block."""
+    token = _cancel_event.set(event)
+    try:
+        yield event
+    finally:
+        _cancel_event.reset(token)
+
+
+def cancelled():
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def check():
+    """Raise Cancelled if the current job was cancelled."""
+    if cancelled():
+        raise Cancelled("Job cancelled")
+
+
+def _wait(is_done, timeout, stage):
+    """Poll until is_done(), raising Cancelled / StageTimeout; timeout <= 0 waits forever."""
+    event = _cancel_event.get()
+    waited = 0.0
+    while not is_done(POLL_INTERVAL):
+        if event is not None and event.is_set():
+            raise Cancelled(f"Job cancelled during '{stage}'")
+        waited += POLL_INTERVAL
+        if 0 < timeout <= waited:
+            raise StageTimeout(stage, timeout)
+
+
+def call_with_deadline(fn, timeout, stage, on_abandoned_result=None):
+    """
+    Run fn() in a helper thread and wait at most `timeout` seconds (cancellable).
+    On timeout or cancellation the thread is abandoned; fn must carry its own I/O
+    timeout (pass it to the OpenAI call) so it ends soon after. If it still returns
+    a result, on_abandoned_result(result) is called from the helper thread (in the
+    caller's context), e.g. to charge the tokens it used.
+    """
+    done = threading.Event()
+    lock = threading.Lock()
+    outcome = {}
+
+    def target():
+        try:
+            result = fn()
+        except BaseException as e:
+            outcome["error"] = e
+            done.set()
+            return
+        with lock:
+            outcome["result"] = result
+            abandoned = outcome.get("abandoned", False)
+        done.set()
+        if abandoned and on_abandoned_result is not None:
+            try:
+                on_abandoned_result(result)
+            except Exception as e:
+                print(f"⚠️ {stage}: could not handle a late result: {e}")
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(target,), name=f"{stage}-call", daemon=True).start()
+    try:
+        _wait(done.wait, timeout, stage)
+    except (Cancelled, StageTimeout):
+        with lock:
+            outcome["abandoned"] = "result" not in outcome
+            late = outcome.get("result") if not outcome["abandoned"] else None
+        if late is not None and on_abandoned_result is not None:
+            on_abandoned_result(late)  # finished between the last poll and now
+        raise
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+_context = None
+_context_lock = threading.Lock()
+
+
+def mp_context():
+    # forkserver forks children from a clean single-threaded server with the converter
+    # modules preloaded, so isolation costs a fork rather than a fresh interpreter
+    global _context
+    with _context_lock:
+        if _context is None:
+            methods = multiprocessing.get_all_start_methods()
+            _context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if "forkserver" in methods:
+                _context.set_forkserver_preload(["backend.code1", "backend.ocr", "markitdown"])
+        return _context
+
+
+def cpu_seconds():
+    """CPU time of this process plus its reaped children (e.g. a tesseract binary)."""
+    times = os.times()
+    return time.process_time() + times.children_user + times.children_system
+
+
+def _child(conn, fn, args):
+    # The child is forked by the forkserver, not by us, so the parent's os.times()
+    # never sees it: it reports its own CPU time with the outcome.
+    try:
+        fn(*args)
+        conn.send((None, cpu_seconds()))
+    except BaseException:
+        conn.send((traceback.format_exc(), cpu_seconds()))
+    finally:
+        conn.close()
+
+
+def run_in_subprocess(fn, args, timeout, stage):
+    """
+    Run fn(*args) in a child process that is killed on timeout or cancellation,
+    so a hung native converter cannot hold the worker. fn must be importable
+    (a module-level function) and report results through files.
+    Returns the CPU seconds the child used (0 if it died without reporting).
+    """
+    ctx = mp_context()
+    parent, child = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_child, args=(child, fn, args), name=f"{stage}-child", daemon=True)
+    proc.start()
+    child.close()
+    try:
+        _wait(lambda t: parent.poll(t) or not proc.is_alive(), timeout, stage)
+        try:
+            error, cpu = parent.recv()
+        except EOFError:
+            proc.join()
+            error, cpu = f"{stage} process exited with code {proc.exitcode}", 0.0
+    finally:
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        parent.close()
+    if error:
+        raise RuntimeError(f"{stage} failed in child process:\n{error}")
+    return cpu
+
+
+_warm = {}  # initializer -> idle (process, connection) pairs
+_warm_lock = threading.Lock()
+
+
+def _warm_child(conn, initializer):
+    # Per-process setup once (e.g. build the converter), then one call per message
+    if initializer is not None:
+        initializer()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        fn, args = job
+        started = cpu_seconds()
+        try:
+            fn(*args)
+            error = None
+        except BaseException:
+            error = traceback.format_exc()
+        conn.send((error, cpu_seconds() - started))
+
+
+def run_in_warm_process(fn, args, timeout, stage, initializer=None):
+    """
+    run_in_subprocess() on a reusable child process that ran `initializer` (a
+    module-level function) once when it started, so the setup is not paid per call.
+    A child goes back to the idle set only after a call it answered; on timeout,
+    cancellation or a crash it is killed and a later call starts a fresh one.
+    Returns the CPU seconds the call used in the child.
+    """
+    worker = None
+    with _warm_lock:
+        idle = _warm.setdefault(initializer, [])
+        while idle and worker is None:
+            worker = idle.pop()
+            if not worker[0].is_alive():  # died while idle
+                worker[1].close()
+                worker = None
+    if worker is None:
+        ctx = mp_context()
+        parent, child = ctx.Pipe()
+        proc = ctx.Process(target=_warm_child, args=(child, initializer), name=f"{stage}-worker", daemon=True)
+        proc.start()
+        child.close()
+        worker = (proc, parent)
+    proc, conn = worker
+    answered = False
+    try:
+        conn.send((fn, args))
+        _wait(lambda t: conn.poll(t) or not proc.is_alive(), timeout, stage)
+        try:
+            error, cpu = conn.recv()
+            answered = True
+        except EOFError:
+            proc.join()
+            error, cpu = f"{stage} process exited with code {proc.exitcode}", 0.0
+    finally:
+        if answered:
+            with _warm_lock:
+                _warm[initializer].append(worker)
+        else:
+            if proc.is_alive():
+                proc.kill()
+            proc.join()
+            conn.close()
+    if error:
+        raise RuntimeError(f"{stage} failed in child process:\n{error}")
+    return cpu
@@ -0,0 +1,250 @@
+# backend/dedup.py
+import difflib
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Allow running as a script (python backend/dedup.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import code2, code7, scheduler, storage, templates
+
+BASE_DIR = Path(__file__).parent.parent
+DEDUP_DB = os.getenv("DEDUP_DB", str(BASE_DIR / "dedup.sqlite3"))
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.8"))
+# Shorter values ("1", "x", "US") occur on almost any line; they are always re-extracted
+MIN_REUSE_CHARS = int(os.getenv("DEDUP_MIN_VALUE_CHARS", "4"))
+
+# The index is scoped per tenant (as backend/profiles.py): a document is only ever
+# compared with, and reuses values of, documents processed for the same tenant.
+
+SHINGLE_WORDS = 5
+NUM_PERM = 64
+BANDS = 16  # LSH: 16 bands x 4 rows finds pairs above ~0.5 Jaccard with high probability
+ROWS = NUM_PERM // BANDS
+CONTEXT_LINES = 2
+_PRIME = (1 << 61) - 1
+_rng = random.Random(1234)  # fixed seed: signatures must be comparable across processes
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_local = threading.local()
+
+
+def shingles(text):
+    """Hashed word 5-grams of the normalized text."""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_WORDS:
+        words = words + [""] * (SHINGLE_WORDS - len(words))
+    return {
+        int.from_bytes(hashlib.blake2b(" ".join(words[i:i + SHINGLE_WORDS]).encode(), digest_size=8).digest(), "big")
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def minhash(text):
+    hashed = shingles(text)
+    return [min((a * h + b) % _PRIME for h in hashed) for a, b in _PERMS]
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two MinHash signatures."""
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _bands(signature):
+    for band in range(BANDS):
+        chunk = signature[band * ROWS:(band + 1) * ROWS]
+        yield band, hashlib.blake2b(json.dumps(chunk).encode(), digest_size=8).hexdigest()
+
+
+def _conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DEDUP_DB:
+        conn = sqlite3.connect(DEDUP_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        columns = [r["name"] for r in conn.execute("PRAGMA table_info(documents)")]
+        if columns and "tenant" not in columns:
+            # Index built before it was scoped per tenant: it cannot be attributed, start over
+            conn.executescript("DROP TABLE IF EXISTS documents; DROP TABLE IF EXISTS bands;")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (
+                tenant TEXT NOT NULL,
+                ref TEXT NOT NULL,
+                template TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (tenant, template, ref)
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                tenant TEXT NOT NULL,
+                template TEXT NOT NULL,
+                band INTEGER NOT NULL,
+                bucket TEXT NOT NULL,
+                ref TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS bands_lookup ON bands (tenant, template, band, bucket);
+            CREATE INDEX IF NOT EXISTS bands_ref ON bands (tenant, template, ref);
+        """)
+        _local.conn, _local.path = conn, DEDUP_DB
+    return conn
+
+
+def _tenant(tenant):
+    return tenant if tenant is not None else (scheduler.current_tenant() or "")
+
+
+def register(template_id, ref, signature, tenant=None):
+    """Add (or replace) a processed document in the tenant's similarity index for the template."""
+    tenant = _tenant(tenant)
+    conn = _conn()
+    with conn:
+        forget(template_id, ref, conn, tenant)
+        conn.execute("INSERT INTO documents (tenant, ref, template, signature, created_at) VALUES (?, ?, ?, ?, ?)",
+                     (tenant, ref, template_id, json.dumps(signature), time.time()))
+        conn.executemany("INSERT INTO bands (tenant, template, band, bucket, ref) VALUES (?, ?, ?, ?, ?)",
+                         [(tenant, template_id, band, bucket, ref) for band, bucket in _bands(signature)])
+
+
+def forget(template_id, ref, conn=None, tenant=None):
+    tenant = _tenant(tenant)
+    conn = conn or _conn()
+    conn.execute("DELETE FROM documents WHERE tenant=? AND template=? AND ref=?", (tenant, template_id, ref))
+    conn.execute("DELETE FROM bands WHERE tenant=? AND template=? AND ref=?", (tenant, template_id, ref))
+
+
+def find_similar(template_id, signature, exclude_ref=None, threshold=DEDUP_THRESHOLD, tenant=None):
+    """Best (ref, similarity) among the tenant's LSH candidates above the threshold, or None."""
+    tenant = _tenant(tenant)
+    conn = _conn()
+    refs = set()
+    for band, bucket in _bands(signature):
+        refs.update(r["ref"] for r in conn.execute(
+            "SELECT ref FROM bands WHERE tenant=? AND template=? AND band=? AND bucket=?",
+            (tenant, template_id, band, bucket)))
+    refs.discard(exclude_ref)
+
+    best = None
+    for ref in refs:
+        row = conn.execute("SELECT signature FROM documents WHERE tenant=? AND template=? AND ref=?",
+                           (tenant, template_id, ref)).fetchone()
+        if row is None:
+            continue
+        score = similarity(signature, json.loads(row["signature"]))
+        if score >= threshold and (best is None or score > best[1]):
+            best = (ref, score)
+    return best
+
+
+def _read_text(store, key):
+    f = store.open_read(key)
+    try:
+        return f.read().decode("utf-8")
+    finally:
+        f.close()
+
+
+def plan_reuse(old_text, new_text, old_values):
+    """
+    Decide which prior values still hold after the text changed.
+
+    A value of at least MIN_REUSE_CHARS characters is reused when every old line
+    containing it as a whole word sequence is unchanged and it still appears that
+    way in the new text. Empty or short fields and values whose supporting lines
+    changed are re-extracted from the changed hunks only.
+
+    Returns:
+        (reused {path: value}, fields to re-extract, changed-hunk text)
+    """
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    changed_old = set()
+    hunks = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        changed_old.update(range(i1, i2))
+        lo, hi = max(0, j1 - CONTEXT_LINES), min(len(new_lines), j2 + CONTEXT_LINES)
+        hunks.append("\n".join(new_lines[lo:hi]))
+
+    reused, reextract = {}, []
+    for path, value in old_values.items():
+        needle = str(value).strip()
+        if len(needle) < MIN_REUSE_CHARS or isinstance(value, bool):
+            reextract.append(path)
+            continue
+        pattern = re.compile(rf"(?<!\w){re.escape(needle)}(?!\w)", re.IGNORECASE)
+        support = [i for i, line in enumerate(old_lines) if pattern.search(line)]
+        if support and not changed_old.intersection(support) and pattern.search(new_text):
+            reused[path] = value
+        else:
+            reextract.append(path)
+    if not hunks:
+        # Identical text: nothing can have changed
+        reused.update({p: old_values[p] for p in reextract if old_values[p]})
+        reextract = []
+    return reused, reextract, "\n...\n".join(hunks)
+
+
+def process(output_folder, template_id=None, tenant=None):
+    """
+    Look for a near-duplicate of code1_output.txt among the tenant's processed documents
+    of the same template.
+
+    Args:
+        output_folder: Folder containing code1_output.txt ({session}/{document})
+        template_id: form template; defaults to the one bound to the session folder
+        tenant: index scope; defaults to the current scheduler tenant
+    Returns:
+        dict with template_id, tenant, ref, signature and, on a match, matched_ref, similarity,
+        reused values, fields to re-extract and the changed-hunk text; saved as dedup_output.json
+    """
+    output_folder = Path(output_folder)
+    input_text_path = output_folder / "code1_output.txt"
+    if not input_text_path.exists():
+        raise FileNotFoundError(f"{input_text_path} not found. Run code1 first.")
+    with open(input_text_path, "r", encoding="utf-8") as f:
+        new_text = f.read()
+
+    template_id = template_id or templates.session_template_id(output_folder.parent)
+    tenant = _tenant(tenant)
+    ref = f"{output_folder.parent.name}/{output_folder.name}"
+    signature = minhash(new_text)
+    result = {"template_id": template_id, "tenant": tenant, "ref": ref, "signature": signature, "matched_ref": None}
+
+    match = find_similar(template_id, signature, exclude_ref=ref, tenant=tenant)
+    if match:
+        matched_ref, score = match
+        store = storage.get_storage()
+        try:
+            old_text = _read_text(store, f"{matched_ref}/code1_output.txt")
+            old_form = json.loads(_read_text(store, f"{matched_ref}/{code2.OUTPUT_FILE}"))
+        except Exception as e:
+            # Prior artifacts are gone (document or session deleted)
+            print(f"⚠️ Near-duplicate {matched_ref} unavailable ({e}); dropping it from the index")
+            forget(template_id, matched_ref, tenant=tenant)
+            _conn().commit()
+        else:
+            old_values = {path: node.get("value", "") for path, node in code7.iter_value_nodes(old_form)}
+            reused, reextract, hunk_text = plan_reuse(old_text, new_text, old_values)
+            result.update(matched_ref=matched_ref, similarity=score, reused=reused,
+                          reextract=reextract, changed_text=hunk_text)
+            print(f"♻️ Near-duplicate of {matched_ref} (similarity {score:.2f}) → "
+                  f"{len(reused)} values reused, {len(reextract)} fields re-extracted")
+
+    with open(output_folder / "dedup_output.json", "w", encoding="utf-8") as f:
+        json.dump({k: v for k, v in result.items() if k != "signature"}, f, indent=4, ensure_ascii=False)
+    return result
+
+
+# CLI support
+if __name__ == "__main__":
+    process(sys.argv[1])
@@ -0,0 +1,631 @@
+# backend/job_queue.py
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from backend.scheduler import BACKFILL_SHARE, LANES
+
+BASE_DIR = Path(__file__).parent.parent
+JOB_QUEUE_URL = os.getenv("JOB_QUEUE_URL", f"sqlite:///{BASE_DIR / 'jobs.sqlite3'}")
+VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "600"))
+MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF = float(os.getenv("JOB_RETRY_BACKOFF", "30"))
+# PIPELINE_MODE=queue turns API nodes into enqueuers; documents run in backend/worker.py processes
+QUEUE_MODE = os.getenv("PIPELINE_MODE", "inline").lower() == "queue"
+LANE_WEIGHTS = {"interactive": 1.0 - BACKFILL_SHARE, "backfill": BACKFILL_SHARE}
+LEASE_WINDOW = 200  # Redis: ready jobs per lane considered by one lease
+
+# Job lifecycle: queued → leased → succeeded | queued (retry) | failed
+#                queued → cancelled;  leased → cancelling → cancelled
+#
+# A lease hides the job from other workers until it expires; a worker that dies
+# simply stops extending its lease and the job becomes visible again. Jobs share
+# a "group" (the session) and only one job per group is leased at a time, so the
+# session-level merge in code7 never runs concurrently for the same session. Jobs of a
+# group also run in enqueue order: while an earlier job waits for its retry (or a
+# budget deferral), later jobs of the group wait behind it.
+# Among leasable jobs, lease() follows the in-process scheduler's policy: the payload's
+# lane picks by smooth weighted round robin (LANE_WEIGHTS, from BACKFILL_SHARE), then
+# the tenant served least recently goes first, oldest job first within a tenant. Unlike
+# the scheduler there are no per-tenant weights, and the Redis backend only considers
+# the first LEASE_WINDOW ready jobs of each lane.
+# Cancelling a leased job makes its next heartbeat fail, which stops the worker's
+# pipeline run; the job keeps its group lock until the worker lets go of it.
+
+
+class SQLiteQueue:
+    """Single-host queue backed by a SQLite file (safe across processes)."""
+
+    def __init__(self, path, visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        self.path = str(path)
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    grp TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    available_at REAL NOT NULL,
+                    lease_token TEXT,
+                    lease_expires REAL,
+                    worker TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    lane TEXT NOT NULL DEFAULT 'interactive',
+                    tenant TEXT NOT NULL DEFAULT ''
+                )""")
+            columns = [r["name"] for r in conn.execute("PRAGMA table_info(jobs)")]
+            if "lane" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN lane TEXT NOT NULL DEFAULT 'interactive'")
+                conn.execute("ALTER TABLE jobs ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_group ON jobs (grp, status)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS turns (
+                    kind TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    value REAL NOT NULL,
+                    PRIMARY KEY (kind, name)
+                )""")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS budgets (
+                    tenant TEXT PRIMARY KEY,
+                    level REAL NOT NULL,
+                    updated REAL NOT NULL,
+                    used INTEGER NOT NULL DEFAULT 0
+                )""")
+
+    def _conn(self, mode="IMMEDIATE"):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return _Transaction(conn, mode)
+
+    def enqueue(self, payload, group=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, grp, payload, status, available_at, created_at, updated_at, lane, tenant) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (job_id, group or job_id, json.dumps(payload), now, now, now,
+                 payload.get("lane") or "interactive", payload.get("tenant") or group or job_id),
+            )
+        return job_id
+
+    def lease(self, worker_id):
+        """Claim the next visible job that is first in its idle group (lane, then tenant turn); returns a job dict or None."""
+        now = time.time()
+        with self._conn() as conn:
+            # Expired leases whose attempts are used up become dead letters
+            conn.execute(
+                "UPDATE jobs SET status='failed', error=COALESCE(error, 'lease expired'), updated_at=? "
+                "WHERE status='leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            conn.execute(
+                "UPDATE jobs SET status='cancelled', lease_token=NULL, updated_at=? "
+                "WHERE status='cancelling' AND lease_expires < ?",
+                (now, now),
+            )
+            # Oldest leasable job of every (lane, tenant)
+            heads = conn.execute(
+                "SELECT j.lane, j.tenant, MIN(j.rowid) AS first FROM jobs j WHERE "
+                "((j.status='queued' AND j.available_at <= ?) OR (j.status='leased' AND j.lease_expires < ?)) "
+                "AND NOT EXISTS (SELECT 1 FROM jobs e WHERE e.grp=j.grp AND e.id != j.id AND ("
+                "(e.status IN ('leased', 'cancelling') AND e.lease_expires >= ?) "
+                "OR (e.status IN ('queued', 'leased', 'cancelling') AND e.rowid < j.rowid))) "
+                "GROUP BY j.lane, j.tenant",
+                (now, now, now),
+            ).fetchall()
+            if not heads:
+                return None
+            row = conn.execute("SELECT * FROM jobs WHERE rowid=?", (self._take_turn(conn, heads),)).fetchone()
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE jobs SET status='leased', attempts=attempts+1, lease_token=?, lease_expires=?, "
+                "worker=?, updated_at=? WHERE id=?",
+                (token, now + self.visibility_timeout, worker_id, now, row["id"]),
+            )
+        job = self._to_dict(row)
+        job.update(status="leased", attempts=row["attempts"] + 1, lease_token=token)
+        return job
+
+    @staticmethod
+    def _take_turn(conn, heads):
+        """rowid of the job to lease among the (lane, tenant) heads; records the lane credit and tenant turn."""
+        turns = {(r["kind"], r["name"]): r["value"] for r in conn.execute("SELECT kind, name, value FROM turns")}
+        lanes = {}
+        for head in heads:
+            lanes.setdefault(head["lane"], []).append(head)
+
+        # Smooth weighted round robin between lanes with leasable work (as Scheduler._pick)
+        credit = {lane: turns.get(("lane", lane), 0.0) + LANE_WEIGHTS.get(lane, 1.0) for lane in lanes}
+        lane = max(lanes, key=lambda l: (credit[l], l == "interactive"))
+        credit[lane] -= sum(LANE_WEIGHTS.get(l, 1.0) for l in lanes)
+
+        # Round robin between tenants: least recently served first
+        head = min(lanes[lane], key=lambda h: (turns.get(("tenant", h["tenant"]), 0.0), h["first"]))
+        turn = max([v for (kind, _), v in turns.items() if kind == "tenant"], default=0.0) + 1
+        conn.executemany(
+            "INSERT INTO turns (kind, name, value) VALUES (?, ?, ?) "
+            "ON CONFLICT(kind, name) DO UPDATE SET value=excluded.value",
+            [("lane", l, c) for l, c in credit.items()] + [("tenant", head["tenant"], turn)],
+        )
+        return head["first"]
+
+    def extend(self, job_id, lease_token):
+        """Heartbeat: push the lease expiry forward. Returns False if the lease was lost or the job cancelled."""
+        now = time.time()
+        with self._conn() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_expires=?, updated_at=? WHERE id=? AND lease_token=? AND status='leased'",
+                (now + self.visibility_timeout, now, job_id, lease_token),
+            )
+        return cur.rowcount == 1
+
+    def ack(self, job_id, lease_token, result=None):
+        with self._conn() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status='succeeded', result=?, lease_token=NULL, updated_at=? "
+                "WHERE id=? AND lease_token=?",
+                (json.dumps(result), time.time(), job_id, lease_token),
+            )
+        return cur.rowcount == 1
+
+    def fail(self, job_id, lease_token, error):
+        """Release a failed job: retry with backoff, or dead-letter after max attempts."""
+        now = time.time()
+        with self._conn() as conn:
+            row = conn.execute("SELECT attempts, status FROM jobs WHERE id=? AND lease_token=?",
+                               (job_id, lease_token)).fetchone()
+            if row is None:
+                return False
+            if row["status"] == "cancelling":
+                conn.execute("UPDATE jobs SET status='cancelled', lease_token=NULL, updated_at=? WHERE id=?",
+                             (now, job_id))
+            elif row["attempts"] >= self.max_attempts:
+                conn.execute("UPDATE jobs SET status='failed', error=?, lease_token=NULL, updated_at=? WHERE id=?",
+                             (error, now, job_id))
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status='queued', error=?, lease_token=NULL, available_at=?, updated_at=? "
+                    "WHERE id=?",
+                    (error, now + RETRY_BACKOFF * row["attempts"], now, job_id),
+                )
+        return True
+
+    def defer(self, job_id, lease_token, delay, reason=None):
+        """Put a leased job back without using up an attempt (e.g. tenant over its token budget)."""
+        now = time.time()
+        with self._conn() as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status='queued', attempts=MAX(attempts-1, 0), error=?, lease_token=NULL, "
+                "available_at=?, updated_at=? WHERE id=? AND lease_token=?",
+                (reason, now + delay, now, job_id, lease_token),
+            )
+        return cur.rowcount == 1
+
+    def cancel(self, job_id):
+        """
+        Cancel a job: a queued one at once, a leased one once its worker notices
+        (next heartbeat). Returns the job's new status, or None if unknown.
+        """
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute("UPDATE jobs SET status='cancelled', updated_at=? WHERE id=? AND status='queued'",
+                         (now, job_id))
+            conn.execute("UPDATE jobs SET status='cancelling', updated_at=? WHERE id=? AND status='leased'",
+                         (now, job_id))
+            row = conn.execute("SELECT status FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return row["status"] if row else None
+
+    def get(self, job_id):
+        with self._conn("DEFERRED") as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id=?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def stats(self):
+        with self._conn("DEFERRED") as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    def _bucket(self, conn, tenant, per_hour, now):
+        row = conn.execute("SELECT level, updated, used FROM budgets WHERE tenant=?", (tenant,)).fetchone()
+        if row is None:
+            return max(per_hour, 0.0), 0
+        return _refill(row["level"], row["updated"], per_hour, now), row["used"]
+
+    def take_tokens(self, tenant, tokens, per_hour, force=False):
+        """
+        Spend tokens from the tenant's hourly bucket shared by all workers of this queue
+        (per_hour <= 0: unlimited, usage is only counted). Returns 0, or the seconds until
+        they would be available; force=True always spends (usage corrections, may be < 0).
+        """
+        now = time.time()
+        with self._conn() as conn:
+            level, used = self._bucket(conn, tenant, per_hour, now)
+            wait = 0.0 if force else _wait_for(level, tokens, per_hour)
+            if not wait:
+                conn.execute(
+                    "INSERT INTO budgets (tenant, level, updated, used) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(tenant) DO UPDATE SET level=excluded.level, updated=excluded.updated, "
+                    "used=excluded.used",
+                    (tenant, level - tokens if per_hour > 0 else 0.0, now, used + tokens),
+                )
+        return wait
+
+    def token_state(self, tenant, per_hour):
+        """{"used", "level"} of the tenant's shared bucket."""
+        with self._conn("DEFERRED") as conn:
+            level, used = self._bucket(conn, tenant, per_hour, time.time())
+        return {"used": used, "level": level}
+
+    @staticmethod
+    def _to_dict(row):
+        return {
+            "id": row["id"],
+            "group": row["grp"],
+            "payload": json.loads(row["payload"]),
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "worker": row["worker"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+
+def _refill(level, updated, per_hour, now):
+    # Token bucket refilled continuously at per_hour / 3600 tokens per second
+    if per_hour <= 0:
+        return 0.0
+    return min(per_hour, level + (now - updated) * per_hour / 3600)
+
+
+def _wait_for(level, tokens, per_hour):
+    # A call may overdraw a full bucket once (same rule as scheduler.TokenBucket)
+    if per_hour <= 0 or level >= tokens or level >= per_hour:
+        return 0.0
+    return (tokens - level) / (per_hour / 3600)
+
+
+class _Transaction:
+    """
+    `with` block running one transaction on an autocommit connection: IMMEDIATE
+    (write lock up front) for updates, DEFERRED for reads so they never wait on writers.
+    """
+
+    def __init__(self, conn, mode="IMMEDIATE"):
+        self.conn = conn
+        self.mode = mode
+
+    def __enter__(self):
+        self.conn.execute(f"BEGIN {self.mode}")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
+
+
+# Atomic lease for the Redis backend: requeue expired leases, then, among the first
+# LEASE_WINDOW jobs of each lane's ready list whose group is not locked (or locked by
+# that job), pick a lane by smooth weighted round robin and in it the job of the tenant
+# served least recently; lock it for the visibility timeout. A job waiting for a retry
+# keeps its group's lock, without expiry, so later jobs of the group cannot overtake it.
+# ARGV = now, timeout, token, max_attempts, worker, window, then lane, weight pairs.
+_REDIS_LEASE = """
+local now = tonumber(ARGV[1])
+local timeout = tonumber(ARGV[2])
+local max_attempts = tonumber(ARGV[4])
+local window = tonumber(ARGV[6])
+local prefix = KEYS[1]
+local function ready(job)
+    return prefix .. ':ready:' .. (redis.call('HGET', job, 'lane') or 'interactive')
+end
+-- Jobs enqueued before lanes were tracked
+while redis.call('RPOPLPUSH', prefix .. ':ready', prefix .. ':ready:interactive') do end
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', prefix .. ':leased', '-inf', now)) do
+    redis.call('ZREM', prefix .. ':leased', id)
+    local job = prefix .. ':job:' .. id
+    local lock = prefix .. ':lock:' .. redis.call('HGET', job, 'group')
+    if redis.call('HGET', job, 'status') == 'cancelling' then
+        redis.call('DEL', lock)
+        redis.call('HSET', job, 'status', 'cancelled', 'lease_token', '')
+    elseif tonumber(redis.call('HGET', job, 'attempts')) >= max_attempts then
+        redis.call('DEL', lock)
+        redis.call('HSET', job, 'status', 'failed', 'error', 'lease expired')
+    else
+        redis.call('SET', lock, id)
+        redis.call('HSET', job, 'status', 'queued')
+        redis.call('LPUSH', ready(job), id)
+    end
+end
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', prefix .. ':delayed', '-inf', now)) do
+    redis.call('ZREM', prefix .. ':delayed', id)
+    redis.call('RPUSH', ready(prefix .. ':job:' .. id), id)
+end
+local picks, total, best, best_credit = {}, 0, nil, nil
+for i = 7, #ARGV, 2 do
+    local lane, weight = ARGV[i], tonumber(ARGV[i + 1])
+    local pick, pick_turn
+    for _, id in ipairs(redis.call('LRANGE', prefix .. ':ready:' .. lane, 0, window - 1)) do
+        local job = prefix .. ':job:' .. id
+        local holder = redis.call('GET', prefix .. ':lock:' .. redis.call('HGET', job, 'group'))
+        if not holder or holder == id then
+            local tenant = redis.call('HGET', job, 'tenant') or ''
+            local turn = tonumber(redis.call('HGET', prefix .. ':turns', tenant) or 0)
+            if not pick or turn < pick_turn then
+                pick, pick_turn = id, turn
+            end
+        end
+    end
+    if pick then
+        picks[lane] = pick
+        total = total + weight
+        local credit = tonumber(redis.call('HINCRBYFLOAT', prefix .. ':lane_credit', lane, weight))
+        if not best or credit > best_credit then
+            best, best_credit = lane, credit
+        end
+    end
+end
+if not best then
+    return false
+end
+redis.call('HINCRBYFLOAT', prefix .. ':lane_credit', best, -total)
+local id = picks[best]
+local job = prefix .. ':job:' .. id
+redis.call('SET', prefix .. ':lock:' .. redis.call('HGET', job, 'group'), id, 'PX', math.floor(timeout * 1000))
+redis.call('LREM', prefix .. ':ready:' .. best, 1, id)
+redis.call('HSET', prefix .. ':turns', redis.call('HGET', job, 'tenant') or '', redis.call('INCR', prefix .. ':turn'))
+redis.call('ZADD', prefix .. ':leased', now + timeout, id)
+redis.call('HINCRBY', job, 'attempts', 1)
+redis.call('HSET', job, 'status', 'leased', 'lease_token', ARGV[3], 'worker', ARGV[5], 'updated_at', now)
+return id
+"""
+
+
+# Shared token bucket (see SQLiteQueue.take_tokens): KEYS[1] = bucket hash,
+# ARGV = now, per_hour, tokens, force ("1"/"0"); returns the seconds to wait as a string.
+_REDIS_TAKE_TOKENS = """
+local now, per_hour, tokens = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local level = tonumber(redis.call('HGET', KEYS[1], 'level') or per_hour)
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or now)
+local used = tonumber(redis.call('HGET', KEYS[1], 'used') or 0)
+if per_hour > 0 then
+    level = math.min(per_hour, level + (now - updated) * per_hour / 3600)
+    if ARGV[4] ~= '1' and level < tokens and level < per_hour then
+        return tostring((tokens - level) / (per_hour / 3600))
+    end
+    level = level - tokens
+else
+    level = 0
+end
+redis.call('HSET', KEYS[1], 'level', tostring(level), 'updated', tostring(now), 'used', tostring(used + tokens))
+return '0'
+"""
+
+
+class RedisQueue:
+    """Multi-node queue for any Redis-protocol server (needs the `redis` package)."""
+
+    def __init__(self, url, prefix="pipeline", visibility_timeout=VISIBILITY_TIMEOUT, max_attempts=MAX_ATTEMPTS):
+        import redis  # optional dependency, only needed for multi-node mode
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._lease_script = self.client.register_script(_REDIS_LEASE)
+        self._take_tokens_script = self.client.register_script(_REDIS_TAKE_TOKENS)
+
+    def _key(self, *parts):
+        return ":".join((self.prefix,) + parts)
+
+    def enqueue(self, payload, group=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        lane = payload.get("lane") or "interactive"
+        pipe = self.client.pipeline()
+        pipe.hset(self._key("job", job_id), mapping={
+            "payload": json.dumps(payload), "group": group or job_id, "status": "queued",
+            "attempts": 0, "created_at": now, "updated_at": now,
+            "lane": lane, "tenant": payload.get("tenant") or group or job_id,
+        })
+        pipe.rpush(self._key("ready", lane), job_id)
+        pipe.execute()
+        return job_id
+
+    def lease(self, worker_id):
+        token = uuid.uuid4().hex
+        job_id = self._lease_script(
+            keys=[self.prefix],
+            args=[time.time(), self.visibility_timeout, token, self.max_attempts, worker_id, LEASE_WINDOW,
+                  *[x for lane in LANES for x in (lane, LANE_WEIGHTS[lane])]],
+        )
+        if not job_id:
+            return None
+        job = self.get(job_id)
+        job["lease_token"] = token
+        return job
+
+    def _owns(self, job_id, lease_token):
+        return self.client.hget(self._key("job", job_id), "lease_token") == lease_token
+
+    def _release(self, pipe, job_id):
+        group = self.client.hget(self._key("job", job_id), "group")
+        pipe.zrem(self._key("leased"), job_id)
+        pipe.delete(self._key("lock", group))
+
+    def _hold(self, pipe, job_id):
+        """Leave the lease but keep the group locked (no expiry) until the job runs again."""
+        group = self.client.hget(self._key("job", job_id), "group")
+        pipe.zrem(self._key("leased"), job_id)
+        pipe.set(self._key("lock", group), job_id)
+
+    def extend(self, job_id, lease_token):
+        if not self._owns(job_id, lease_token):
+            return False
+        if self.client.hget(self._key("job", job_id), "status") != "leased":
+            return False
+        group = self.client.hget(self._key("job", job_id), "group")
+        pipe = self.client.pipeline()
+        pipe.zadd(self._key("leased"), {job_id: time.time() + self.visibility_timeout})
+        pipe.pexpire(self._key("lock", group), int(self.visibility_timeout * 1000))
+        pipe.execute()
+        return True
+
+    def ack(self, job_id, lease_token, result=None):
+        if not self._owns(job_id, lease_token):
+            return False
+        pipe = self.client.pipeline()
+        self._release(pipe, job_id)
+        pipe.hset(self._key("job", job_id), mapping={
+            "status": "succeeded", "result": json.dumps(result), "lease_token": "", "updated_at": time.time(),
+        })
+        pipe.execute()
+        return True
+
+    def fail(self, job_id, lease_token, error):
+        if not self._owns(job_id, lease_token):
+            return False
+        job_key = self._key("job", job_id)
+        attempts = int(self.client.hget(job_key, "attempts") or 0)
+        now = time.time()
+        pipe = self.client.pipeline()
+        if self.client.hget(job_key, "status") == "cancelling":
+            self._release(pipe, job_id)
+            pipe.hset(job_key, mapping={"status": "cancelled", "lease_token": "", "updated_at": now})
+        elif attempts >= self.max_attempts:
+            self._release(pipe, job_id)
+            pipe.hset(job_key, mapping={"status": "failed", "error": error, "lease_token": "", "updated_at": now})
+        else:
+            self._hold(pipe, job_id)
+            pipe.hset(job_key, mapping={"status": "queued", "error": error, "lease_token": "", "updated_at": now})
+            pipe.zadd(self._key("delayed"), {job_id: now + RETRY_BACKOFF * attempts})
+        pipe.execute()
+        return True
+
+    def defer(self, job_id, lease_token, delay, reason=None):
+        if not self._owns(job_id, lease_token):
+            return False
+        job_key = self._key("job", job_id)
+        now = time.time()
+        pipe = self.client.pipeline()
+        self._hold(pipe, job_id)
+        pipe.hincrby(job_key, "attempts", -1)
+        pipe.hset(job_key, mapping={"status": "queued", "error": reason or "", "lease_token": "", "updated_at": now})
+        pipe.zadd(self._key("delayed"), {job_id: now + delay})
+        pipe.execute()
+        return True
+
+    def cancel(self, job_id):
+        job_key = self._key("job", job_id)
+        status = self.client.hget(job_key, "status")
+        if status == "queued":
+            lock = self._key("lock", self.client.hget(job_key, "group"))
+            pipe = self.client.pipeline()
+            pipe.lrem(self._key("ready", self.client.hget(job_key, "lane") or "interactive"), 0, job_id)
+            pipe.lrem(self._key("ready"), 0, job_id)
+            pipe.zrem(self._key("delayed"), job_id)
+            if self.client.get(lock) == job_id:
+                pipe.delete(lock)  # it was waiting for a retry
+            pipe.hset(job_key, mapping={"status": "cancelled", "updated_at": time.time()})
+            pipe.execute()
+            return "cancelled"
+        if status == "leased":
+            self.client.hset(job_key, mapping={"status": "cancelling", "updated_at": time.time()})
+            return "cancelling"
+        return status
+
+    def get(self, job_id):
+        data = self.client.hgetall(self._key("job", job_id))
+        if not data:
+            return None
+        return {
+            "id": job_id,
+            "group": data.get("group"),
+            "payload": json.loads(data["payload"]),
+            "status": data.get("status"),
+            "attempts": int(data.get("attempts", 0)),
+            "worker": data.get("worker"),
+            "result": json.loads(data["result"]) if data.get("result") else None,
+            "error": data.get("error"),
+            "created_at": float(data.get("created_at", 0)),
+            "updated_at": float(data.get("updated_at", 0)),
+        }
+
+    def stats(self):
+        return {
+            "queued": sum(self.client.llen(self._key("ready", lane)) for lane in LANES)
+            + self.client.llen(self._key("ready")) + self.client.zcard(self._key("delayed")),
+            "leased": self.client.zcard(self._key("leased")),
+        }
+
+    def take_tokens(self, tenant, tokens, per_hour, force=False):
+        wait = self._take_tokens_script(
+            keys=[self._key("budget", tenant)], args=[time.time(), per_hour, tokens, "1" if force else "0"],
+        )
+        return float(wait)
+
+    def token_state(self, tenant, per_hour):
+        data = self.client.hgetall(self._key("budget", tenant))
+        if not data:
+            return {"used": 0, "level": max(per_hour, 0.0)}
+        return {"used": int(float(data["used"])),
+                "level": _refill(float(data["level"]), float(data["updated"]), per_hour, time.time())}
+
+
+def document_job(session_name, document, filename, override=False, policy=None, tenant=None, lane="interactive"):
+    """Payload for one document (storage keys, not local paths); the session is the job group."""
+    return {
+        "session_name": session_name, "document": document, "filename": filename,
+        "override": override, "policy": policy, "tenant": tenant or session_name, "lane": lane,
+    }
+
+
+def remove_document_job(session_name, document, policy=None, tenant=None):
+    """Payload withdrawing a document from its session (same group, so it never races a merge)."""
+    return {
+        "kind": "remove_document", "session_name": session_name, "document": document,
+        "policy": policy, "tenant": tenant or session_name,
+    }
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue(url=None):
+    """
+    Queue backend for JOB_QUEUE_URL: sqlite:///path/to/jobs.sqlite3 or redis://host:port/db.
+    """
+    global _queue
+    if url is not None:
+        return _open(url)
+    with _queue_lock:
+        if _queue is None:
+            _queue = _open(JOB_QUEUE_URL)
+        return _queue
+
+
+def _open(url):
+    if url.startswith("sqlite:///"):
+        return SQLiteQueue(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue(url)
+    raise ValueError(f"Unsupported JOB_QUEUE_URL '{url}'")
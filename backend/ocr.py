@@ -0,0 +1,263 @@
+# backend/ocr.py
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+# Allow running as a script (python backend/ocr.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import deadlines, profiling
+
+BASE_DIR = Path(__file__).parent.parent
+OCR_CACHE_DB = os.getenv("OCR_CACHE_DB", str(BASE_DIR / "ocr_cache.sqlite3"))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_PAGE_TIMEOUT = float(os.getenv("OCR_PAGE_TIMEOUT", "60"))
+OCR_CLASSIFY_TIMEOUT = float(os.getenv("OCR_CLASSIFY_TIMEOUT", "60"))
+TEXT_LAYER_MIN_CHARS = int(os.getenv("OCR_MIN_CHARS", "25"))
+OUTPUT_FILE = "ocr_output.json"
+
+# Scanned booklets mix text-layer pages with image-only pages (signatures, ID copies).
+# PyPDF2 tells them apart per page; only image-only pages have their embedded images
+# OCR'd with Tesseract, in a process pool, and the text is put back at the page's place
+# in code1_output.txt. Results are cached by image hash, so a signature page that
+# repeats across documents is OCR'd once. pytesseract (plus the tesseract binary) is
+# optional: without it code1 output is left as is.
+
+_local = threading.local()
+_pool = None
+_pool_lock = threading.Lock()
+_available = None
+
+
+def available():
+    """True when pytesseract and the tesseract binary can be used (checked once)."""
+    global _available
+    if _available is None:
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+            _available = True
+        except Exception:
+            _available = False
+    return _available
+
+
+def classify_pages(pdf_path):
+    """
+    Per page: {"page": index, "kind": "text" | "image" | "blank", "text", "images": [bytes]}.
+    A page is "text" when its text layer has at least TEXT_LAYER_MIN_CHARS characters;
+    otherwise it is "image" if it embeds images, else "blank".
+    """
+    from PyPDF2 import PdfReader
+
+    pages = []
+    for index, page in enumerate(PdfReader(str(pdf_path)).pages):
+        text = page.extract_text() or ""
+        images = []
+        if len(text.strip()) < TEXT_LAYER_MIN_CHARS:
+            try:
+                images = [image.data for image in page.images]
+            except Exception as e:
+                # Unsupported image filters: the page is left to the converter's output
+                print(f"⚠️ Could not read images of page {index + 1}: {e}")
+        kind = "text" if len(text.strip()) >= TEXT_LAYER_MIN_CHARS else ("image" if images else "blank")
+        pages.append({"page": index, "kind": kind, "text": text, "images": images})
+    return pages
+
+
+def image_key(data, lang=OCR_LANG):
+    return hashlib.sha256(lang.encode() + b"\0" + data).hexdigest()
+
+
+def _ocr_image(data, lang, timeout):
+    # Runs in a pool process; returns (text, CPU seconds spent, tesseract included)
+    import pytesseract
+    from PIL import Image
+
+    started = deadlines.cpu_seconds()
+    with Image.open(io.BytesIO(data)) as image:
+        text = pytesseract.image_to_string(image, lang=lang, timeout=timeout).strip()
+    return text, deadlines.cpu_seconds() - started
+
+
+def _conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != OCR_CACHE_DB:
+        conn = sqlite3.connect(OCR_CACHE_DB, timeout=30)
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                image_hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+        """)
+        _local.conn, _local.path = conn, OCR_CACHE_DB
+    return conn
+
+
+def cached(keys):
+    """{image_hash: text} for the keys already OCR'd."""
+    keys = list(keys)
+    found = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        rows = _conn().execute(
+            f"SELECT image_hash, text FROM ocr_cache WHERE image_hash IN ({','.join('?' * len(chunk))})", chunk
+        ).fetchall()
+        found.update(rows)
+    return found
+
+
+def _store(key, text):
+    conn = _conn()
+    conn.execute("INSERT OR REPLACE INTO ocr_cache (image_hash, text, created_at) VALUES (?, ?, ?)",
+                 (key, text, time.time()))
+    conn.commit()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, mp_context=deadlines.mp_context())
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        _pool = None
+
+
+def ocr_pages(pages):
+    """
+    OCR the images of image-only pages. Returns ({page index: text}, cache hits).
+    Waits are cancellable (deadlines.check); a failed image is skipped, not cached.
+    """
+    keys = {}  # image hash -> image bytes
+    page_keys = {}
+    for page in pages:
+        page_keys[page["page"]] = [image_key(data) for data in page["images"]]
+        keys.update(zip(page_keys[page["page"]], page["images"]))
+
+    texts = cached(keys)
+    hits = len(texts)
+    missing = [key for key in keys if key not in texts]
+    if missing:
+        pool = get_pool()
+        futures = {pool.submit(_ocr_image, keys[key], OCR_LANG, OCR_PAGE_TIMEOUT): key for key in missing}
+        pending = set(futures)
+        try:
+            while pending:
+                deadlines.check()
+                done, pending = wait(pending, timeout=deadlines.POLL_INTERVAL)
+                for future in done:
+                    try:
+                        texts[futures[future]], cpu = future.result()
+                        profiling.add_child_cpu(cpu)
+                    except BrokenProcessPool as e:
+                        print(f"⚠️ OCR worker died: {e}")
+                        _reset_pool()
+                        continue
+                    except Exception as e:
+                        print(f"⚠️ OCR failed for an image: {e}")
+                        continue
+                    _store(futures[future], texts[futures[future]])
+        finally:
+            for future in pending:
+                future.cancel()
+
+    result = {}
+    for index, page_hashes in page_keys.items():
+        text = "\n\n".join(texts[key] for key in page_hashes if texts.get(key))
+        if text:
+            result[index] = text
+    return result, hits
+
+
+def merge(text, pages, ocr_text):
+    """
+    Put OCR text in place of the image-only pages of the converter's output.
+    Pages are split on form feeds. If the converter did not keep one break per
+    page, its text is kept as is (it may carry tables PyPDF2 loses) and the OCR
+    pages are appended after it, labelled with their page numbers.
+    """
+    chunks = text.split("\f")
+    if len(chunks) != len(pages):
+        appended = [f"<!-- page {index + 1} (OCR) -->\n{ocr_text[index]}\n" for index in sorted(ocr_text)]
+        return "\n\n".join([text.rstrip("\n")] + appended)
+    for index, page_text in ocr_text.items():
+        if len(chunks[index].strip()) < TEXT_LAYER_MIN_CHARS:
+            chunks[index] = f"<!-- page {index + 1} (OCR) -->\n{page_text}\n"
+    return "\f".join(chunks)
+
+
+def process(input_file, output_folder):
+    """
+    OCR the image-only pages of a PDF and merge them into code1_output.txt.
+
+    Args:
+        input_file: the uploaded document (non-PDFs are left alone)
+        output_folder: document folder holding code1_output.txt
+    Returns:
+        page statistics (also saved as ocr_output.json), or None when skipped
+    """
+    output_folder = Path(output_folder)
+    if Path(input_file).suffix.lower() != ".pdf":
+        return None
+    if not available():
+        print("⚠️ OCR skipped: pytesseract / tesseract not installed")
+        return None
+
+    try:
+        # A pathological PDF can keep PyPDF2 busy indefinitely: give up on OCR, not the document
+        pages = deadlines.call_with_deadline(lambda: classify_pages(input_file), OCR_CLASSIFY_TIMEOUT, "ocr")
+    except deadlines.Cancelled:
+        raise
+    except deadlines.StageTimeout:
+        print(f"⚠️ OCR skipped: reading the pages of {Path(input_file).name} took over {OCR_CLASSIFY_TIMEOUT:.0f}s")
+        return None
+    except Exception as e:
+        # Encrypted or malformed PDFs PyPDF2 cannot read: keep code1's output
+        print(f"⚠️ OCR skipped: could not read the pages of {Path(input_file).name}: {e}")
+        return None
+    image_pages = [page for page in pages if page["kind"] == "image"]
+    stats = {
+        "pages": len(pages),
+        "text_pages": sum(1 for page in pages if page["kind"] == "text"),
+        "image_pages": [page["page"] + 1 for page in image_pages],
+        "blank_pages": [page["page"] + 1 for page in pages if page["kind"] == "blank"],
+        "ocr_pages": [],
+        "cache_hits": 0,
+    }
+    if image_pages:
+        ocr_text, stats["cache_hits"] = ocr_pages(image_pages)
+        stats["ocr_pages"] = sorted(index + 1 for index in ocr_text)
+        if ocr_text:
+            code1_file = output_folder / "code1_output.txt"
+            with open(code1_file, "r", encoding="utf-8") as f:
+                text = f.read()
+            with open(code1_file, "w", encoding="utf-8") as f:
+                f.write(merge(text, pages, ocr_text))
+
+    with open(output_folder / OUTPUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=4)
+    print(f"🔎 OCR: {len(image_pages)}/{len(pages)} image-only pages, "
+          f"{len(stats['ocr_pages'])} merged ({stats['cache_hits']} images from cache)")
+    return stats
+
+
+# CLI support
+if __name__ == "__main__":
+    process(sys.argv[1], sys.argv[2])
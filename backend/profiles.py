@@ -0,0 +1,285 @@
+# backend/profiles.py
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Allow running as a script (python backend/profiles.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import code7, scheduler
+
+BASE_DIR = Path(__file__).parent.parent
+PROFILE_DB = os.getenv("PROFILE_DB", str(BASE_DIR / "profiles.sqlite3"))
+PROFILE_TTL_DAYS = float(os.getenv("PROFILE_TTL_DAYS", "180"))
+
+# Identifier fields (matched on the last path component) and fund-specific
+# sections that must never be carried over from another subscription.
+NAME_FIELD = "investorFullLegalName_ID"
+TAX_FIELDS = ("investorEINTAX_ID", "investorSSN_ID")
+FUND_SPECIFIC = ("Share Class Type", "Additional subs", "USD/EUR/GBP_IDs", "Self_certification")
+# Personal data (path substrings, case-insensitive) only prefilled after an exact tax-ID match
+SENSITIVE = ("legalname", "ssn", "eintax", "dob", "address", "adress", "wiring", "telephone", "email", "fax",
+             "co-investor", "entity representative", "pointofcontact", "signatory", "beneficial", "directors",
+             "pep")
+
+# Profiles are matched on the investor identifiers the document labels as such
+# ("Investor Full Legal Name: ...", "SSN: ...", a table cell after the label), never on
+# names that merely appear somewhere in the text (signatories, counterparties).
+_NAME_LABEL = re.compile(
+    r"(?:investor|subscriber|purchaser)(?:'s)?\s+(?:full\s+)?(?:legal\s+)?name"
+    r"|(?:full\s+)?legal\s+name(?:\s+of\s+(?:the\s+)?(?:investor|subscriber|purchaser))?"
+    r"|name\s+of\s+(?:the\s+)?(?:investor|subscriber|purchaser)",
+    re.IGNORECASE,
+)
+_TAX_LABEL = re.compile(
+    r"social\s+security\s+(?:number|no\.?)|\bssn\b|\bein\b|employer\s+identification\s+(?:number|no\.?)"
+    r"|tax(?:payer)?\s+identification\s+(?:number|no\.?)|\btin\b|\btax\s+id\b",
+    re.IGNORECASE,
+)
+_SQL_CHUNK = 500
+_local = threading.local()
+
+
+def normalize_name(name):
+    """Lowercase, punctuation-free, single-spaced legal name ("John L.L.C." → "john llc")."""
+    name = re.sub(r"[^\w\s]", "", str(name).lower())
+    return " ".join(name.split())
+
+
+def normalize_tax_id(tax_id):
+    return re.sub(r"[^0-9A-Za-z]", "", str(tax_id)).upper()
+
+
+def _conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != PROFILE_DB:
+        conn = sqlite3.connect(PROFILE_DB, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            CREATE TABLE IF NOT EXISTS profiles (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                tenant TEXT NOT NULL DEFAULT '',
+                name_key TEXT,
+                tax_key TEXT,
+                source_session TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS profile_fields (
+                profile_id INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                value TEXT NOT NULL,
+                source_session TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (profile_id, path)
+            );
+        """)
+        if "tenant" not in [r["name"] for r in conn.execute("PRAGMA table_info(profiles)")]:
+            # Store created before profiles were scoped per tenant
+            conn.execute("ALTER TABLE profiles ADD COLUMN tenant TEXT NOT NULL DEFAULT ''")
+        conn.executescript("""
+            DROP INDEX IF EXISTS profiles_name;
+            DROP INDEX IF EXISTS profiles_tax;
+            CREATE INDEX IF NOT EXISTS profiles_tenant_name ON profiles (tenant, name_key);
+            CREATE INDEX IF NOT EXISTS profiles_tenant_tax ON profiles (tenant, tax_key);
+        """)
+        _local.conn, _local.path = conn, PROFILE_DB
+    return conn
+
+
+def _is_profile_field(path):
+    parts = path.split(".")
+    return not any(section in parts for section in FUND_SPECIFIC)
+
+
+def is_sensitive(path):
+    path = path.lower()
+    return any(marker in path for marker in SENSITIVE)
+
+
+def _tenant(tenant):
+    return tenant if tenant is not None else (scheduler.current_tenant() or "")
+
+
+def _identifiers(values):
+    name_key = tax_key = None
+    for path, value in values.items():
+        last = path.rsplit(".", 1)[-1]
+        if last == NAME_FIELD and value:
+            name_key = normalize_name(value) or None
+        elif last in TAX_FIELDS and value and not tax_key:
+            tax_key = normalize_tax_id(value) or None
+    return name_key, tax_key
+
+
+def record_session(session_json_file, session_name=None, tenant=None):
+    """
+    Upsert the investor profile from a session's master JSON, within the tenant
+    (default: the current scheduler tenant). Values that were themselves prefilled
+    from a profile are not re-stored, so they keep their age and expire after
+    PROFILE_TTL_DAYS unless a document confirms them again.
+
+    Returns:
+        profile id, or None when the session has no name or tax ID yet
+    """
+    session_json_file = Path(session_json_file)
+    if not session_json_file.exists():
+        return None
+    tenant = _tenant(tenant)
+
+    fields = {path: field for path, field in code7.get_field_provenance(session_json_file).items()
+              if field["value"] not in ("", None) and _is_profile_field(path)}
+    name_key, tax_key = _identifiers({path: field["value"] for path, field in fields.items()})
+    if not name_key and not tax_key:
+        return None
+    values = {path: field["value"] for path, field in fields.items()
+              if (field["source"] or {}).get("method") != "profile"}
+
+    now = time.time()
+    conn = _conn()
+    with conn:
+        row = None
+        if tax_key:
+            row = conn.execute("SELECT id FROM profiles WHERE tenant=? AND tax_key=? ORDER BY updated_at DESC LIMIT 1",
+                               (tenant, tax_key)).fetchone()
+        if row is None and name_key:
+            # Same name but a different tax ID is a different investor
+            row = conn.execute(
+                "SELECT id FROM profiles WHERE tenant=? AND name_key=? AND (tax_key IS NULL OR ? IS NULL) "
+                "ORDER BY updated_at DESC LIMIT 1",
+                (tenant, name_key, tax_key),
+            ).fetchone()
+        if row is None:
+            profile_id = conn.execute(
+                "INSERT INTO profiles (tenant, name_key, tax_key, source_session, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (tenant, name_key, tax_key, session_name, now),
+            ).lastrowid
+        else:
+            profile_id = row["id"]
+            conn.execute(
+                "UPDATE profiles SET name_key=COALESCE(?, name_key), tax_key=COALESCE(?, tax_key), "
+                "source_session=?, updated_at=? WHERE id=?",
+                (name_key, tax_key, session_name, now, profile_id),
+            )
+        conn.executemany(
+            "INSERT INTO profile_fields (profile_id, path, value, source_session, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(profile_id, path) DO UPDATE SET value=excluded.value, "
+            "source_session=excluded.source_session, updated_at=excluded.updated_at",
+            [(profile_id, path, json.dumps(value), session_name, now) for path, value in values.items()],
+        )
+    print(f"👤 Investor profile {profile_id} updated from {session_json_file.name} ({len(values)} fields)")
+    return profile_id
+
+
+def _labelled(text, label):
+    """Values written after `label` at the start of a line or table cell ("Label: value", "| Label | value |")."""
+    for line in text.split("\n"):
+        for m in label.finditer(line):
+            before = line[:m.start()].rstrip()
+            if before and not before.endswith("|") and before.strip("*#>-.()0123456789 \t"):
+                continue
+            value = line[m.end():].lstrip(" \t:|-–#.*").split("|")[0].strip(" _*")
+            if value:
+                yield value
+            break
+
+
+def extract_identifiers(text):
+    """Normalized investor names and tax IDs the document labels as the investor's."""
+    names = {normalize_name(v) for v in _labelled(text, _NAME_LABEL)}
+    # A name needs at least two words so a lone first name never matches
+    names = {n for n in names if len(n.split()) >= 2}
+    # "SSN: 123-45-6789   Date of Birth: ..." → the leading ID only
+    tax_ids = {normalize_tax_id(m.group()) for m in
+               (re.match(r"[0-9A-Za-z][0-9A-Za-z\-/]*(?: [0-9\-/]+)*", v) for v in _labelled(text, _TAX_LABEL)) if m}
+    tax_ids = {t for t in tax_ids if sum(c.isdigit() for c in t) >= 5}
+    return names, tax_ids
+
+
+def _lookup(conn, tenant, column, keys):
+    keys = list(keys)
+    rows = []
+    for i in range(0, len(keys), _SQL_CHUNK):
+        chunk = keys[i:i + _SQL_CHUNK]
+        rows += conn.execute(
+            f"SELECT id, name_key, tax_key, updated_at FROM profiles "
+            f"WHERE tenant=? AND {column} IN ({','.join('?' * len(chunk))})", [tenant] + chunk
+        ).fetchall()
+    return rows
+
+
+def match_text(text, tenant=None):
+    """
+    Find the tenant's profile for the investor identified in the document text.
+
+    Returns:
+        (profile id or None, verified) where verified means the document's tax ID
+        matched the profile exactly. A document whose tax ID matches no profile
+        matches nothing, even if the name does.
+    """
+    tenant = _tenant(tenant)
+    names, tax_ids = extract_identifiers(text)
+    conn = _conn()
+    if tax_ids:
+        by_tax = _lookup(conn, tenant, "tax_key", tax_ids)
+        if by_tax:
+            return max(by_tax, key=lambda r: r["updated_at"])["id"], True
+        return None, False
+    by_name = _lookup(conn, tenant, "name_key", names) if names else []
+    if by_name:
+        return max(by_name, key=lambda r: r["updated_at"])["id"], False
+    return None, False
+
+
+def known_values(profile_id, max_age_days=PROFILE_TTL_DAYS, include_sensitive=False):
+    """Fresh (not stale) field values of a profile as {path: value}; personal data only if include_sensitive."""
+    cutoff = time.time() - max_age_days * 86400
+    rows = _conn().execute(
+        "SELECT path, value FROM profile_fields WHERE profile_id=? AND updated_at >= ?", (profile_id, cutoff)
+    ).fetchall()
+    return {r["path"]: json.loads(r["value"]) for r in rows if include_sensitive or not is_sensitive(r["path"])}
+
+
+def process(output_folder):
+    """
+    Match code1_output.txt against the current tenant's known investors.
+
+    Args:
+        output_folder: Folder containing code1_output.txt
+    Returns:
+        dict with profile_id and known_values (fields code2 can skip);
+        also saved as profile_match.json
+    """
+    output_folder = Path(output_folder)
+    input_text_path = output_folder / "code1_output.txt"
+    if not input_text_path.exists():
+        raise FileNotFoundError(f"{input_text_path} not found. Run code1 first.")
+
+    with open(input_text_path, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    profile_id, verified = match_text(text)
+    result = {
+        "profile_id": profile_id,
+        "tax_id_verified": verified,
+        "known_values": known_values(profile_id, include_sensitive=verified) if profile_id else {},
+    }
+
+    with open(output_folder / "profile_match.json", "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=4, ensure_ascii=False)
+
+    if profile_id:
+        print(f"👤 Known investor (profile {profile_id}, tax ID {'verified' if verified else 'not verified'}) "
+              f"→ {len(result['known_values'])} fields prefilled")
+    return result
+
+
+# CLI support
+if __name__ == "__main__":
+    process(sys.argv[1])
@@ -0,0 +1,250 @@
+# backend/profiling.py
+import contextvars
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.getenv("PROFILE_SLOW_MS", "10000"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(BASE_DIR / "request_profiles")))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+TOP_FUNCTIONS = 40
+
+# A request is profiled when it carries X-Profile-Token == PROFILE_ADMIN_TOKEN, or is
+# picked by PROFILE_SAMPLE_RATE. The active profile travels in a context variable (the
+# scheduler copies it into the pipeline thread); stage() records wall/CPU time and the
+# tracemalloc peak of each stage, and pipeline_profile() runs cProfile on the pipeline
+# thread. Token-forced requests, and sampled ones slower than PROFILE_SLOW_MS, are saved
+# to PROFILE_DIR, which keeps the newest PROFILE_KEEP profiles.
+# Child processes (code1 conversion, OCR pool workers) report their own CPU time, which
+# the caller charges to the running stage with add_child_cpu().
+# tracemalloc is process-wide: while any profiled request is running, every allocation in
+# the process (profiled or not) is traced and slower. Its peak can only be measured by one
+# stage at a time, so a stage that overlaps another profiled stage records no peak
+# (peak_mem_kb null) rather than a mixed one.
+
+_active = contextvars.ContextVar("request_profile", default=None)
+_child_cpu = contextvars.ContextVar("child_cpu", default=None)
+_tracing = 0
+_tracing_lock = threading.Lock()
+_peak_lock = threading.Lock()
+
+
+class RequestProfile:
+    def __init__(self, method, path, forced=False):
+        self.id = uuid.uuid4().hex[:16]
+        self.method, self.path, self.forced = method, path, forced
+        self.started_at = time.time()
+        self.stages = []
+        self.profilers = []
+        self._lock = threading.Lock()
+
+    def add_stage(self, record):
+        with self._lock:
+            self.stages.append(record)
+
+    def add_profiler(self, profiler):
+        with self._lock:
+            self.profilers.append(profiler)
+
+    def stats(self):
+        """Merged pstats.Stats of all pipeline threads, or None."""
+        with self._lock:
+            profilers = list(self.profilers)
+        if not profilers:
+            return None
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        return stats
+
+
+def should_profile(token=None):
+    """(profile?, forced?) for a request with the given X-Profile-Token header."""
+    if token and PROFILE_ADMIN_TOKEN and token == PROFILE_ADMIN_TOKEN:
+        return True, True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE, False
+
+
+def is_admin(token):
+    return bool(PROFILE_ADMIN_TOKEN) and token == PROFILE_ADMIN_TOKEN
+
+
+def current():
+    return _active.get()
+
+
+def _start_tracing():
+    global _tracing
+    with _tracing_lock:
+        if _tracing == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing += 1
+
+
+def _stop_tracing():
+    global _tracing
+    with _tracing_lock:
+        _tracing -= 1
+        if _tracing == 0:
+            tracemalloc.stop()
+
+
+@contextmanager
+def request_profile(method, path, forced=False):
+    """Make a new RequestProfile the active one for this block."""
+    profile = RequestProfile(method, path, forced)
+    token = _active.set(profile)
+    _start_tracing()
+    try:
+        yield profile
+    finally:
+        _stop_tracing()
+        _active.reset(token)
+
+
+@contextmanager
+def stage(name, **info):
+    """Record wall time, CPU time and memory peak of a pipeline stage (no-op unless profiled)."""
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    # Only one stage at a time owns the (process-wide) tracemalloc peak
+    tracing = tracemalloc.is_tracing() and _peak_lock.acquire(blocking=False)
+    if tracing:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    children = []
+    token = _child_cpu.set(children)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        _child_cpu.reset(token)
+        peak = None
+        if tracing:
+            peak = round((tracemalloc.get_traced_memory()[1] - base) / 1024, 1)
+            _peak_lock.release()
+        profile.add_stage({
+            "stage": name,
+            **info,
+            "wall_ms": round((time.perf_counter() - wall) * 1000, 1),
+            "cpu_ms": round((time.thread_time() - cpu) * 1000, 1),
+            "child_cpu_ms": round(sum(children) * 1000, 1),
+            "peak_mem_kb": peak,
+        })
+
+
+def add_child_cpu(seconds):
+    """Charge CPU seconds used by a child or pool process to the running stage (no-op unless profiled)."""
+    children = _child_cpu.get()
+    if children is not None:
+        children.append(seconds)
+
+
+@contextmanager
+def pipeline_profile():
+    """Run cProfile on the current (pipeline) thread when the request is profiled."""
+    profile = _active.get()
+    if profile is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is active on this interpreter; keep the stage timings only
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profile.add_profiler(profiler)
+
+
+def finish(profile, status_code, elapsed_ms):
+    """Save the profile if it was forced or slow; returns the saved id or None."""
+    if not profile.forced and elapsed_ms < PROFILE_SLOW_MS:
+        return None
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    stats = profile.stats()
+    top = ""
+    if stats is not None:
+        stats.dump_stats(str(PROFILE_DIR / f"{profile.id}.prof"))
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        top = out.getvalue()
+    summary = {
+        "id": profile.id,
+        "method": profile.method,
+        "path": profile.path,
+        "status_code": status_code,
+        "forced": profile.forced,
+        "started_at": profile.started_at,
+        "elapsed_ms": round(elapsed_ms, 1),
+        "stages": profile.stages,
+        "has_pstats": stats is not None,
+        "top_functions": top,
+    }
+    with open(PROFILE_DIR / f"{profile.id}.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=4)
+    _trim()
+    print(f"🐢 Profiled {profile.method} {profile.path}: {elapsed_ms:.0f} ms → {profile.id}")
+    return profile.id
+
+
+def _trim():
+    saved = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for path in saved[:max(0, len(saved) - PROFILE_KEEP)]:
+        path.unlink(missing_ok=True)
+        path.with_suffix(".prof").unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Saved profiles, newest first (without the per-function listing)."""
+    if not PROFILE_DIR.exists():
+        return []
+    profiles = []
+    for path in sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime, reverse=True):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue  # trimmed or being written
+        summary.pop("top_functions", None)
+        profiles.append(summary)
+    return profiles
+
+
+def _path(profile_id, suffix):
+    if not profile_id.isalnum():
+        return None
+    path = PROFILE_DIR / f"{profile_id}{suffix}"
+    return path if path.exists() else None
+
+
+def load_profile(profile_id):
+    path = _path(profile_id, ".json")
+    if path is None:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def pstats_path(profile_id):
+    """Path of the cProfile dump (open with `python -m pstats` or snakeviz), or None."""
+    return _path(profile_id, ".prof")
@@ -1,84 +1,262 @@
 # backend/run_pipeline.py
 from pathlib import Path
+import hashlib
+import importlib
+import json
+import os
 import shutil
-import backend.code1 as code1
-import backend.code2 as code2
-import backend.code5 as code5
-import backend.code6 as code6
-import backend.code7 as code7
+import time
 
-def run_automated_pipeline(file_path, output_folder):
+# Route documents by type to a field subset / model tier (DOC_ROUTING=0 sends everything to the full prompt)
+DOC_ROUTING = os.getenv("DOC_ROUTING", "1").lower() not in ("0", "false", "no")
+# Prefill fields of known investors from the cross-session profile store (PROFILE_CACHE=0 disables)
+PROFILE_CACHE = os.getenv("PROFILE_CACHE", "1").lower() not in ("0", "false", "no")
+# Reuse extractions of near-duplicate documents (DEDUP=0 disables)
+DEDUP = os.getenv("DEDUP", "1").lower() not in ("0", "false", "no")
+# Strip repeated headers/footers, page numbers and boilerplate before the LLM call (COMPACTION=0 disables)
+COMPACTION = os.getenv("COMPACTION", "1").lower() not in ("0", "false", "no")
+
+# OCR the image-only pages of PDFs (needs pytesseract + tesseract; OCR=0 disables)
+OCR = os.getenv("OCR", "1").lower() not in ("0", "false", "no")
+
+PIPELINE_STATE_FILE = "pipeline_state.json"
+MISSING_MANDATORY_FILE = "missing_mandatory.json"
+
+def _stage(name):
+    """
+    Import a backend stage on first use.
+    Keeps `import backend.run_pipeline` cheap; markitdown/openai load only when needed.
+    """
+    return importlib.import_module(f"backend.{name}")
+
+
+def prewarm():
+    """
+    Load the stage modules and build the document converter and LLM client
+    so the first request does not pay for it.
+    """
+    for name in ("code1", "classifier", "code2", "code5", "code6", "code7"):
+        _stage(name)
+    _stage("code1").get_converter()
+    _stage("code2").get_client()
+    print("🔥 Pipeline pre-warmed (converter + LLM client ready)")
+
+def _source_digest(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_state(file_path, output_folder):
+    """
+    Checkpoints of an unfinished run of this document ({"source", "completed": [stages]}).
+    A finished run or a different source file starts a fresh state.
     """
-    Run code1 → code2.
+    state_file = Path(output_folder) / PIPELINE_STATE_FILE
+    digest = _source_digest(file_path)
+    if state_file.exists():
+        with open(state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("source") == digest and "merged" not in state.get("completed", []):
+            return state
+    return {"source": digest, "completed": []}
+
+
+def mark_done(output_folder, state, stage):
+    """Persist that `stage` finished so a retry after a timeout/crash resumes after it."""
+    if stage not in state["completed"]:
+        state["completed"].append(stage)
+    state["updated_at"] = time.time()
+    with open(Path(output_folder) / PIPELINE_STATE_FILE, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=4)
+
+
+def _resumable(state, output_folder, stage, artifact):
+    if stage in state["completed"] and (Path(output_folder) / artifact).exists():
+        print(f"⏭️ Resuming: {stage} already completed ({artifact})")
+        return True
+    return False
+
+
+def run_automated_pipeline(file_path, output_folder, state=None):
+    """
+    Run code1 → classifier → near-duplicate check / profile lookup → compaction → code2.
     Input: PDF file
     Output: code2_output.json in output_folder
+    state: checkpoints from load_state(); completed code1/code2 outputs are reused
     """
     output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
+    deadlines = _stage("deadlines")
+    profiling = _stage("profiling")
+    state = state or load_state(file_path, output_folder)
 
-    print(f"\n🔹 Running code1 (PDF → text) for {Path(file_path).name}")
-    code1.process(file_path, output_folder)
+    if not _resumable(state, output_folder, "code1", "code1_output.txt"):
+        print(f"\n🔹 Running code1 (PDF → text) for {Path(file_path).name}")
+        deadlines.check()
+        with profiling.stage("code1", document=output_folder.name):
+            if deadlines.CONVERT_TIMEOUT > 0:
+                # Warm child process (converter built once): a hung converter is killed at the deadline or on cancel
+                code1 = _stage("code1")
+                cpu = deadlines.run_in_warm_process(code1.process, (str(file_path), str(output_folder)),
+                                                    deadlines.CONVERT_TIMEOUT, "code1", code1.get_converter)
+                profiling.add_child_cpu(cpu)
+            else:
+                _stage("code1").process(file_path, output_folder)
+        if OCR:
+            with profiling.stage("ocr", document=output_folder.name):
+                _stage("ocr").process(file_path, output_folder)
+        mark_done(output_folder, state, "code1")
+    deadlines.check()
 
-    print(f"🔹 Running code2 (text → extracted JSON) for {Path(file_path).name}")
-    code2.process(output_folder)
+    if DOC_ROUTING:
+        print(f"🔹 Classifying document type for {Path(file_path).name}")
+        route = _stage("classifier").process(output_folder)
+    else:
+        route = {"fields": None, "model": None}
+
+    dup = _stage("dedup").process(output_folder) if DEDUP else {"matched_ref": None}
+    deadlines.check()
+
+    code2 = _stage("code2")
+    if _resumable(state, output_folder, "code2", code2.OUTPUT_FILE):
+        pass
+    elif dup["matched_ref"]:
+        print(f"🔹 Running code2 (text → extracted JSON) for {Path(file_path).name}")
+        # Revised upload: keep unchanged values, re-extract the rest from the changed text only
+        fields = dup["reextract"]
+        if route["fields"] is not None:
+            routed = set(route["fields"])
+            fields = [path for path in fields if path in routed]
+        with profiling.stage("code2", document=output_folder.name):
+            code2.process(
+                output_folder, fields=fields, model=route["model"], known_values=dup["reused"],
+                known_method="llm", document_text=dup["changed_text"],
+            )
+    else:
+        print(f"🔹 Running code2 (text → extracted JSON) for {Path(file_path).name}")
+        known = _stage("profiles").process(output_folder)["known_values"] if PROFILE_CACHE else {}
+        text = _stage("compact").process(output_folder)["text"] if COMPACTION else None
+        with profiling.stage("code2", document=output_folder.name):
+            code2.process(output_folder, fields=route["fields"], model=route["model"], known_values=known,
+                          document_text=text)
+    mark_done(output_folder, state, "code2")
+
+    if DEDUP:
+        _stage("dedup").register(dup["template_id"], dup["ref"], dup["signature"], tenant=dup["tenant"])
 
-    return output_folder / "code2_output.json"
+    return output_folder / code2.OUTPUT_FILE
 
 
-def run_manual_steps(output_folder):
+def run_manual_steps(output_folder, interactive=True):
     """
-    Run code5 → code6 and generate final_output_form_keys_filled.json
+    Run code5 → code6 and generate final_output_form_keys_filled.json.
+    interactive=False (API, batch, workers) skips the code6 prompts: the extracted
+    values are used as they are and the empty mandatory fields are listed in
+    missing_mandatory.json for the user to fill in later.
     """
     output_folder = Path(output_folder)
 
     print(f"\n🔹 Running code5 (map mandatory fields) in {output_folder}")
-    code5.process(output_folder)
+    with _stage("profiling").stage("code5", document=output_folder.name):
+        mapping_file = _stage("code5").process(output_folder)
+
+    if not interactive:
+        missing = _missing_mandatory(mapping_file)
+        with open(output_folder / MISSING_MANDATORY_FILE, "w", encoding="utf-8") as f:
+            json.dump(missing, f, indent=4, ensure_ascii=False)
+        final_output = write_final_output(output_folder)
+        print(f"✅ Final output generated without prompts: {final_output.name} "
+              f"({len(missing)} mandatory fields left empty)")
+        return final_output
 
     print(f"🔹 Running code6 (ask user for empty mandatory/optional fields)")
-    code6.process(output_folder)
+    _stage("code6").process(output_folder)
 
     code6_output = output_folder / "code6_output_form_keys_filled.json"
-    final_output = output_folder / "final_output_form_keys_filled.json"
-
-    if code6_output.exists():
-        shutil.copy(code6_output, final_output)
-        print(f"✅ Final output generated: {final_output.name}")
-    else:
+    if not code6_output.exists():
         raise FileNotFoundError(f"{code6_output} not found after code6 processing")
+    with open(code6_output, "r", encoding="utf-8") as f:
+        user_values = json.load(f)
+
+    final_output = write_final_output(output_folder, user_values)
+    print(f"✅ Final output generated: {final_output.name}")
+    return final_output
+
+
+def _missing_mandatory(mapping_file):
+    """Paths of the code5 mandatory mapping whose value is empty."""
+    with open(mapping_file, "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+    return [path for path, node in _stage("code7").iter_value_nodes(mapping) if node.get("value") in ("", None)]
 
+
+def write_final_output(output_folder, user_values=None):
+    """
+    final_output_form_keys_filled.json = code2 output plus the answers given in code6
+    ({path: value}). Only those answers are tagged method "user"; extracted values keep
+    their own method (code7 treats untagged ones as "llm").
+    """
+    output_folder = Path(output_folder)
+    with open(output_folder / _stage("code2").OUTPUT_FILE, "r", encoding="utf-8") as f:
+        form = json.load(f)
+    nodes = dict(_stage("code7").iter_value_nodes(form))
+    for path, value in (user_values or {}).items():
+        if path in nodes and value not in ("", None, False):
+            nodes[path]["value"] = value
+            nodes[path]["method"] = "user"
+
+    final_output = output_folder / "final_output_form_keys_filled.json"
+    with open(final_output, "w", encoding="utf-8") as f:
+        json.dump(form, f, indent=4, ensure_ascii=False)
     return final_output
 
 
-def run_full_pipeline(file_path, output_folder, session_json_file, override: bool = False):
+def run_full_pipeline(file_path, output_folder, session_json_file, override: bool = False, policy=None,
+                      interactive=True):
     """
     Run full pipeline for a single PDF, integrating session logic.
     - First PDF: run manual steps (code5 → code6)
     - Subsequent PDFs: copy code2_output.json → final_output_form_keys_filled.json
       and merge into session JSON
+    - policy: code7 merge policy ("confidence", "latest", "first"); None follows override
+    - interactive: False never prompts (see run_manual_steps)
     """
     output_folder = Path(output_folder)
     session_json_file = Path(session_json_file)
 
     print(f"\n{'='*70}\n🎯 Processing PDF: {Path(file_path).name}\n{'='*70}\n")
 
-    # Step 1-2: Automated (code1 → code2)
-    run_automated_pipeline(file_path, output_folder)
+    # Step 1-2: Automated (code1 → code2), resuming after stages a failed attempt completed
+    state = load_state(file_path, output_folder)
+    run_automated_pipeline(file_path, output_folder, state)
+    _stage("deadlines").check()
 
     first_pdf = not session_json_file.exists()
 
     if first_pdf:
         print("🆕 First PDF → Running manual steps (code5 → code6)")
-        run_manual_steps(output_folder)
+        run_manual_steps(output_folder, interactive)
     else:
         # Subsequent PDFs: generate final_output_form_keys_filled.json from code2 output
         # by simply mapping extracted values to form_keys
-        src = output_folder / "code2_output.json"
+        src = output_folder / _stage("code2").OUTPUT_FILE
         dest = output_folder / "final_output_form_keys_filled.json"
         shutil.copy(src, dest)
         print(f"📄 Copied code2 output → {dest.name} for subsequent PDF (no manual steps)")
 
     # Merge into session-level JSON
-    code7.merge_pdf_into_session(str(output_folder), str(session_json_file), override)
+    with _stage("profiling").stage("code7", document=output_folder.name):
+        _stage("code7").merge_pdf_into_session(
+            str(output_folder), str(session_json_file), override, policy=policy, method="llm"
+        )
+
+    mark_done(output_folder, state, "merged")
+
+    if PROFILE_CACHE:
+        _stage("profiles").record_session(session_json_file, session_json_file.parent.name)
 
     print(f"\n{'='*70}\n✅ Pipeline Completed for {Path(file_path).name}")
     print(f"Session JSON updated at: {session_json_file}\n{'='*70}\n")
@@ -86,6 +264,42 @@ def run_full_pipeline(file_path, output_folder, session_json_file, override: boo
     return session_json_file
 
 
+def session_json_name(session_name):
+    return f"final_{session_name}_form_keys_filled.json"
+
+
+def run_document(session_name, document, filename, override: bool = False, policy=None):
+    """
+    Run the full pipeline for a document stored at {session}/{document}/{filename}
+    in the configured storage backend. With remote storage the stages run on a
+    local scratch copy and their artifacts are uploaded back afterwards.
+    Runs unattended: the first document of a session does not prompt (code6).
+    """
+    storage = _stage("storage").get_storage()
+    with _stage("profiling").pipeline_profile(), storage.workspace(session_name, document) as session_dir:
+        doc_folder = session_dir / document
+        run_full_pipeline(
+            str(doc_folder / filename), str(doc_folder), str(session_dir / session_json_name(session_name)),
+            override, policy, interactive=False,
+        )
+    return session_json_name(session_name)
+
+
+def remove_document(session_name, document, policy=None):
+    """
+    Withdraw a document from its session and delete its folder. Runs as a pipeline
+    job so it is serialized with the session's merges (scheduler session / queue group).
+    """
+    storage = _stage("storage").get_storage()
+    with storage.workspace(session_name) as session_dir:
+        changed = _stage("code7").remove_document_from_session(
+            document, session_dir / session_json_name(session_name), policy
+        )
+    storage.delete_prefix(f"{session_name}/{document}")
+    _stage("versions").bump_stored(storage, session_name)
+    return changed
+
+
 # CLI support
 if __name__ == "__main__":
     import sys
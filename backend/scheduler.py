@@ -0,0 +1,452 @@
+# backend/scheduler.py
+import contextvars
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+
+# Allow running as a script as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import deadlines
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", os.getenv("BATCH_MAX_WORKERS", "4")))
+TENANT_CONFIG = os.getenv("TENANT_CONFIG", "")
+TOKEN_BUDGET_PER_HOUR = float(os.getenv("TOKEN_BUDGET_PER_HOUR", "0"))  # 0 = unlimited
+BACKFILL_SHARE = float(os.getenv("BACKFILL_SHARE", "0.2"))
+LANES = ("interactive", "backfill")
+JOB_HISTORY = 1000  # finished tasks kept for GET /api/jobs/{id}
+
+# Scheduling model
+#
+# Every task belongs to a tenant (X-Tenant-ID, or the session name), a session and a lane.
+# - Lanes: interactive (API uploads) and backfill (batches) share the workers by smooth
+#   weighted round robin, backfill getting BACKFILL_SHARE of dispatches while both have work.
+# - Tenants: start-time fair queuing inside a lane. A task's tag is
+#   max(lane virtual time, tenant's previous tag) + cost / weight, and the smallest tag runs
+#   first, so a tenant with 300 queued documents cannot delay a newcomer by more than one task.
+# - Sessions: tasks of one session run one at a time and in submission order (the first
+#   document builds the session JSON; code7 merges must not race).
+# - Budgets: code2 calls charge() with its prompt size before the LLM call; a tenant over its
+#   hourly token budget gets BudgetExceeded, and backfill tasks are re-queued until it refills.
+#   Buckets live in this process unless share_budgets() hands them to the job queue backend
+#   (queue mode: workers and API nodes then draw from one bucket per tenant).
+# - Cancellation: cancel() drops a queued task, or signals a running one through its
+#   deadlines.cancel_scope() event; the pipeline stops at the next check and frees the worker.
+
+_tenant = contextvars.ContextVar("tenant", default=None)
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, tenant, tokens, retry_after):
+        super().__init__(f"Token budget of tenant '{tenant}' exhausted ({tokens} tokens needed); "
+                         f"retry in {retry_after:.0f}s")
+        self.tenant = tenant
+        self.tokens = tokens
+        self.retry_after = retry_after
+
+
+def load_tenant_config():
+    """{tenant: {"weight", "tokens_per_hour"}} from the JSON file in TENANT_CONFIG ("default" applies to all)."""
+    config = {"default": {"weight": 1.0, "tokens_per_hour": TOKEN_BUDGET_PER_HOUR}}
+    if TENANT_CONFIG:
+        with open(TENANT_CONFIG, "r", encoding="utf-8") as f:
+            for tenant, settings in json.load(f).items():
+                config.setdefault(tenant, {}).update(settings)
+    return config
+
+
+class TokenBucket:
+    """Hourly token budget refilled continuously; a call may overdraw a full bucket once."""
+
+    def __init__(self, per_hour):
+        self.capacity = per_hour
+        self.level = per_hour
+        self.rate = per_hour / 3600
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, tokens):
+        """Spend tokens; returns 0, or the seconds until they would be available."""
+        self._refill()
+        if self.level >= tokens or self.level >= self.capacity:
+            self.level -= tokens
+            return 0.0
+        return (tokens - self.level) / self.rate
+
+    def adjust(self, delta):
+        self._refill()
+        self.level -= delta
+
+
+class _Budgets:
+    def __init__(self, config):
+        self.config = config
+        self.buckets = {}
+        self.used = defaultdict(int)
+        self.lock = threading.Lock()
+        self.shared = None  # job queue backend holding the buckets (share_budgets)
+
+    def settings(self, tenant):
+        return {**self.config["default"], **self.config.get(tenant, {})}
+
+    def _per_hour(self, tenant):
+        return float(self.settings(tenant).get("tokens_per_hour") or 0)
+
+    def _bucket(self, tenant):
+        per_hour = self._per_hour(tenant)
+        if per_hour <= 0:
+            return None
+        if tenant not in self.buckets:
+            self.buckets[tenant] = TokenBucket(per_hour)
+        return self.buckets[tenant]
+
+    def charge(self, tenant, tokens):
+        if self.shared is not None:
+            wait = self.shared.take_tokens(tenant, tokens, self._per_hour(tenant))
+            if wait:
+                raise BudgetExceeded(tenant, tokens, wait)
+            return
+        with self.lock:
+            bucket = self._bucket(tenant)
+            wait = bucket.take(tokens) if bucket else 0.0
+            if not wait:
+                self.used[tenant] += tokens
+        if wait:
+            raise BudgetExceeded(tenant, tokens, wait)
+
+    def record(self, tenant, estimated, actual):
+        if self.shared is not None:
+            self.shared.take_tokens(tenant, actual - estimated, self._per_hour(tenant), force=True)
+            return
+        with self.lock:
+            bucket = self._bucket(tenant)
+            if bucket:
+                bucket.adjust(actual - estimated)
+            self.used[tenant] += actual - estimated
+
+    def snapshot(self, tenant):
+        if self.shared is not None:
+            per_hour = self._per_hour(tenant)
+            state = self.shared.token_state(tenant, per_hour)
+            return {
+                "tokens_used": state["used"],
+                "tokens_per_hour": per_hour if per_hour > 0 else None,
+                "tokens_available": round(state["level"]) if per_hour > 0 else None,
+            }
+        with self.lock:
+            bucket = self._bucket(tenant)
+            if bucket:
+                bucket._refill()
+            return {
+                "tokens_used": self.used[tenant],
+                "tokens_per_hour": bucket.capacity if bucket else None,
+                "tokens_available": round(bucket.level) if bucket else None,
+            }
+
+
+_budgets = _Budgets(load_tenant_config())
+
+
+def share_budgets(queue):
+    """Keep token budgets in the job queue backend (SQLite/Redis) so all worker processes share them."""
+    _budgets.shared = queue
+
+
+def current_tenant():
+    return _tenant.get()
+
+
+@contextmanager
+def tenant_context(tenant):
+    """Attribute LLM usage in this block to `tenant` (worker processes, CLI runs)."""
+    token = _tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _tenant.reset(token)
+
+
+def charge(tokens):
+    """Spend `tokens` of the current tenant's budget before an LLM call; raises BudgetExceeded."""
+    tenant = _tenant.get()
+    if tenant is not None:
+        _budgets.charge(tenant, tokens)
+
+
+def record_usage(estimated, actual):
+    """Correct the pre-call estimate with the usage the LLM reported."""
+    tenant = _tenant.get()
+    if tenant is not None and actual is not None:
+        _budgets.record(tenant, estimated, actual)
+
+
+class _Task:
+    __slots__ = ("id", "fn", "args", "kwargs", "tenant", "session", "lane", "tag", "seq", "status", "error",
+                 "future", "context", "cancel_event", "not_before", "submitted_at", "finished_at", "defer_on_budget")
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p95": None}
+    return {"p50": round(values[len(values) // 2], 1), "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1)}
+
+
+class Scheduler:
+    """In-process pipeline scheduler (see the module comment for the policy)."""
+
+    def __init__(self, workers=PIPELINE_WORKERS, backfill_share=BACKFILL_SHARE):
+        self.workers = workers
+        self.lane_weights = {"interactive": 1.0 - backfill_share, "backfill": backfill_share}
+        self._cond = threading.Condition()
+        # Only the first unfinished task of a session may run, so the pending tasks worth
+        # looking at are the session heads: _ready[lane] = {session key: head task} for heads
+        # that are queued or deferred (sessionless tasks are their own session).
+        self._sessions = defaultdict(deque)  # session key -> tasks in submission order
+        self._ready = {lane: {} for lane in LANES}
+        self._queued = defaultdict(int)  # (lane, tenant) -> queued or deferred tasks
+        self._vtime = {lane: 0.0 for lane in LANES}
+        self._last_tag = {}
+        self._credit = {lane: 0.0 for lane in LANES}
+        self._seq = itertools.count()
+        self._threads = []
+        self._jobs = {}  # id -> task, pending/running plus the last JOB_HISTORY finished
+        self._history = deque()  # finished ids, oldest first
+        self._stats = defaultdict(lambda: {
+            "submitted": 0, "running": 0, "completed": 0, "failed": 0, "deferred": 0, "cancelled": 0,
+            "wait_ms": deque(maxlen=1000), "run_ms": deque(maxlen=1000),
+        })
+
+    def submit(self, fn, *args, tenant, session=None, lane="interactive", cost=1.0, defer_on_budget=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs); returns a concurrent.futures.Future whose
+        `job_id` attribute identifies the task for get()/cancel().
+        Over-budget tasks are re-queued until the budget refills when defer_on_budget
+        (default: backfill lane only); otherwise the future gets the BudgetExceeded.
+        """
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane '{lane}', expected one of {LANES}")
+        task = _Task()
+        task.id = uuid.uuid4().hex
+        task.fn, task.args, task.kwargs = fn, args, kwargs
+        task.tenant, task.session, task.lane = tenant, session, lane
+        task.status, task.error = "queued", None
+        task.future = Future()
+        task.future.job_id = task.id
+        task.context = contextvars.copy_context()  # e.g. the request's profiling.request_profile()
+        task.cancel_event = threading.Event()
+        task.not_before = 0.0
+        task.submitted_at = time.time()
+        task.finished_at = None
+        task.defer_on_budget = lane == "backfill" if defer_on_budget is None else defer_on_budget
+        weight = float(_budgets.settings(tenant).get("weight", 1.0)) or 1.0
+        with self._cond:
+            self._ensure_workers()
+            start = max(self._vtime[lane], self._last_tag.get((lane, tenant), 0.0))
+            task.tag = start + cost / weight
+            self._last_tag[(lane, tenant)] = task.tag
+            task.seq = next(self._seq)
+            key = self._key(task)
+            self._sessions[key].append(task)
+            if len(self._sessions[key]) == 1:
+                self._ready[lane][key] = task
+            self._queued[(lane, tenant)] += 1
+            self._jobs[task.id] = task
+            self._stats[tenant]["submitted"] += 1
+            self._cond.notify()
+        return task.future
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._work, name=f"pipeline-{len(self._threads)}", daemon=True)
+            self._threads.append(t)
+            t.start()
+
+    @staticmethod
+    def _key(task):
+        return task.session if task.session is not None else task.id
+
+    def _pick(self, now):
+        """Next task to run (or None) and how long to sleep before a deferred task becomes due."""
+        candidates = {}
+        wake = None
+        for lane, heads in self._ready.items():
+            for t in heads.values():
+                if t.not_before > now:
+                    wake = min(wake or t.not_before, t.not_before)
+                elif lane not in candidates or (t.tag, t.seq) < (candidates[lane].tag, candidates[lane].seq):
+                    candidates[lane] = t
+        if not candidates:
+            return None, (wake - now if wake else None)
+
+        # Smooth weighted round robin between lanes that have runnable work
+        total = sum(self.lane_weights[lane] for lane in candidates)
+        for lane in candidates:
+            self._credit[lane] += self.lane_weights[lane]
+        lane = max(candidates, key=lambda l: (self._credit[l], l == "interactive"))
+        self._credit[lane] -= total
+        return candidates[lane], None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while True:
+                    task, wake = self._pick(time.time())
+                    if task is not None:
+                        break
+                    self._cond.wait(timeout=wake)
+                del self._ready[task.lane][self._key(task)]
+                self._queued[(task.lane, task.tenant)] -= 1
+                # A deferred task's future is already running; waiters keep waiting on it
+                if not task.future.running() and not task.future.set_running_or_notify_cancel():
+                    self._finish(task, "cancelled")
+                    continue
+                task.status = "running"
+                self._vtime[task.lane] = max(self._vtime[task.lane], task.tag - 1e-9)
+                stats = self._stats[task.tenant]
+                stats["running"] += 1
+                stats["wait_ms"].append((time.time() - task.submitted_at) * 1000)
+
+            started = time.time()
+            deferred = False
+            try:
+                result = task.context.run(self._call, task)
+            except BudgetExceeded as e:
+                if task.defer_on_budget:
+                    deferred = True
+                    task.not_before = time.time() + e.retry_after
+                    print(f"⏳ Tenant '{task.tenant}' over token budget → task deferred {e.retry_after:.0f}s")
+                else:
+                    task.future.set_exception(e)
+            except BaseException as e:
+                task.future.set_exception(e)
+            else:
+                task.future.set_result(result)
+
+            with self._cond:
+                stats["running"] -= 1
+                if deferred and not task.cancel_event.is_set():
+                    # Keeps its tag (place in line) and its session slot; the future stays unresolved
+                    stats["deferred"] += 1
+                    task.status = "deferred"
+                    self._ready[task.lane][self._key(task)] = task
+                    self._queued[(task.lane, task.tenant)] += 1
+                else:
+                    if deferred:
+                        task.future.set_exception(deadlines.Cancelled("Job cancelled"))
+                    error = task.future.exception()
+                    status = ("cancelled" if isinstance(error, deadlines.Cancelled)
+                              else "failed" if error else "succeeded")
+                    stats["run_ms"].append((time.time() - started) * 1000)
+                    self._finish(task, status, error)
+                self._cond.notify_all()
+
+    @staticmethod
+    def _call(task):
+        with tenant_context(task.tenant), deadlines.cancel_scope(task.cancel_event):
+            return task.fn(*task.args, **task.kwargs)
+
+    def _finish(self, task, status, error=None):
+        task.status, task.finished_at = status, time.time()
+        task.error = str(error) if error else None
+        stats = self._stats[task.tenant]
+        stats[{"succeeded": "completed"}.get(status, status)] += 1
+        key = self._key(task)
+        queue = self._sessions[key]
+        queue.remove(task)
+        if not queue:
+            del self._sessions[key]
+        elif queue[0].status in ("queued", "deferred"):
+            self._ready[queue[0].lane][key] = queue[0]
+        task.fn = task.args = task.kwargs = task.context = None
+        self._history.append(task.id)
+        while len(self._history) > JOB_HISTORY:
+            del self._jobs[self._history.popleft()]
+
+    def get(self, job_id):
+        """Status of a task, or None if unknown (or long finished)."""
+        with self._cond:
+            task = self._jobs.get(job_id)
+            if task is None:
+                return None
+            return {
+                "id": task.id, "tenant": task.tenant, "session": task.session, "lane": task.lane,
+                "status": task.status, "error": task.error,
+                "created_at": task.submitted_at, "finished_at": task.finished_at,
+            }
+
+    def cancel(self, job_id):
+        """
+        Cancel a task: a queued/deferred one is dropped at once, a running one is
+        signalled and stops at its next cancellation check. Returns the new status,
+        or None if the task is unknown.
+        """
+        with self._cond:
+            task = self._jobs.get(job_id)
+            if task is None:
+                return None
+            if task.status in ("queued", "deferred"):
+                key = self._key(task)
+                if self._ready[task.lane].get(key) is task:
+                    del self._ready[task.lane][key]
+                self._queued[(task.lane, task.tenant)] -= 1
+                if not task.future.cancel():
+                    task.future.set_exception(deadlines.Cancelled("Job cancelled"))
+                self._finish(task, "cancelled")
+                self._cond.notify_all()
+            elif task.status == "running":
+                task.cancel_event.set()
+                task.status = "cancelling"
+            return task.status
+
+    def stats(self):
+        """Per-tenant and per-lane counters with queue wait / run time percentiles (recent tasks)."""
+        with self._cond:
+            queued = defaultdict(int)
+            lanes = {lane: {"queued": 0, "weight": self.lane_weights[lane]} for lane in LANES}
+            for (lane, tenant), n in self._queued.items():
+                lanes[lane]["queued"] += n
+                queued[tenant] += n
+            tenants = {}
+            for tenant, s in self._stats.items():
+                tenants[tenant] = {
+                    "queued": queued[tenant],
+                    **{k: s[k] for k in ("submitted", "running", "completed", "failed", "deferred", "cancelled")},
+                    "wait_ms": list(s["wait_ms"]),
+                    "run_ms": list(s["run_ms"]),
+                }
+        # Budget snapshots may query the shared queue backend: never while holding the lock
+        for tenant, entry in tenants.items():
+            entry.update(
+                wait_ms=_percentiles(entry["wait_ms"]),
+                run_ms=_percentiles(entry["run_ms"]),
+                weight=float(_budgets.settings(tenant).get("weight", 1.0)),
+                **_budgets.snapshot(tenant),
+            )
+        return {"workers": self.workers, "lanes": lanes, "tenants": tenants}
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler (worker threads start on first submit)."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
@@ -0,0 +1,314 @@
+# backend/storage.py
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path, PurePosixPath
+
+try:
+    import fcntl
+except ImportError:  # Windows: update_file() is only atomic within the process
+    fcntl = None
+
+STORAGE_URL = os.getenv("STORAGE_URL", "file://samples")
+CHUNK_SIZE = 1024 * 1024
+
+# Session state lives under keys "{session}/{file}" and "{session}/{document}/{file}".
+# LocalStorage maps keys onto the samples/ tree; S3Storage onto objects in a bucket.
+# Pipeline stages work on local paths: `workspace()` gives them a local copy of a
+# session (or the real folder when storage is already local) and pushes changes back.
+# Counters (versions.VERSION_FILE) are read-modify-written in place with `update()`,
+# never through a workspace upload, so concurrent writers cannot lose increments.
+WORKSPACE_SKIP = ("session_version.json",)
+UPDATE_ATTEMPTS = 20
+
+_update_locks = {}
+_update_locks_guard = threading.Lock()
+_origins = {}  # scratch session dir -> (store, session name) while an S3 workspace is open
+
+
+def workspace_origin(path):
+    """(store, session_name) when `path` is the scratch copy of a remote session, else None."""
+    return _origins.get(str(Path(path)))
+
+
+def update_file(path, fn):
+    """
+    Atomic read-modify-write of a local file, across threads and processes
+    (flock on a sidecar lock file): fn(old bytes or None) -> new bytes.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with _update_locks_guard:
+        thread_lock = _update_locks.setdefault(str(path.resolve()), threading.Lock())
+    with thread_lock, open(path.with_name(f".{path.name}.lock"), "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        old = path.read_bytes() if path.exists() else None
+        data = fn(old)
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+    return data
+
+
+def _clean_key(key):
+    parts = PurePosixPath(key).parts
+    # "." / "./" have no parts and would resolve to the storage root
+    if not parts or any(p in ("..", "") for p in parts) or key.startswith("/"):
+        raise ValueError(f"Invalid storage key '{key}'")
+    return "/".join(parts)
+
+
+class LocalStorage:
+    """Storage on the local (or shared, e.g. NFS) filesystem."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def local_path(self, key=""):
+        return self.root / _clean_key(key) if key else self.root
+
+    def exists(self, key):
+        return self.local_path(key).is_file()
+
+    def exists_dir(self, prefix):
+        return self.local_path(prefix.rstrip("/")).is_dir()
+
+    def open_read(self, key):
+        return open(self.local_path(key), "rb")
+
+    def iter_chunks(self, key, chunk_size=CHUNK_SIZE):
+        with self.open_read(key) as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+
+    def write_stream(self, key, fileobj):
+        path = self.local_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+
+    def write_bytes(self, key, data):
+        path = self.local_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    def update(self, key, fn):
+        """Atomic read-modify-write of a small file: fn(old bytes or None) -> new bytes."""
+        return update_file(self.local_path(key), fn)
+
+    def list_dirs(self, prefix=""):
+        base = self.local_path(prefix.rstrip("/"))
+        if not base.is_dir():
+            return []
+        return sorted(d.name for d in base.iterdir() if d.is_dir() and not d.name.startswith("."))
+
+    def list_files(self, prefix=""):
+        base = self.local_path(prefix.rstrip("/"))
+        if not base.is_dir():
+            return []
+        return sorted(f.name for f in base.iterdir() if f.is_file())
+
+    def delete_prefix(self, prefix):
+        path = self.root / _clean_key(prefix)
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        elif path.exists():
+            path.unlink()
+
+    async def adelete_prefix(self, prefix):
+        """
+        Hide the folder instantly by renaming it to a tombstone, then remove it
+        off the event loop.
+        """
+        path = self.root / _clean_key(prefix)
+        if not path.exists():
+            return
+        tombstone = path.with_name(f".deleting-{path.name}-{uuid.uuid4().hex[:8]}")
+        path.rename(tombstone)
+        await asyncio.to_thread(shutil.rmtree, tombstone, True)
+
+    @contextmanager
+    def workspace(self, session_name, document=None):
+        path = self.local_path(session_name)
+        path.mkdir(parents=True, exist_ok=True)
+        yield path
+
+
+class S3Storage:
+    """S3-compatible object storage (AWS S3, MinIO, ...); needs the `boto3` package."""
+
+    DELETE_BATCH = 1000  # S3 DeleteObjects limit
+
+    def __init__(self, bucket, prefix="", endpoint_url=None, client=None):
+        if client is None:
+            import boto3  # optional dependency, only needed for object storage
+            client = boto3.client("s3", endpoint_url=endpoint_url or os.getenv("S3_ENDPOINT_URL") or None)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+
+    def _obj(self, key):
+        key = _clean_key(key)
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def _dir(self, prefix):
+        prefix = prefix.strip("/")
+        full = "/".join(p for p in (self.prefix, _clean_key(prefix) if prefix else "") if p)
+        return f"{full}/" if full else ""
+
+    def local_path(self, key=""):
+        return None
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._obj(key))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def exists_dir(self, prefix):
+        resp = self.client.list_objects_v2(Bucket=self.bucket, Prefix=self._dir(prefix), MaxKeys=1)
+        return resp.get("KeyCount", 0) > 0
+
+    def open_read(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=self._obj(key))["Body"]
+
+    def iter_chunks(self, key, chunk_size=CHUNK_SIZE):
+        body = self.open_read(key)
+        try:
+            yield from body.iter_chunks(chunk_size)
+        finally:
+            body.close()
+
+    def write_stream(self, key, fileobj):
+        # upload_fileobj streams in multipart chunks instead of buffering the whole file
+        self.client.upload_fileobj(fileobj, self.bucket, self._obj(key))
+
+    def write_bytes(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self._obj(key), Body=data)
+
+    def update(self, key, fn):
+        """
+        Atomic read-modify-write of a small object: fn(old bytes or None) -> new bytes,
+        stored with a conditional put (If-Match on the ETag read, If-None-Match for a new
+        object) and retried when another writer got there first.
+        """
+        for attempt in range(UPDATE_ATTEMPTS):
+            try:
+                obj = self.client.get_object(Bucket=self.bucket, Key=self._obj(key))
+                old, condition = obj["Body"].read(), {"IfMatch": obj["ETag"]}
+            except self.client.exceptions.NoSuchKey:
+                old, condition = None, {"IfNoneMatch": "*"}
+            data = fn(old)
+            try:
+                self.client.put_object(Bucket=self.bucket, Key=self._obj(key), Body=data, **condition)
+                return data
+            except self.client.exceptions.ClientError as e:
+                if e.response.get("Error", {}).get("Code") not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    raise
+            time.sleep(random.uniform(0, 0.02 * (attempt + 1)))
+        raise RuntimeError(f"Could not update '{key}': too many concurrent writers")
+
+    def _list(self, prefix, delimiter="/"):
+        paginator = self.client.get_paginator("list_objects_v2")
+        kwargs = {"Bucket": self.bucket, "Prefix": self._dir(prefix)}
+        if delimiter:
+            kwargs["Delimiter"] = delimiter
+        for page in paginator.paginate(**kwargs):
+            yield page
+
+    def list_dirs(self, prefix=""):
+        base = self._dir(prefix)
+        names = set()
+        for page in self._list(prefix):
+            for p in page.get("CommonPrefixes", []):
+                names.add(p["Prefix"][len(base):].rstrip("/"))
+        return sorted(n for n in names if n and not n.startswith("."))
+
+    def list_files(self, prefix=""):
+        base = self._dir(prefix)
+        return sorted(o["Key"][len(base):] for page in self._list(prefix) for o in page.get("Contents", []))
+
+    def _iter_keys(self, prefix):
+        for page in self._list(prefix, delimiter=None):
+            for o in page.get("Contents", []):
+                yield o["Key"]
+
+    def delete_prefix(self, prefix):
+        _clean_key(prefix)  # never the whole bucket prefix
+        batch = []
+        for key in self._iter_keys(prefix):
+            batch.append({"Key": key})
+            if len(batch) == self.DELETE_BATCH:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch, "Quiet": True})
+                batch = []
+        if batch:
+            self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": batch, "Quiet": True})
+
+    async def adelete_prefix(self, prefix):
+        await asyncio.to_thread(self.delete_prefix, prefix)
+
+    @contextmanager
+    def workspace(self, session_name, document=None):
+        """
+        Local scratch copy of the session-level files (plus one document folder),
+        uploading every file that was created or modified when the block exits.
+        """
+        with tempfile.TemporaryDirectory(prefix="pipeline-") as tmp:
+            session_dir = Path(tmp) / session_name
+            session_dir.mkdir(parents=True)
+            prefixes = [session_name] + ([f"{session_name}/{document}"] if document else [])
+            for prefix in prefixes:
+                for name in self.list_files(prefix):
+                    dest = Path(tmp) / prefix / name
+                    dest.parent.mkdir(parents=True, exist_ok=True)
+                    self.client.download_file(self.bucket, self._obj(f"{prefix}/{name}"), str(dest))
+            before = {p: p.stat().st_mtime_ns for p in session_dir.rglob("*") if p.is_file()}
+
+            _origins[str(session_dir)] = (self, session_name)
+            try:
+                yield session_dir
+            finally:
+                _origins.pop(str(session_dir), None)
+                # Upload even on failure so finished stages' artifacts are kept
+                self._upload_changed(tmp, session_dir, before)
+
+    def _upload_changed(self, tmp, session_dir, before):
+        for path in session_dir.rglob("*"):
+            if path.name in WORKSPACE_SKIP:
+                continue  # bumped in the bucket directly (versions.bump)
+            if path.is_file() and before.get(path) != path.stat().st_mtime_ns:
+                key = path.relative_to(tmp).as_posix()
+                self.client.upload_file(str(path), self.bucket, self._obj(key))
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """
+    Storage backend for STORAGE_URL: file://path (default file://samples) or s3://bucket/prefix.
+    """
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = open_storage(STORAGE_URL)
+        return _storage
+
+
+def open_storage(url):
+    if url.startswith("file://"):
+        return LocalStorage(url[len("file://"):])
+    if url.startswith("s3://"):
+        bucket, _, prefix = url[len("s3://"):].partition("/")
+        return S3Storage(bucket, prefix)
+    raise ValueError(f"Unsupported STORAGE_URL '{url}'")
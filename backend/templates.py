@@ -0,0 +1,137 @@
+# backend/templates.py
+import copy
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent
+TEMPLATES_DIR = Path(os.getenv("TEMPLATES_DIR", BASE_DIR / "templates"))
+DEFAULT_TEMPLATE = "default"
+SESSION_TEMPLATE_FILE = "session_template.json"
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CompiledTemplate:
+    """
+    A form template compiled once: schema, mandatory map, flattened field list
+    and the pre-rendered field-description block used in the code2 prompt.
+    """
+
+    def __init__(self, template_id, form_keys, mandatory, signature):
+        self.template_id = template_id
+        self.form_keys = form_keys
+        self.mandatory = mandatory
+        self.signature = signature
+        self.fields = collect_fields(form_keys)
+        self.prompt_block = "".join(f'- {f["path"]}: {f["description"]}\n' for f in self.fields)
+
+    def new_form(self):
+        """Fresh, mutable copy of the schema for filling in."""
+        return copy.deepcopy(self.form_keys)
+
+    def prompt_block_for(self, paths):
+        """Field-description block restricted to the given field paths."""
+        paths = set(paths)
+        return "".join(f'- {f["path"]}: {f["description"]}\n' for f in self.fields if f["path"] in paths)
+
+
+def collect_fields(form_dict, parent=""):
+    """Flatten fields for GPT (path + description); description falls back to the key name."""
+    fields = []
+    for k, v in form_dict.items():
+        path = f"{parent}.{k}" if parent else k
+        if isinstance(v, dict) and "value" in v:
+            fields.append({"path": path, "description": v.get("description", k)})
+        elif isinstance(v, dict):
+            fields.extend(collect_fields(v, path))
+    return fields
+
+
+def template_files(template_id):
+    """
+    Return (form_keys_path, mandatory_path) for a template.
+    The default template is the repo-level form_keys.json / mandatory.json;
+    others live in templates/{template_id}/.
+    """
+    if template_id == DEFAULT_TEMPLATE:
+        return BASE_DIR / "form_keys.json", BASE_DIR / "mandatory.json"
+    if not template_id or Path(template_id).name != template_id or template_id.startswith("."):
+        raise ValueError(f"Invalid template id '{template_id}'")
+    folder = TEMPLATES_DIR / template_id
+    return folder / "form_keys.json", folder / "mandatory.json"
+
+
+def list_templates():
+    templates = [DEFAULT_TEMPLATE]
+    if TEMPLATES_DIR.is_dir():
+        templates += sorted(d.name for d in TEMPLATES_DIR.iterdir() if (d / "form_keys.json").exists())
+    return templates
+
+
+def _stat(path):
+    if not path.exists():
+        return None
+    st = path.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _digest(path):
+    if not path.exists():
+        return None
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def get_template(template_id=None):
+    """
+    Return the compiled template, recompiling only when its files changed.
+    A changed mtime/size triggers a hash check; the template is rebuilt only if the content differs.
+    """
+    template_id = template_id or DEFAULT_TEMPLATE
+    form_path, mandatory_path = template_files(template_id)
+    if not form_path.exists():
+        raise FileNotFoundError(f"Template '{template_id}' not found ({form_path})")
+
+    stats = (_stat(form_path), _stat(mandatory_path))
+    with _cache_lock:
+        entry = _cache.get(template_id)
+        if entry and entry["stats"] == stats:
+            return entry["template"]
+
+        digests = (_digest(form_path), _digest(mandatory_path))
+        if entry and entry["template"].signature == digests:
+            entry["stats"] = stats
+            return entry["template"]
+
+        with open(form_path, "r", encoding="utf-8") as f:
+            form_keys = json.load(f)
+        mandatory = {}
+        if mandatory_path.exists():
+            with open(mandatory_path, "r", encoding="utf-8") as f:
+                mandatory = json.load(f)
+
+        template = CompiledTemplate(template_id, form_keys, mandatory, digests)
+        _cache[template_id] = {"stats": stats, "template": template}
+        print(f"🧩 Compiled template '{template_id}' ({len(template.fields)} fields)")
+        return template
+
+
+def bind_session(storage, session_name, template_id):
+    """Record which template a session uses (validates that it exists)."""
+    template_id = template_id or DEFAULT_TEMPLATE
+    get_template(template_id)
+    storage.write_bytes(f"{session_name}/{SESSION_TEMPLATE_FILE}",
+                        json.dumps({"template_id": template_id}, indent=4).encode("utf-8"))
+    return template_id
+
+
+def session_template_id(session_path):
+    """Template bound to a session folder, or the default template."""
+    marker = Path(session_path) / SESSION_TEMPLATE_FILE
+    if marker.exists():
+        with open(marker, "r", encoding="utf-8") as f:
+            return json.load(f).get("template_id", DEFAULT_TEMPLATE)
+    return DEFAULT_TEMPLATE
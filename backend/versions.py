@@ -0,0 +1,109 @@
+# backend/versions.py
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+
+from backend import storage as storage_backend
+
+VERSION_FILE = "session_version.json"
+VERSION_HISTORY = int(os.getenv("VERSION_HISTORY", "500"))
+
+# A session's version file: {"id": ..., "version": N, "changes": [[version, [field paths]], ...]}.
+# "id" changes when a session is re-created under the same name, so ETags never collide.
+# API handlers and pipeline workers (possibly other processes or hosts) bump the same
+# session concurrently, so every bump is an atomic read-modify-write in the storage
+# backend (storage.update_file / S3 conditional put). Inside an S3 workspace the bump
+# goes to the bucket and the version file is never uploaded from the scratch copy.
+
+
+def _empty():
+    return {"id": "", "version": 0, "changes": []}
+
+
+def _next(state, paths):
+    state = dict(state)
+    state["id"] = state.get("id") or uuid.uuid4().hex[:12]
+    state["version"] = state.get("version", 0) + 1
+    state["changes"] = (state.get("changes", []) + [[state["version"], sorted(set(paths))]])[-VERSION_HISTORY:]
+    return state
+
+
+def read(session_dir):
+    """Version state of a local session folder."""
+    path = Path(session_dir) / VERSION_FILE
+    if not path.exists():
+        return _empty()
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _bumper(paths):
+    def bump_state(old):
+        return json.dumps(_next(json.loads(old) if old else _empty(), paths)).encode("utf-8")
+    return bump_state
+
+
+def bump(session_dir, paths=()):
+    """
+    Record a change (optionally the changed field paths) in a session folder; returns the new version.
+    For the scratch copy of a remote session the bump is made in the storage backend.
+    """
+    session_dir = Path(session_dir)
+    origin = storage_backend.workspace_origin(session_dir)
+    if origin is not None:
+        data = origin[0].update(f"{origin[1]}/{VERSION_FILE}", _bumper(paths))
+        (session_dir / VERSION_FILE).write_bytes(data)  # local readers; never uploaded
+    else:
+        data = storage_backend.update_file(session_dir / VERSION_FILE, _bumper(paths))
+    return json.loads(data)["version"]
+
+
+def load(store, session_name):
+    """Version state of a session read through the storage backend (no workspace copy)."""
+    key = f"{session_name}/{VERSION_FILE}"
+    if not store.exists(key):
+        return _empty()
+    f = store.open_read(key)
+    try:
+        return json.loads(f.read().decode("utf-8"))
+    finally:
+        f.close()
+
+
+def bump_stored(store, session_name, paths=()):
+    """bump() for callers that only hold a storage backend (API handlers)."""
+    data = store.update(f"{session_name}/{VERSION_FILE}", _bumper(paths))
+    return json.loads(data)["version"]
+
+
+def changed_since(state, since):
+    """
+    Field paths changed after version `since`, or None when the retained
+    history does not reach back that far (the caller must send everything).
+    """
+    if since >= state["version"]:
+        return set()
+    changes = state.get("changes", [])
+    if not changes or changes[0][0] > since + 1:
+        return None
+    paths = set()
+    for version, changed in changes:
+        if version > since:
+            paths.update(changed)
+    return paths
+
+
+def etag(state, *extra):
+    """Weak ETag for a representation derived from the session at this version."""
+    tag = ".".join([state.get("id") or "0", str(state.get("version", 0)), *map(str, extra)])
+    return f'W/"{tag}"'
+
+
+def combined_etag(states):
+    """Weak ETag over several sessions' versions ({session_name: state}), e.g. for the session list."""
+    digest = hashlib.sha1(json.dumps(
+        sorted((name, state.get("id", ""), state.get("version", 0)) for name, state in states.items())
+    ).encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
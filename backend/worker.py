@@ -0,0 +1,113 @@
+# backend/worker.py
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Allow running as a script (python backend/worker.py) as well as a package module
+if __package__ in (None, ""):
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from backend import deadlines, job_queue, run_pipeline, scheduler
+
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1.0"))
+# Also bounds how long a cancelled job keeps running before the worker notices
+HEARTBEAT_INTERVAL = float(os.getenv("HEARTBEAT_INTERVAL", "5.0"))
+
+
+def run_job(payload, cancel_event=None):
+    """
+    Execute one document job. Inputs and artifacts go through the storage
+    backend (STORAGE_URL), so workers need no disk shared with the API nodes.
+    Setting `cancel_event` stops the pipeline at its next check (deadlines.Cancelled).
+    """
+    with scheduler.tenant_context(payload.get("tenant") or payload["session_name"]), \
+            deadlines.cancel_scope(cancel_event or threading.Event()):
+        if payload.get("kind") == "remove_document":
+            changed = run_pipeline.remove_document(payload["session_name"], payload["document"], payload.get("policy"))
+            return {"recomputed_fields": changed}
+        session_json = run_pipeline.run_document(
+            payload["session_name"], payload["document"], payload["filename"],
+            payload.get("override", False), payload.get("policy"),
+        )
+    return {"session_json": session_json}
+
+
+def _heartbeat(queue, job, stop, cancel):
+    interval = max(min(queue.visibility_timeout / 3, HEARTBEAT_INTERVAL), 0.5)
+    while not stop.wait(interval):
+        if not queue.extend(job["id"], job["lease_token"]):
+            # Cancelled through the API, or the lease expired and another worker may own it
+            print(f"⚠️ Lost lease on job {job['id']} → stopping it")
+            cancel.set()
+            return
+
+
+def work(queue, worker_id, once=False, stop=None):
+    """
+    Lease jobs and run them until `stop` is set (or the queue is empty when once=True).
+    """
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        job = queue.lease(worker_id)
+        if job is None:
+            if once:
+                return
+            stop.wait(POLL_INTERVAL)
+            continue
+
+        print(f"🛠️ [{worker_id}] job {job['id']} (attempt {job['attempts']}): {job['payload'].get('document')}")
+        beat_stop, cancel = threading.Event(), threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(queue, job, beat_stop, cancel), daemon=True)
+        beat.start()
+        try:
+            result = run_job(job["payload"], cancel)
+            queue.ack(job["id"], job["lease_token"], result)
+            print(f"✅ [{worker_id}] job {job['id']} done")
+        except scheduler.BudgetExceeded as e:
+            queue.defer(job["id"], job["lease_token"], e.retry_after, str(e))
+            print(f"⏳ [{worker_id}] job {job['id']} deferred: {e}")
+        except deadlines.Cancelled:
+            queue.fail(job["id"], job["lease_token"], "cancelled")
+            print(f"🚫 [{worker_id}] job {job['id']} cancelled")
+        except Exception as e:
+            queue.fail(job["id"], job["lease_token"], str(e))
+            print(f"❌ [{worker_id}] job {job['id']} failed: {e}")
+        finally:
+            beat_stop.set()
+            beat.join()
+
+
+def main(concurrency=1, once=False):
+    queue = job_queue.get_queue()
+    # Token budgets are per tenant across all workers, not per worker process
+    scheduler.share_budgets(queue)
+    base_id = f"{socket.gethostname()}:{os.getpid()}"
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=work, args=(queue, f"{base_id}:{i}", once, stop), name=f"worker-{i}")
+        for i in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    print(f"👷 {concurrency} worker thread(s) polling {job_queue.JOB_QUEUE_URL}")
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+    except KeyboardInterrupt:
+        print("🛑 Stopping workers after current jobs...")
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+# CLI support
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run pipeline workers against the shared job queue")
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "1")))
+    parser.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    args = parser.parse_args()
+    main(args.concurrency, args.once)
@@ -1,13 +1,17 @@
 # main.py
+import asyncio
 import os
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+from fastapi import FastAPI, File, Form, Header, UploadFile, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
-import shutil
-from typing import List
+import json
+import threading
+import time
+import zipfile
+from typing import List, Optional
 
 # Backend pipeline
-from backend import run_pipeline
+from backend import run_pipeline, batch, code7, deadlines, job_queue, profiling, scheduler, storage as storage_backend, templates, versions
 
 # ==================== App Setup ====================
 app = FastAPI(title="Document Processing Pipeline", version="1.0.0")
@@ -21,104 +25,467 @@ app.add_middleware(
 )
 
 # Serve frontend (optional)
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 app.mount("/static", Path("frontend/static"), name="static")
 
 # ==================== Config ====================
-SAMPLES_DIR = Path("samples")
-SAMPLES_DIR.mkdir(exist_ok=True)
+# Session state lives in the storage backend (STORAGE_URL, default: local samples/ tree)
+storage = storage_backend.get_storage()
+ALLOWED_EXTENSIONS = {'.pdf', '.csv', '.xlsx', '.docx', '.json'}
+# Batch archives: limits on the uncompressed size and number of entries (zip bombs)
+BATCH_MAX_ARCHIVE_BYTES = int(os.getenv("BATCH_MAX_ARCHIVE_BYTES", str(2 * 1024 ** 3)))
+BATCH_MAX_ENTRIES = int(os.getenv("BATCH_MAX_ENTRIES", "5000"))
+# Polled endpoints carry ETags; no-cache makes browsers revalidate (If-None-Match → 304) on every fetch
+CACHE_HEADERS = {"Cache-Control": "no-cache"}
 
 # ==================== Helpers ====================
-def get_session_path(session_name: str) -> Path:
-    return SAMPLES_DIR / session_name
+def session_exists(session_name: str) -> bool:
+    try:
+        return storage.exists_dir(session_name)
+    except ValueError:
+        return False
+
+def save_document(session_name: str, filename: str, fileobj) -> str:
+    """Stream an uploaded file to {session}/{doc_name}/{filename} and return the document name."""
+    doc_name = Path(filename).stem
+    storage.write_stream(f"{session_name}/{doc_name}/{filename}", fileobj)
+    versions.bump_stored(storage, session_name)
+    return doc_name
+
+def document_statuses(session_name: str):
+    docs = storage.list_dirs(session_name)
+    return [{"document_name": d, "status": "processed" if storage.exists(f"{session_name}/{d}/processed_{d}.json") else "pending"} for d in docs]
+
+def read_archive(fileobj):
+    """
+    Group the files of a batch zip by top-level folder (session name):
+    {session_name: [(filename, zipfile, info)]}. Raises ValueError for an invalid
+    archive or one over BATCH_MAX_ENTRIES / BATCH_MAX_ARCHIVE_BYTES. Reads are bounded
+    by the declared sizes (zipfile stops at file_size and checks the CRC).
+    """
+    try:
+        zf = zipfile.ZipFile(fileobj)
+    except zipfile.BadZipFile:
+        raise ValueError("Archive is not a valid zip file")
+    infos = zf.infolist()
+    if len(infos) > BATCH_MAX_ENTRIES:
+        raise ValueError(f"Archive has more than {BATCH_MAX_ENTRIES} entries")
+    if sum(info.file_size for info in infos) > BATCH_MAX_ARCHIVE_BYTES:
+        raise ValueError(f"Archive expands to more than {BATCH_MAX_ARCHIVE_BYTES} bytes")
+    plan = {}
+    for info in infos:
+        parts = Path(info.filename).parts
+        if info.is_dir() or len(parts) < 2 or parts[0] in ("", "..", "__MACOSX"):
+            continue
+        plan.setdefault(parts[0].strip(), []).append((Path(parts[-1]).name, zf, info))
+    return plan
+
+def store_batch(plan, skipped):
+    """
+    Create missing sessions and save the planned files; returns {session_name: [documents]}.
+    A file whose document name is already taken in the batch (same file name in another
+    folder of the archive, or a.pdf next to a.docx) is skipped instead of overwriting it.
+    """
+    sessions = {}
+    for session_name, entries in plan.items():
+        if not session_name:
+            continue
+        if not session_exists(session_name):
+            try:
+                templates.bind_session(storage, session_name, templates.DEFAULT_TEMPLATE)
+            except ValueError as e:
+                skipped.append({"session_name": session_name, "reason": str(e)})
+                continue
+        documents = []
+        for filename, zf, source in entries:
+            if Path(filename).suffix.lower() not in ALLOWED_EXTENSIONS:
+                skipped.append({"session_name": session_name, "filename": filename, "reason": "Unsupported file type"})
+                continue
+            if any(d["document"] == Path(filename).stem for d in documents):
+                skipped.append({"session_name": session_name, "filename": source.filename,
+                                "reason": f"Duplicate document name '{Path(filename).stem}' in this session"})
+                continue
+            if zf is not None:
+                with zf.open(source) as fileobj:
+                    doc_name = save_document(session_name, filename, fileobj)
+            else:
+                source.file.seek(0)
+                doc_name = save_document(session_name, filename, source.file)
+            documents.append({"document": doc_name, "filename": filename})
+        if documents:
+            sessions[session_name] = documents
+    return sessions
+
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in [t.strip() for t in header.split(",")]
+
+def not_modified_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, **CACHE_HEADERS})
+
+def require_profile_admin(token: Optional[str]):
+    if not profiling.is_admin(token):
+        raise HTTPException(status_code=403, detail="Profile admin token required")
+
+# ==================== Middleware ====================
+@app.middleware("http")
+async def profile_requests(request: Request, call_next):
+    """
+    Opt-in profiling: X-Profile-Token = PROFILE_ADMIN_TOKEN, or PROFILE_SAMPLE_RATE.
+    Forced and slow profiles are saved and listed under /api/admin/profiles.
+    """
+    enabled, forced = profiling.should_profile(request.headers.get("x-profile-token"))
+    if not enabled:
+        return await call_next(request)
+    started = time.perf_counter()
+    with profiling.request_profile(request.method, request.url.path, forced) as profile:
+        response = await call_next(request)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    profile_id = await asyncio.to_thread(profiling.finish, profile, response.status_code, elapsed_ms)
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+    return response
+
+# ==================== Startup ====================
+@app.on_event("startup")
+async def prewarm_pipeline():
+    """Optionally load the converter and LLM client in the background (PREWARM_PIPELINE=1); share budgets in queue mode."""
+    if os.getenv("PREWARM_PIPELINE", "").lower() in ("1", "true", "yes"):
+        threading.Thread(target=run_pipeline.prewarm, name="prewarm", daemon=True).start()
+    if job_queue.QUEUE_MODE:
+        # Report (and enforce) the token budgets the workers share through the queue backend
+        scheduler.share_budgets(job_queue.get_queue())
 
 # ==================== API Endpoints ====================
+# Storage calls block (S3 round trips): handlers that only read or write storage are
+# plain `def`, which FastAPI runs in its threadpool; async handlers that also await
+# pipeline jobs push their storage and job-queue calls through asyncio.to_thread.
 @app.post("/api/sessions/create")
-async def create_session(session_name: str = Form(...)):
+def create_session(session_name: str = Form(...), template_id: str = Form(templates.DEFAULT_TEMPLATE)):
     session_name = session_name.strip()
     if not session_name:
         raise HTTPException(status_code=400, detail="Session name cannot be empty")
-    session_path = get_session_path(session_name)
-    if session_path.exists():
+    if session_exists(session_name):
         raise HTTPException(status_code=400, detail="Session already exists")
-    session_path.mkdir(parents=True, exist_ok=True)
-    return {"message": "Session created successfully", "session_name": session_name}
+    try:
+        templates.bind_session(storage, session_name, template_id)
+    except (ValueError, FileNotFoundError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    versions.bump_stored(storage, session_name)
+    return {"message": "Session created successfully", "session_name": session_name, "template_id": template_id}
+
+@app.get("/api/templates")
+async def list_templates():
+    return {"templates": templates.list_templates()}
 
 @app.get("/api/sessions")
-async def list_sessions():
+def list_sessions(request: Request, response: Response):
+    # Only the small version files are read to answer a poll that has nothing new
+    states = {session_name: versions.load(storage, session_name) for session_name in storage.list_dirs()}
+    etag = versions.combined_etag(states)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update({"ETag": etag, **CACHE_HEADERS})
+
     sessions = []
-    for session_dir in SAMPLES_DIR.iterdir():
-        if session_dir.is_dir():
-            docs = [d.name for d in session_dir.iterdir() if d.is_dir()]
-            processed_count = sum(1 for d in session_dir.iterdir() if d.is_dir() and (d / f"processed_{d.name}.json").exists())
-            sessions.append({
-                "session_name": session_dir.name,
-                "document_count": len(docs),
-                "processed_documents": processed_count,
-                "documents": [{"document_name": d, "status": "processed" if (session_dir / d / f"processed_{d}.json").exists() else "pending"} for d in docs]
-            })
+    for session_name, state in states.items():
+        documents = document_statuses(session_name)
+        sessions.append({
+            "session_name": session_name,
+            "version": state["version"],
+            "document_count": len(documents),
+            "processed_documents": sum(1 for d in documents if d["status"] == "processed"),
+            "documents": documents
+        })
     return {"sessions": sessions}
 
 @app.get("/api/sessions/{session_name}")
-async def get_session_details(session_name: str):
-    session_path = get_session_path(session_name)
-    if not session_path.exists():
+def get_session_details(session_name: str, request: Request, response: Response):
+    if not session_exists(session_name):
         raise HTTPException(status_code=404, detail="Session not found")
-    docs = [d.name for d in session_path.iterdir() if d.is_dir()]
-    processed_count = sum(1 for d in session_path.iterdir() if d.is_dir() and (d / f"processed_{d.name}.json").exists())
+    state = versions.load(storage, session_name)
+    etag = versions.etag(state, "status")
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update({"ETag": etag, **CACHE_HEADERS})
+
+    documents = document_statuses(session_name)
     return {
         "session_name": session_name,
-        "total_documents": len(docs),
-        "processed_documents": processed_count,
-        "documents": [{"document_name": d, "status": "processed" if (session_path / d / f"processed_{d}.json").exists() else "pending"} for d in docs]
+        "version": state["version"],
+        "total_documents": len(documents),
+        "processed_documents": sum(1 for d in documents if d["status"] == "processed"),
+        "documents": documents
     }
 
 @app.post("/api/sessions/{session_name}/upload_process")
-async def upload_and_process_documents(session_name: str, files: List[UploadFile] = File(...), override: bool = Form(False)):
+async def upload_and_process_documents(session_name: str, files: List[UploadFile] = File(...), override: bool = Form(False),
+                                       policy: Optional[str] = Form(None), wait: bool = Form(True),
+                                       x_tenant_id: Optional[str] = Header(None)):
     """
     Upload files and run the full pipeline automatically.
+    `policy` picks how conflicts merge into the session ("confidence", "latest", "first").
+    Documents run on the shared scheduler's interactive lane, fairly shared between
+    tenants (X-Tenant-ID header, default: the session). With wait=false the response
+    returns job ids right away; poll or cancel them under /api/jobs/{job_id}.
     """
-    session_path = get_session_path(session_name)
-    if not session_path.exists():
+    if not await asyncio.to_thread(session_exists, session_name):
         raise HTTPException(status_code=404, detail="Session not found")
 
-    session_json = session_path / f"final_{session_name}_form_keys_filled.json"
+    tenant = x_tenant_id or session_name
     results = []
+    running = []
 
     for file in files:
-        allowed_extensions = {'.pdf', '.csv', '.xlsx', '.docx', '.json'}
         ext = Path(file.filename).suffix.lower()
-        if ext not in allowed_extensions:
+        if ext not in ALLOWED_EXTENSIONS:
             results.append({"filename": file.filename, "status": "skipped", "reason": "Unsupported file type"})
             continue
 
-        # Create folder for document
-        doc_name = Path(file.filename).stem
-        doc_folder = session_path / doc_name
-        doc_folder.mkdir(parents=True, exist_ok=True)
+        # Save uploaded file into its own document folder
+        doc_name = await asyncio.to_thread(save_document, session_name, file.filename, file.file)
+
+        # Queue mode: hand the document to a worker process and return immediately
+        if job_queue.QUEUE_MODE:
+            job_id = await asyncio.to_thread(job_queue.get_queue().enqueue, job_queue.document_job(
+                session_name, doc_name, file.filename, override, policy, tenant=tenant,
+            ), group=session_name)
+            results.append({"document": doc_name, "status": "queued", "job_id": job_id})
+            continue
 
-        # Save uploaded file
-        file_path = doc_folder / file.filename
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Run full pipeline (documents of this session run in upload order)
+        future = scheduler.get_scheduler().submit(
+            run_pipeline.run_document, session_name, doc_name, file.filename, override, policy,
+            tenant=tenant, session=session_name, lane="interactive",
+        )
+        results.append({"document": doc_name, "status": "running" if wait else "queued", "job_id": future.job_id})
+        if wait:
+            running.append((results[-1], future))
 
-        # Run full pipeline
+    for result, future in running:
         try:
-            session_json_path = run_pipeline.run_full_pipeline(
-                str(file_path), str(doc_folder), str(session_json), override
-            )
-            results.append({"document": doc_name, "status": "success"})
+            await asyncio.wrap_future(future)
+            result["status"] = "success"
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            result["status"] = "cancelled"
+        except deadlines.Cancelled:
+            result["status"] = "cancelled"
+        except scheduler.BudgetExceeded as e:
+            result.update(status="failed", error=str(e), retry_after=round(e.retry_after))
         except Exception as e:
-            results.append({"document": doc_name, "status": "failed", "error": str(e)})
+            result.update(status="failed", error=str(e))
 
     return {"session": session_name, "results": results}
 
+@app.post("/api/batches")
+async def create_batch(
+    manifest: Optional[str] = Form(None),
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    override: bool = Form(False),
+    x_tenant_id: Optional[str] = Header(None),
+):
+    """
+    Create many sessions and enqueue all their documents in one request.
+
+    Either send `archive` (a zip whose top-level folders are session names) or
+    `files` plus a JSON `manifest` mapping session names to uploaded filenames:
+    {"sessions": {"investor_a": ["a.pdf", "b.pdf"], "investor_b": ["c.pdf"]}}
+    Missing sessions are created; existing ones get the new documents appended.
+    Documents run on the scheduler's backfill lane, charged to X-Tenant-ID (default: each session).
+    Files that would get the same document name within a session are listed in `skipped`.
+    The response carries each document's job id (see GET /api/batches/{batch_id}).
+    """
+    plan = {}  # session_name -> list of (filename, fileobj)
+    skipped = []
+
+    if archive is not None:
+        try:
+            plan = await asyncio.to_thread(read_archive, archive.file)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    elif manifest is not None:
+        try:
+            mapping = json.loads(manifest)["sessions"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Manifest must be JSON like {\"sessions\": {name: [filenames]}}")
+        uploads = {f.filename: f for f in files or []}
+        for session_name, filenames in mapping.items():
+            for filename in filenames:
+                if filename not in uploads:
+                    skipped.append({"session_name": session_name, "filename": filename, "reason": "File not uploaded"})
+                    continue
+                plan.setdefault(session_name.strip(), []).append((filename, None, uploads[filename]))
+    else:
+        raise HTTPException(status_code=400, detail="Provide either a zip archive or a manifest with files")
+
+    # Extraction and storage writes run off the event loop
+    sessions = await asyncio.to_thread(store_batch, plan, skipped)
+    if not sessions:
+        raise HTTPException(status_code=400, detail="No supported documents found in request")
+
+    batch_id = await asyncio.to_thread(batch.create_batch, sessions, override, tenant=x_tenant_id)
+    return {
+        "batch_id": batch_id,
+        "sessions": list(sessions),
+        "total_documents": sum(len(documents) for documents in sessions.values()),
+        "skipped": skipped,
+        "jobs": batch.job_ids(batch_id),
+    }
+
+@app.get("/api/batches/{batch_id}")
+def get_batch(batch_id: str):
+    """
+    Aggregate progress of a batch. Batches are tracked in the memory of the API process
+    that created them (for BATCH_TTL after finishing): after a restart, or on another API
+    node behind a load balancer, this returns 404. Each document's job id, returned when
+    the batch was created, stays queryable under /api/jobs/{job_id} (in queue mode from any node).
+    """
+    progress = batch.get_batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return progress
+
+@app.get("/api/sessions/{session_name}/form")
+def get_session_form(session_name: str, request: Request, response: Response, since: Optional[int] = None):
+    """
+    The session's master form. With `?since=<version>` only fields changed after
+    that version are returned ({path: value}); "full" is true when the change
+    history no longer reaches back that far and the whole form is sent instead.
+    """
+    if not session_exists(session_name):
+        raise HTTPException(status_code=404, detail="Session not found")
+    key = f"{session_name}/{run_pipeline.session_json_name(session_name)}"
+    if not storage.exists(key):
+        raise HTTPException(status_code=404, detail="No document merged into this session yet")
+
+    state = versions.load(storage, session_name)
+    etag = versions.etag(state, "form" if since is None else f"since-{since}")
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response.headers.update({"ETag": etag, **CACHE_HEADERS})
+
+    changed = None if since is None else versions.changed_since(state, since)
+    if changed is not None and not changed:
+        return {"session_name": session_name, "version": state["version"], "since": since, "full": False, "fields": {}}
+    form = json.loads(b"".join(storage.iter_chunks(key)))
+    if changed is None:
+        return {"session_name": session_name, "version": state["version"], "since": since, "full": True, "form": form}
+    fields = {path: node.get("value", "") for path, node in code7.iter_value_nodes(form) if path in changed}
+    return {"session_name": session_name, "version": state["version"], "since": since, "full": False, "fields": fields}
+
+@app.get("/api/sessions/{session_name}/provenance")
+def get_session_provenance(session_name: str):
+    if not session_exists(session_name):
+        raise HTTPException(status_code=404, detail="Session not found")
+    with storage.workspace(session_name) as session_dir:
+        fields = code7.get_field_provenance(session_dir / run_pipeline.session_json_name(session_name))
+    return {"session_name": session_name, "fields": fields}
+
+@app.delete("/api/sessions/{session_name}/documents/{document_name}")
+async def delete_document(session_name: str, document_name: str, policy: Optional[str] = None,
+                          x_tenant_id: Optional[str] = Header(None)):
+    """
+    Remove one document and recompute only the session fields it contributed.
+    Runs as a job of the session, after (never alongside) its in-flight merges.
+    """
+    found = await asyncio.to_thread(
+        lambda: session_exists(session_name) and storage.exists_dir(f"{session_name}/{document_name}")
+    )
+    if not found:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if policy is not None and policy not in code7.POLICIES:
+        raise HTTPException(status_code=400, detail=f"Unknown merge policy '{policy}'")
+    tenant = x_tenant_id or session_name
+
+    if job_queue.QUEUE_MODE:
+        job_id = await asyncio.to_thread(
+            job_queue.get_queue().enqueue,
+            job_queue.remove_document_job(session_name, document_name, policy, tenant=tenant), group=session_name,
+        )
+        return {"message": "Document removal queued", "job_id": job_id}
+
+    future = scheduler.get_scheduler().submit(
+        run_pipeline.remove_document, session_name, document_name, policy,
+        tenant=tenant, session=session_name, lane="interactive",
+    )
+    changed = await asyncio.wrap_future(future)
+    return {"message": "Document removed", "job_id": future.job_id, "recomputed_fields": changed}
+
+@app.get("/api/sessions/{session_name}/documents/{document_name}/artifacts/{filename}")
+def get_document_artifact(session_name: str, document_name: str, filename: str):
+    """
+    Stream one pipeline artifact (e.g. code1_output.txt) without loading it into memory
+    (Starlette pulls the chunks of the sync iterator in its threadpool).
+    """
+    key = f"{session_name}/{document_name}/{filename}"
+    try:
+        found = storage.exists(key)
+    except ValueError:
+        found = False
+    if not found:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    media_type = "application/json" if filename.endswith(".json") else "application/octet-stream"
+    return StreamingResponse(storage.iter_chunks(key), media_type=media_type)
+
+@app.get("/api/scheduler/stats")
+def get_scheduler_stats():
+    """Per-tenant queue depth, wait/run time percentiles and token budget usage."""
+    stats = {"scheduler": scheduler.get_scheduler().stats()}
+    if job_queue.QUEUE_MODE:
+        stats["queue"] = job_queue.get_queue().stats()
+    return stats
+
+@app.get("/api/admin/profiles")
+async def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    """Saved request profiles, newest first: per-stage wall/CPU time and memory peaks."""
+    require_profile_admin(x_profile_token)
+    return {"profiles": profiling.list_profiles()}
+
+@app.get("/api/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    """One saved profile, including its top functions by cumulative time."""
+    require_profile_admin(x_profile_token)
+    profile = profiling.load_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/api/admin/profiles/{profile_id}/pstats")
+async def download_profile(profile_id: str, x_profile_token: Optional[str] = Header(None)):
+    """The raw cProfile dump, for `python -m pstats` or snakeviz."""
+    require_profile_admin(x_profile_token)
+    path = profiling.pstats_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
+
+@app.get("/api/jobs/{job_id}")
+def get_job(job_id: str):
+    job = scheduler.get_scheduler().get(job_id) or job_queue.get_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_job(job_id: str):
+    """
+    Cancel a document job. Queued jobs are dropped; running ones stop at the next
+    stage boundary (or mid-conversion / mid-LLM-call) and keep their finished
+    stages, so re-uploading the same file resumes where it stopped.
+    """
+    status = scheduler.get_scheduler().cancel(job_id) or job_queue.get_queue().cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, "status": status}
+
 @app.delete("/api/sessions/{session_name}")
 async def delete_session(session_name: str):
-    session_path = get_session_path(session_name)
-    if not session_path.exists():
+    if not await asyncio.to_thread(session_exists, session_name):
         raise HTTPException(status_code=404, detail="Session not found")
-    shutil.rmtree(session_path)
+    await storage.adelete_prefix(session_name)
     return {"message": "Session deleted successfully"}
 
 @app.get("/")
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import sys
+from pathlib import Path
+
+# Import the app packages (backend, app) from the repository root
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,115 @@
+# tests/s3_stub.py
+import hashlib
+import io
+import threading
+from pathlib import Path
+
+
+class ClientError(Exception):
+    def __init__(self, code, operation="S3"):
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation")
+        self.response = {"Error": {"Code": code}}
+
+
+class NoSuchKey(ClientError):
+    def __init__(self):
+        super().__init__("NoSuchKey", "GetObject")
+
+
+class _Exceptions:
+    ClientError = ClientError
+    NoSuchKey = NoSuchKey
+
+
+class _Body(io.BytesIO):
+    def iter_chunks(self, chunk_size):
+        while chunk := self.read(chunk_size):
+            yield chunk
+
+
+class _Paginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Bucket, Prefix="", Delimiter=None):
+        yield self.client.list_objects_v2(Bucket=Bucket, Prefix=Prefix, Delimiter=Delimiter)
+
+
+class InMemoryS3:
+    """
+    The subset of the boto3 S3 client used by storage.S3Storage, in memory (moto-style
+    stand-in), including conditional puts (IfMatch / IfNoneMatch) and per-call counts.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self):
+        self.objects = {}  # (bucket, key) -> bytes
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _etag(self, data):
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def head_object(self, Bucket, Key):
+        self.calls.append("head_object")
+        if (Bucket, Key) not in self.objects:
+            raise ClientError("404", "HeadObject")
+        return {"ETag": self._etag(self.objects[(Bucket, Key)])}
+
+    def get_object(self, Bucket, Key):
+        self.calls.append("get_object")
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise NoSuchKey()
+            data = self.objects[(Bucket, Key)]
+        return {"Body": _Body(data), "ETag": self._etag(data)}
+
+    def put_object(self, Bucket, Key, Body, IfMatch=None, IfNoneMatch=None):
+        self.calls.append("put_object")
+        data = Body if isinstance(Body, bytes) else Body.read()
+        with self._lock:
+            current = self.objects.get((Bucket, Key))
+            if IfNoneMatch == "*" and current is not None:
+                raise ClientError("PreconditionFailed", "PutObject")
+            if IfMatch is not None and (current is None or self._etag(current) != IfMatch):
+                raise ClientError("PreconditionFailed", "PutObject")
+            self.objects[(Bucket, Key)] = data
+        return {"ETag": self._etag(data)}
+
+    def upload_fileobj(self, fileobj, Bucket, Key):
+        self.calls.append("upload_fileobj")
+        self.objects[(Bucket, Key)] = fileobj.read()
+
+    def upload_file(self, Filename, Bucket, Key):
+        self.calls.append("upload_file")
+        self.objects[(Bucket, Key)] = Path(Filename).read_bytes()
+
+    def download_file(self, Bucket, Key, Filename):
+        self.calls.append("download_file")
+        Path(Filename).write_bytes(self.objects[(Bucket, Key)])
+
+    def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, MaxKeys=None):
+        self.calls.append("list_objects_v2")
+        contents, prefixes = [], set()
+        for bucket, key in sorted(self.objects):
+            if bucket != Bucket or not key.startswith(Prefix):
+                continue
+            rest = key[len(Prefix):]
+            if Delimiter and Delimiter in rest:
+                prefixes.add(Prefix + rest.split(Delimiter)[0] + Delimiter)
+            else:
+                contents.append({"Key": key})
+        if MaxKeys is not None:
+            contents = contents[:MaxKeys]
+        return {"Contents": contents, "CommonPrefixes": [{"Prefix": p} for p in sorted(prefixes)],
+                "KeyCount": len(contents) + len(prefixes)}
+
+    def get_paginator(self, name):
+        assert name == "list_objects_v2"
+        return _Paginator(self)
+
+    def delete_objects(self, Bucket, Delete):
+        self.calls.append("delete_objects")
+        for obj in Delete["Objects"]:
+            self.objects.pop((Bucket, obj["Key"]), None)
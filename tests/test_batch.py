@@ -0,0 +1,20 @@
+# tests/test_batch.py
+from backend import batch, job_queue
+
+
+def test_queue_mode_batch_reports_job_ids_and_progress(tmp_path, monkeypatch):
+    queue = job_queue.SQLiteQueue(tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr(job_queue, "QUEUE_MODE", True)
+    monkeypatch.setattr(job_queue, "get_queue", lambda url=None: queue)
+    sessions = {"s1": [{"document": "a", "filename": "a.pdf"}, {"document": "b", "filename": "b.pdf"}]}
+
+    batch_id = batch.create_batch(sessions, tenant="t1")
+    jobs = batch.job_ids(batch_id)
+    assert set(jobs["s1"]) == {"a", "b"}
+    assert queue.get(jobs["s1"]["a"])["payload"]["lane"] == "backfill"
+
+    job = queue.lease("w")
+    queue.ack(job["id"], job["lease_token"])
+    progress = batch.get_batch_progress(batch_id)
+    assert (progress["success"], progress["queued"], progress["status"]) == (1, 1, "running")
+    assert batch.job_ids("unknown") == {} and batch.get_batch_progress("unknown") is None
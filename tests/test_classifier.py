@@ -0,0 +1,39 @@
+# tests/test_classifier.py
+import pytest
+
+from backend import classifier, templates
+
+W9 = ("Form W-9 Request for Taxpayer Identification Number and Certification. Internal Revenue Service. "
+      "Backup withholding applies unless you certify your taxpayer identification number.")
+WIRE = "Bank confirmation letter. Account name: Acme Trust. IBAN GB00 0000. SWIFT ABCDGB2L. Wire instructions attached."
+
+
+@pytest.fixture
+def folder(tmp_path):
+    def write(text):
+        (tmp_path / "code1_output.txt").write_text(text, encoding="utf-8")
+        return tmp_path
+    return write
+
+
+def test_confident_label_is_routed(folder):
+    result = classifier.process(folder(W9), template_id=templates.DEFAULT_TEMPLATE)
+    assert result["label"] == "tax_form" and result["fallback"] is None
+    assert result["fields"] and result["model"] == classifier.MODEL_TIERS["light"]
+
+
+def test_unrecognised_document_gets_full_extraction(folder):
+    result = classifier.process(folder("Minutes of the quarterly meeting."), template_id=templates.DEFAULT_TEMPLATE)
+    assert result["label"] == "other" and result["fallback"]
+    assert result["fields"] is None and result["model"] == classifier.MODEL_TIERS["full"]
+
+
+def test_close_runner_up_gets_full_extraction(folder):
+    result = classifier.process(folder(W9 + "\n" + WIRE), template_id=templates.DEFAULT_TEMPLATE)
+    assert "runner-up" in result["fallback"] and result["fields"] is None
+
+
+def test_long_document_gets_full_extraction(folder, monkeypatch):
+    monkeypatch.setattr(classifier, "MAX_ROUTED_CHARS", len(W9) - 1)
+    result = classifier.process(folder(W9), template_id=templates.DEFAULT_TEMPLATE)
+    assert result["label"] == "tax_form" and "longer" in result["fallback"] and result["fields"] is None
@@ -0,0 +1,36 @@
+# tests/test_code2.py
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+from backend import code2, code5
+
+ROOT = Path(__file__).parent.parent
+
+
+class _Completions:
+    def __init__(self, values):
+        self.values = values
+
+    def create(self, model, messages, **kwargs):
+        message = SimpleNamespace(content=json.dumps(self.values))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)],
+                               usage=SimpleNamespace(total_tokens=100))
+
+
+def test_code2_output_is_what_the_next_stages_read(tmp_path, monkeypatch):
+    values = {"Details in Subscription Booklet.investorFullLegalName_ID": "Jane Q. Investor"}
+    client = SimpleNamespace(chat=SimpleNamespace(completions=_Completions(values)))
+    monkeypatch.setattr(code2, "get_client", lambda: client)
+    folder = tmp_path / "s1" / "doc"
+    folder.mkdir(parents=True)
+    (folder / "code1_output.txt").write_text("Subscriber: Jane Q. Investor", encoding="utf-8")
+
+    code2.process(folder)
+
+    assert code2.OUTPUT_FILE == "code2_output.json"
+    form = json.loads((folder / code2.OUTPUT_FILE).read_text(encoding="utf-8"))
+    assert form["Details in Subscription Booklet"]["investorFullLegalName_ID"]["value"] == "Jane Q. Investor"
+    # code5 (and code6) read the same file
+    mapping = json.loads(code5.process(folder).read_text(encoding="utf-8"))
+    assert mapping["Name"]["value"] == "Jane Q. Investor"
@@ -0,0 +1,68 @@
+# tests/test_code7.py
+import inspect
+import json
+
+import pytest
+
+from backend import code7, run_pipeline
+
+
+@pytest.fixture
+def session(tmp_path):
+    session_file = tmp_path / "s1" / "final_s1_form_keys_filled.json"
+
+    def merge(document, value, method="llm", **kwargs):
+        folder = tmp_path / "s1" / document
+        folder.mkdir(parents=True, exist_ok=True)
+        form = {"Name": {"value": value, "method": method}, "Country": {"value": ""}}
+        (folder / "final_output_form_keys_filled.json").write_text(json.dumps(form), encoding="utf-8")
+        return code7.merge_pdf_into_session(str(folder), str(session_file), **kwargs)
+
+    def value():
+        return json.loads(session_file.read_text(encoding="utf-8"))["Name"]["value"]
+
+    merge.value = value
+    merge.file = session_file
+    return merge
+
+
+@pytest.mark.parametrize("policy, expected", [("confidence", "Rule"), ("latest", "Late"), ("first", "Early")])
+def test_policies(session, policy, expected):
+    session("a", "Early", policy=policy)
+    session("b", "Rule", method="rule", policy=policy)
+    session("c", "Late", policy=policy)
+    assert session.value() == expected
+
+
+def test_unknown_policy_is_rejected(session):
+    with pytest.raises(ValueError):
+        session("a", "Early", policy="loudest")
+
+
+def test_legacy_session_values_count_as_user_confirmed(session):
+    session.file.parent.mkdir(parents=True)
+    session.file.write_text(json.dumps({"Name": {"value": "Legacy"}}), encoding="utf-8")
+
+    session("a", "Extracted", method="rule", policy="confidence")
+
+    assert session.value() == "Legacy"
+    candidates = code7.get_field_provenance(str(session.file))["Name"]["candidates"]
+    legacy = next(c for c in candidates if c["document"] == code7.LEGACY_DOCUMENT)
+    assert legacy["method"] == "user" and legacy["confidence"] == 1.0
+
+
+def test_api_default_keeps_session_values(session, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda *args: pytest.fail("prompted"))
+    assert inspect.signature(run_pipeline.run_document).parameters["override"].default is False
+
+    session("a", "Early", override=False)
+    assert session("b", "Late", override=False) == []
+    assert session.value() == "Early"
+    assert session("c", "Late", override=True) == ["Name"]
+
+
+def test_removing_a_document_recomputes_its_fields(session):
+    session("a", "Early", policy="latest")
+    session("b", "Late", policy="latest")
+    assert code7.remove_document_from_session("b", str(session.file)) == ["Name"]
+    assert session.value() == "Early"
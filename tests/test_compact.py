@@ -0,0 +1,58 @@
+# tests/test_compact.py
+from backend import compact
+
+VALUES = ["Acme Family Trust", "12-3456789", "1 Main Street", "USD 250,000", "GB29NWBK60161331926819", "Class A"]
+
+
+def booklet():
+    pages = []
+    for n in range(1, 5):
+        pages.append("\n".join([
+            "ACME GROWTH FUND LP — SUBSCRIPTION BOOKLET",
+            f"Page {n} of 4",
+            "",
+            "Investor Name: Acme Family Trust",
+            "[x] Trust    [ ] Individual",
+            "",
+            "| Field      |   | Value                  |",
+            "|------------|---|------------------------|",
+            "| EIN        |   | 12-3456789             |",
+            "| Address    |   | 1 Main Street          |",
+            "|            |   |                        |",
+            "",
+            "This document is confidential and privileged.",
+            "Commitment Amount: USD 250,000",
+            "",
+            "This communication is confidential and privileged. All rights reserved.",
+            "",
+            "IBAN: GB29NWBK60161331926819",
+            "Share class: Class A",
+            "DocuSign Envelope ID: 1234-ABCD",
+        ]))
+    return "\f".join(pages)
+
+
+def test_compaction_keeps_every_value():
+    text = booklet()
+    compacted, removed = compact.compact_text(text)
+    for value in VALUES:
+        assert compacted.count(value) == text.count(value), value
+    assert compacted.count("[x] Trust") == 4
+    assert len(compacted) < len(text)
+    # Header and boilerplate lines repeated on pages 2-4, the empty table row on every page
+    assert removed["page_numbers"] == 4 and removed["repeated_lines"] == 9 and removed["table_rows"] == 4
+    assert "DocuSign" not in compacted and "All rights reserved" not in compacted
+
+
+def test_repeated_value_lines_are_never_dropped():
+    text = "\n".join(["Signature: John Smith"] * 5 + ["Appendix"] * 5)
+    compacted, removed = compact.compact_text(text)
+    assert compacted.count("Signature: John Smith") == 5
+    assert compacted.count("Appendix") == 1 and removed == {"repeated_lines": 4}
+
+
+def test_process_writes_text_and_stats(tmp_path):
+    (tmp_path / "code1_output.txt").write_text(booklet(), encoding="utf-8")
+    result = compact.process(tmp_path)
+    assert (tmp_path / compact.OUTPUT_FILE).read_text(encoding="utf-8") == result["text"]
+    assert result["tokens_after"] < result["tokens_before"]
@@ -0,0 +1,64 @@
+# tests/test_deadlines.py
+import os
+import threading
+import time
+
+import pytest
+
+from backend import deadlines
+
+
+def _pid(path):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(f"{os.getpid()}\n")
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+
+
+def _fail():
+    raise ValueError("bad document")
+
+
+def test_warm_process_is_reused(tmp_path):
+    log = tmp_path / "pids.txt"
+    for _ in range(3):
+        deadlines.run_in_warm_process(_pid, (str(log),), 30, "test")
+    assert len(set(log.read_text().split())) == 1
+
+
+def test_warm_process_survives_errors_and_is_replaced_after_timeout(tmp_path):
+    log = tmp_path / "pids.txt"
+    deadlines.run_in_warm_process(_pid, (str(log),), 30, "test")
+    with pytest.raises(RuntimeError, match="bad document"):
+        deadlines.run_in_warm_process(_fail, (), 30, "test")
+    deadlines.run_in_warm_process(_pid, (str(log),), 30, "test")
+    with pytest.raises(deadlines.StageTimeout):
+        deadlines.run_in_warm_process(_sleep, (5,), 0.5, "test")
+    deadlines.run_in_warm_process(_pid, (str(log),), 30, "test")
+    first, same, replaced = log.read_text().split()
+    assert first == same != replaced
+
+
+def test_abandoned_call_reports_its_result():
+    late = []
+    finished = threading.Event()
+
+    def slow():
+        time.sleep(0.6)
+        return "usage"
+
+    def on_late(result):
+        late.append(result)
+        finished.set()
+
+    with pytest.raises(deadlines.StageTimeout):
+        deadlines.call_with_deadline(slow, 0.3, "llm", on_abandoned_result=on_late)
+    assert finished.wait(5) and late == ["usage"]
+
+
+def test_call_in_time_does_not_report_late():
+    late = []
+    assert deadlines.call_with_deadline(lambda: 42, 5, "llm", on_abandoned_result=late.append) == 42
+    assert late == []
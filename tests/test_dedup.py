@@ -0,0 +1,68 @@
+# tests/test_dedup.py
+import json
+
+import pytest
+
+from backend import code2, dedup, storage
+
+LINES = [f"Line {i}: the subscriber acknowledges clause {i} of the agreement in full." for i in range(40)]
+TEXT = "\n".join(LINES + ["Investor name: Acme Family Trust", "Country: US"])
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setattr(dedup, "DEDUP_DB", str(tmp_path / "dedup.sqlite3"))
+    monkeypatch.setattr(storage, "_storage", storage.LocalStorage(tmp_path / "sessions"))
+    return tmp_path / "sessions"
+
+
+def processed(root, ref, text, values):
+    folder = root / ref
+    folder.mkdir(parents=True)
+    (folder / "code1_output.txt").write_text(text, encoding="utf-8")
+    form = {name: {"value": value} for name, value in values.items()}
+    (folder / code2.OUTPUT_FILE).write_text(json.dumps(form), encoding="utf-8")
+    return folder
+
+
+def test_near_duplicate_reuses_unchanged_values(index):
+    old = processed(index, "s1/doc", TEXT, {"name_ID": "Acme Family Trust"})
+    dedup.register("form", "s1/doc", dedup.minhash(TEXT), tenant="t1")
+
+    revised = TEXT.replace("clause 3 ", "clause three ")
+    new = processed(index, "s2/doc", revised, {})
+    result = dedup.process(new, template_id="form", tenant="t1")
+
+    assert result["matched_ref"] == "s1/doc" and result["tenant"] == "t1"
+    assert result["reused"] == {"name_ID": "Acme Family Trust"}
+    assert old.exists()
+
+
+def test_index_is_never_shared_across_tenants(index):
+    processed(index, "s1/doc", TEXT, {"name_ID": "Acme Family Trust"})
+    dedup.register("form", "s1/doc", dedup.minhash(TEXT), tenant="t1")
+
+    new = processed(index, "s2/doc", TEXT, {})
+    assert dedup.find_similar("form", dedup.minhash(TEXT), tenant="t2") is None
+    result = dedup.process(new, template_id="form", tenant="t2")
+    assert result["matched_ref"] is None and "reused" not in result
+
+
+def test_short_values_and_substrings_are_reextracted():
+    old = "Country: US\nStatus: trust beneficiary\nName: Acme Trust\nTitle: Director"
+    new = "Country: US\nStatus: trust beneficiary\nName: Acme Trust\nTitle: Managing Director"
+    values = {"country_ID": "US", "name_ID": "Acme Trust", "trust_ID": "trust", "flag_ID": True, "role_ID": "Director"}
+
+    reused, reextract, _ = dedup.plan_reuse(old, new, values)
+
+    assert reused == {"name_ID": "Acme Trust", "trust_ID": "trust"}
+    # "US" is too short to locate reliably; "Director" sits on a changed line
+    assert set(reextract) == {"country_ID", "flag_ID", "role_ID"}
+
+
+def test_value_only_matches_on_word_boundaries():
+    # The amount was normalized by extraction, so the raw text only contains it inside "21500"
+    old = "Fee: 21500\nAmount: 1,500"
+    new = "Fee: 21500\nAmount: 2,000"
+    reused, reextract, _ = dedup.plan_reuse(old, new, {"amount_ID": "1500"})
+    assert reused == {} and reextract == ["amount_ID"]
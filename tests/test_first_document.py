@@ -0,0 +1,44 @@
+# tests/test_first_document.py
+import builtins
+import json
+from pathlib import Path
+
+import pytest
+
+from backend import code5, code7, run_pipeline
+
+ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture
+def document(tmp_path, monkeypatch):
+    def no_prompt(*args):
+        raise AssertionError("unattended run prompted for input")
+    monkeypatch.setattr(builtins, "input", no_prompt)
+
+    folder = tmp_path / "s1" / "doc"
+    folder.mkdir(parents=True)
+    form = json.loads((ROOT / "form_keys.json").read_text(encoding="utf-8"))
+    section = form["Details in Subscription Booklet"]
+    section["Type of Subscriber"]["trustcheck_ID"]["value"] = True
+    section["investorFullLegalName_ID"]["value"] = "Acme Family Trust"
+    (folder / "code2_output.json").write_text(json.dumps(form), encoding="utf-8")
+    return folder
+
+
+def test_investor_type_is_inferred(document):
+    form = json.loads((document / "code2_output.json").read_text(encoding="utf-8"))
+    assert code5.infer_investor_type(form, {"Trust/Non-Profit Organisations": {}}) == "Trust/Non-Profit Organisations"
+    assert code5.infer_investor_type({}, {}) == code5.DEFAULT_INVESTOR_TYPE
+
+
+def test_first_document_runs_without_prompts(document):
+    run_pipeline.run_manual_steps(document, interactive=False)
+
+    missing = json.loads((document / run_pipeline.MISSING_MANDATORY_FILE).read_text(encoding="utf-8"))
+    assert "Name" not in missing and missing
+
+    session_json = document.parent / run_pipeline.session_json_name("s1")
+    code7.merge_pdf_into_session(str(document), str(session_json), False, method="llm")
+    session = json.loads(session_json.read_text(encoding="utf-8"))
+    assert session["Details in Subscription Booklet"]["investorFullLegalName_ID"]["value"] == "Acme Family Trust"
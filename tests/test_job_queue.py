@@ -0,0 +1,184 @@
+# tests/test_job_queue.py
+import sqlite3
+import time
+
+import pytest
+
+from backend import job_queue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return job_queue.SQLiteQueue(tmp_path / "jobs.sqlite3", visibility_timeout=60, max_attempts=3)
+
+
+def test_lease_and_ack(queue):
+    job_id = queue.enqueue({"kind": "document"}, group="s1")
+    job = queue.lease("w1")
+    assert job["id"] == job_id and job["status"] == "leased" and job["attempts"] == 1
+    assert queue.lease("w2") is None
+    assert queue.ack(job_id, job["lease_token"], {"ok": True})
+    assert queue.get(job_id)["status"] == "succeeded"
+    assert queue.get(job_id)["result"] == {"ok": True}
+
+
+def test_one_job_per_group_in_order(queue):
+    first = queue.enqueue({"n": 1}, group="s1")
+    second = queue.enqueue({"n": 2}, group="s1")
+    other = queue.enqueue({"n": 3}, group="s2")
+
+    job = queue.lease("w1")
+    assert job["id"] == first
+    # s1 is busy, so the next worker gets the other session's job
+    assert queue.lease("w2")["id"] == other
+    assert queue.lease("w3") is None
+
+    queue.ack(first, job["lease_token"])
+    assert queue.lease("w3")["id"] == second
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = job_queue.SQLiteQueue(tmp_path / "jobs.sqlite3", visibility_timeout=0.1, max_attempts=3)
+    job_id = queue.enqueue({"n": 1}, group="s1")
+    later = queue.enqueue({"n": 2}, group="s1")
+    stale = queue.lease("w1")
+    time.sleep(0.2)
+
+    job = queue.lease("w2")
+    assert job["id"] == job_id and job["attempts"] == 2
+    # The first worker lost its lease and can no longer settle the job
+    assert not queue.ack(job_id, stale["lease_token"])
+    assert not queue.extend(job_id, stale["lease_token"])
+    assert queue.ack(job_id, job["lease_token"])
+    assert queue.lease("w3")["id"] == later
+
+
+def test_expired_lease_dead_letters_after_max_attempts(tmp_path):
+    queue = job_queue.SQLiteQueue(tmp_path / "jobs.sqlite3", visibility_timeout=0.05, max_attempts=1)
+    job_id = queue.enqueue({"n": 1}, group="s1")
+    queue.lease("w1")
+    time.sleep(0.1)
+
+    assert queue.lease("w2") is None
+    assert queue.get(job_id)["status"] == "failed"
+
+
+def test_retry_keeps_group_order(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_BACKOFF", 0.2)
+    first = queue.enqueue({"n": 1}, group="s1")
+    second = queue.enqueue({"n": 2}, group="s1")
+
+    job = queue.lease("w1")
+    assert queue.fail(first, job["lease_token"], "boom")
+    assert queue.get(first)["status"] == "queued"
+    # While the first job waits for its retry, the rest of its group waits too
+    assert queue.lease("w2") is None
+
+    time.sleep(0.25)
+    retry = queue.lease("w2")
+    assert retry["id"] == first and retry["attempts"] == 2
+    queue.ack(first, retry["lease_token"])
+    assert queue.lease("w3")["id"] == second
+
+
+def test_deferred_job_keeps_group_order(queue):
+    first = queue.enqueue({"n": 1}, group="s1")
+    queue.enqueue({"n": 2}, group="s1")
+
+    job = queue.lease("w1")
+    assert queue.defer(first, job["lease_token"], 0.1, "over budget")
+    assert queue.lease("w2") is None
+    time.sleep(0.15)
+    again = queue.lease("w2")
+    # Deferring does not use up an attempt
+    assert again["id"] == first and again["attempts"] == 1
+
+
+def test_fail_dead_letters_and_unblocks_group(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_BACKOFF", 0)
+    first = queue.enqueue({"n": 1}, group="s1")
+    second = queue.enqueue({"n": 2}, group="s1")
+
+    for _ in range(3):
+        job = queue.lease("w1")
+        assert job["id"] == first
+        queue.fail(first, job["lease_token"], "boom")
+
+    assert queue.get(first)["status"] == "failed"
+    assert queue.get(first)["error"] == "boom"
+    assert queue.lease("w1")["id"] == second
+
+
+def test_cancel(queue):
+    queued = queue.enqueue({"n": 1}, group="s1")
+    running = queue.enqueue({"n": 2}, group="s2")
+    assert queue.cancel(queued) == "cancelled"
+
+    job = queue.lease("w1")
+    assert job["id"] == running
+    assert queue.cancel(running) == "cancelling"
+    # The worker notices on its next heartbeat and settles the job
+    assert not queue.extend(running, job["lease_token"])
+    queue.fail(running, job["lease_token"], "cancelled")
+    assert queue.get(running)["status"] == "cancelled"
+    assert queue.cancel("missing") is None
+
+
+def test_cancelled_retry_unblocks_group(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "RETRY_BACKOFF", 60)
+    first = queue.enqueue({"n": 1}, group="s1")
+    second = queue.enqueue({"n": 2}, group="s1")
+
+    job = queue.lease("w1")
+    queue.fail(first, job["lease_token"], "boom")
+    assert queue.lease("w2") is None
+    assert queue.cancel(first) == "cancelled"
+    assert queue.lease("w2")["id"] == second
+
+
+def test_token_budget_is_shared_between_queue_handles(tmp_path):
+    path = tmp_path / "jobs.sqlite3"
+    first, second = job_queue.SQLiteQueue(path), job_queue.SQLiteQueue(path)
+
+    assert first.take_tokens("t1", 3000, 3600) == 0
+    # Another worker process sees the same bucket: 600 left, 1000 more needs ~400s
+    assert second.take_tokens("t1", 1000, 3600) == pytest.approx(400, abs=1)
+    first.take_tokens("t1", -500, 3600, force=True)  # usage correction
+    assert second.take_tokens("t1", 1000, 3600) == 0
+    state = first.token_state("t1", 3600)
+    assert state["used"] == 3500 and state["level"] == pytest.approx(100, abs=1)
+    # Unlimited tenants are only counted
+    assert first.take_tokens("t2", 10 ** 9, 0) == 0
+    assert second.token_state("t2", 0)["used"] == 10 ** 9
+
+
+def test_reads_do_not_wait_for_a_writer(queue):
+    job_id = queue.enqueue({"kind": "document"}, group="s1")
+    writer = sqlite3.connect(queue.path, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.monotonic()
+        assert queue.get(job_id)["status"] == "queued"
+        assert queue.stats() == {"queued": 1}
+        assert time.monotonic() - started < 1
+    finally:
+        writer.execute("ROLLBACK")
+
+
+def test_interactive_lane_is_favoured_over_backfill(queue):
+    for i in range(4):
+        queue.enqueue(job_queue.document_job(f"b{i}", "doc", "doc.pdf", tenant="batch", lane="backfill"), group=f"b{i}")
+    for i in range(4):
+        queue.enqueue(job_queue.document_job(f"i{i}", "doc", "doc.pdf", tenant="user"), group=f"i{i}")
+    lanes = [queue.lease("w")["payload"]["lane"] for _ in range(5)]
+    # Backfill still gets its share (BACKFILL_SHARE = 0.2) while both lanes have work
+    assert lanes[0] == "interactive" and lanes.count("backfill") == 1
+
+
+def test_tenants_take_turns(queue):
+    for i in range(3):
+        queue.enqueue(job_queue.document_job(f"a{i}", "doc", "doc.pdf", tenant="a"), group=f"a{i}")
+    queue.enqueue(job_queue.document_job("b0", "doc", "doc.pdf", tenant="b"), group="b0")
+    queue.enqueue(job_queue.document_job("c0", "doc", "doc.pdf", tenant="c"), group="c0")
+    sessions = [queue.lease("w")["payload"]["session_name"] for _ in range(5)]
+    assert sessions == ["a0", "b0", "c0", "a1", "a2"]
@@ -0,0 +1,70 @@
+# tests/test_ocr.py
+import threading
+import time
+
+import pytest
+
+from backend import deadlines, ocr
+
+
+def _pages(*kinds):
+    return [{"page": i, "kind": kind, "text": "layer text " * 5 if kind == "text" else "", "images": []}
+            for i, kind in enumerate(kinds)]
+
+
+def test_merge_replaces_image_pages_in_place():
+    text = "first page " * 5 + "\f\f" + "third page " * 5
+    merged = ocr.merge(text, _pages("text", "image", "text"), {1: "scanned"})
+    chunks = merged.split("\f")
+    assert len(chunks) == 3
+    assert "(OCR)" in chunks[1] and "scanned" in chunks[1]
+    assert chunks[0] == "first page " * 5
+
+
+def test_merge_keeps_converter_text_without_page_breaks():
+    text = "| table | kept |\n" * 3
+    merged = ocr.merge(text, _pages("text", "image"), {1: "scanned"})
+    assert merged.startswith(text.rstrip("\n"))
+    assert "layer text" not in merged
+    assert "<!-- page 2 (OCR) -->\nscanned" in merged
+
+
+def test_unreadable_pdf_keeps_code1_output(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr, "available", lambda: True)
+
+    def broken(path):
+        raise ValueError("EOF marker not found")
+    monkeypatch.setattr(ocr, "classify_pages", broken)
+    (tmp_path / "code1_output.txt").write_text("converted", encoding="utf-8")
+
+    assert ocr.process(tmp_path / "doc.pdf", tmp_path) is None
+    assert (tmp_path / "code1_output.txt").read_text(encoding="utf-8") == "converted"
+
+
+def test_slow_page_classification_skips_ocr(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr, "available", lambda: True)
+    monkeypatch.setattr(ocr, "OCR_CLASSIFY_TIMEOUT", 0.1)
+    release = threading.Event()
+    monkeypatch.setattr(ocr, "classify_pages", lambda path: release.wait(5))
+    (tmp_path / "code1_output.txt").write_text("converted", encoding="utf-8")
+
+    started = time.monotonic()
+    try:
+        assert ocr.process(tmp_path / "doc.pdf", tmp_path) is None
+    finally:
+        release.set()
+    assert time.monotonic() - started < 2
+    assert not (tmp_path / ocr.OUTPUT_FILE).exists()
+
+
+def test_cancellation_is_not_swallowed(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr, "available", lambda: True)
+    release = threading.Event()
+    monkeypatch.setattr(ocr, "classify_pages", lambda path: release.wait(5))
+    event = threading.Event()
+    event.set()
+    try:
+        with deadlines.cancel_scope(event), pytest.raises(deadlines.Cancelled):
+            ocr.process(tmp_path / "doc.pdf", tmp_path)
+    finally:
+        release.set()
@@ -0,0 +1,57 @@
+# tests/test_profiles.py
+import json
+
+import pytest
+
+from backend import profiles, scheduler
+
+SESSION = {
+    "investorFullLegalName_ID": {"value": "Acme Family Trust"},
+    "investorEINTAX_ID": {"value": "12-3456789"},
+    "Address (Registered)": {"Street": {"value": "1 Main Street"}},
+    "InvestorOccupation_ID": {"value": "Family office"},
+    "Share Class Type": {"Class A": {"value": "true"}},
+}
+
+
+@pytest.fixture
+def known(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiles, "PROFILE_DB", str(tmp_path / "profiles.sqlite3"))
+    session_file = tmp_path / "s1" / "final_s1_form_keys_filled.json"
+    session_file.parent.mkdir()
+    session_file.write_text(json.dumps(SESSION), encoding="utf-8")
+    assert profiles.record_session(session_file, "s1", tenant="t1")
+
+    def match(text, tenant="t1"):
+        folder = tmp_path / "doc"
+        folder.mkdir(exist_ok=True)
+        (folder / "code1_output.txt").write_text(text, encoding="utf-8")
+        with scheduler.tenant_context(tenant):
+            return profiles.process(folder)
+    return match
+
+
+def test_verified_tax_id_prefills_personal_data(known):
+    result = known("Investor Full Legal Name: Acme Family Trust\nEIN: 12-3456789")
+    assert result["profile_id"] and result["tax_id_verified"]
+    values = result["known_values"]
+    assert values["Address (Registered).Street"] == "1 Main Street"
+    assert values["investorFullLegalName_ID"] == "Acme Family Trust"
+    assert not any(path.startswith("Share Class Type") for path in values)
+
+
+def test_name_match_only_prefills_non_sensitive_fields(known):
+    result = known("Investor Full Legal Name: Acme Family Trust")
+    assert result["profile_id"] and not result["tax_id_verified"]
+    assert result["known_values"] == {"InvestorOccupation_ID": "Family office"}
+
+
+def test_different_tax_id_matches_nothing(known):
+    result = known("Investor Full Legal Name: Acme Family Trust\nEIN: 98-7654321")
+    assert result["profile_id"] is None and result["known_values"] == {}
+
+
+def test_profiles_are_scoped_per_tenant(known):
+    result = known("Investor Full Legal Name: Acme Family Trust\nEIN: 12-3456789", tenant="t2")
+    assert result["profile_id"] is None
+    assert profiles.match_text("Investor Full Legal Name: Acme Family Trust", tenant="t1")[0]
@@ -0,0 +1,35 @@
+# tests/test_profiling.py
+from backend import deadlines, profiling
+
+
+def _spin(seconds):
+    # Module-level so the forkserver child can import it
+    import time
+
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+
+
+def test_stage_charges_child_cpu():
+    with profiling.request_profile("POST", "/upload", forced=True) as profile:
+        with profiling.stage("code1", document="doc"):
+            profiling.add_child_cpu(deadlines.run_in_subprocess(_spin, (0.2,), 30, "spin"))
+    record, = profile.stages
+    assert record["stage"] == "code1" and record["document"] == "doc"
+    assert record["child_cpu_ms"] >= 150
+    assert record["peak_mem_kb"] is not None
+
+
+def test_overlapping_stages_do_not_share_the_memory_peak():
+    with profiling.request_profile("POST", "/upload", forced=True) as profile:
+        with profiling.stage("outer"):
+            with profiling.stage("inner"):
+                pass
+    inner, outer = profile.stages
+    assert inner["peak_mem_kb"] is None
+    assert outer["peak_mem_kb"] is not None
+
+
+def test_add_child_cpu_outside_a_stage_is_ignored():
+    profiling.add_child_cpu(1.0)
@@ -0,0 +1,90 @@
+# tests/test_scheduler.py
+import threading
+import time
+
+import pytest
+
+from backend import scheduler
+
+
+@pytest.fixture
+def sched(monkeypatch):
+    monkeypatch.setattr(scheduler, "_budgets", scheduler._Budgets({"default": {"weight": 1.0, "tokens_per_hour": 0}}))
+    return scheduler.Scheduler(workers=1, backfill_share=0.2)
+
+
+def run_in_order(sched, submissions):
+    """Submit while the single worker is blocked, then return the order the tasks ran in."""
+    gate, order = threading.Event(), []
+    blocker = sched.submit(gate.wait, tenant="blocker")
+    futures = [sched.submit(order.append, name, tenant=tenant, session=session, lane=lane)
+               for name, tenant, session, lane in submissions]
+    gate.set()
+    for future in [blocker] + futures:
+        future.result(timeout=5)
+    return order
+
+
+def test_tenants_share_a_lane_fairly(sched):
+    submissions = [(f"a{i}", "a", f"sa{i}", "interactive") for i in range(3)]
+    submissions += [(f"b{i}", "b", f"sb{i}", "interactive") for i in range(2)]
+    assert run_in_order(sched, submissions) == ["a0", "b0", "a1", "b1", "a2"]
+
+
+def test_session_tasks_run_in_submission_order(sched):
+    submissions = [("s1", "a", "s", "backfill"), ("s2", "a", "s", "interactive"), ("t1", "a", "t", "interactive")]
+    order = run_in_order(sched, submissions)
+    assert order.index("s1") < order.index("s2")
+    assert set(order) == {"s1", "s2", "t1"}
+
+
+def test_backfill_gets_its_share(sched):
+    submissions = [(f"i{i}", "a", f"i{i}", "interactive") for i in range(8)]
+    submissions += [(f"b{i}", "b", f"b{i}", "backfill") for i in range(2)]
+    order = run_in_order(sched, submissions)
+    assert order.index("b0") < 6 and len(order) == 10
+
+
+def test_cancelled_session_head_unblocks_the_next_task(sched):
+    gate, order = threading.Event(), []
+    blocker = sched.submit(gate.wait, tenant="blocker")
+    while sched.get(blocker.job_id)["status"] != "running":
+        time.sleep(0.01)
+    first = sched.submit(order.append, 1, tenant="a", session="s")
+    second = sched.submit(order.append, 2, tenant="a", session="s")
+    assert sched.cancel(first.job_id) == "cancelled"
+    assert sched.stats()["lanes"]["interactive"]["queued"] == 1
+    gate.set()
+    blocker.result(timeout=5)
+    second.result(timeout=5)
+    assert order == [2] and sched.get(first.job_id)["status"] == "cancelled"
+
+
+def test_finished_history_is_bounded(sched, monkeypatch):
+    monkeypatch.setattr(scheduler, "JOB_HISTORY", 3)
+    futures = [sched.submit(int, tenant="a") for _ in range(6)]
+    for future in futures:
+        future.result(timeout=5)
+    assert sched.get(futures[0].job_id) is None
+    assert sched.get(futures[-1].job_id)["status"] == "succeeded"
+
+
+def test_stats_snapshots_budgets_outside_the_lock(sched, monkeypatch):
+    sched.submit(int, tenant="a").result(timeout=5)
+
+    def snapshot(tenant):
+        acquired = []
+
+        def probe():
+            acquired.append(sched._cond.acquire(timeout=1))
+            if acquired[0]:
+                sched._cond.release()
+
+        thread = threading.Thread(target=probe)
+        thread.start()
+        thread.join()
+        assert acquired == [True]
+        return {"tokens_used": 0}
+
+    monkeypatch.setattr(scheduler._budgets, "snapshot", snapshot)
+    assert sched.stats()["tenants"]["a"]["completed"] == 1
@@ -0,0 +1,24 @@
+# tests/test_scheduler_budgets.py
+import pytest
+
+from backend import job_queue, scheduler
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    budgets = scheduler._Budgets({"default": {"weight": 1.0, "tokens_per_hour": 3600}})
+    monkeypatch.setattr(scheduler, "_budgets", budgets)
+    scheduler.share_budgets(job_queue.SQLiteQueue(tmp_path / "jobs.sqlite3"))
+    return budgets
+
+
+def test_shared_budget_is_enforced_per_tenant(shared):
+    with scheduler.tenant_context("t1"):
+        scheduler.charge(3000)
+        scheduler.record_usage(3000, 3500)
+        with pytest.raises(scheduler.BudgetExceeded) as e:
+            scheduler.charge(1000)
+    assert e.value.retry_after > 0
+    assert shared.snapshot("t1")["tokens_used"] == 3500
+    with scheduler.tenant_context("t2"):
+        scheduler.charge(1000)
@@ -0,0 +1,105 @@
+# tests/test_storage.py
+import asyncio
+import io
+import json
+import threading
+
+import pytest
+
+from backend import storage, versions
+from tests.s3_stub import InMemoryS3
+
+
+@pytest.fixture
+def s3():
+    return storage.S3Storage("bucket", "root", client=InMemoryS3())
+
+
+def test_s3_read_write_list(s3):
+    s3.write_stream("s1/doc/doc.pdf", io.BytesIO(b"%PDF-1.4"))
+    s3.write_bytes("s1/session_template.json", b"{}")
+    assert s3.exists("s1/doc/doc.pdf") and not s3.exists("s1/missing.pdf")
+    assert s3.exists_dir("s1/doc") and not s3.exists_dir("s2")
+    assert s3.list_dirs() == ["s1"]
+    assert s3.list_dirs("s1") == ["doc"]
+    assert s3.list_files("s1") == ["session_template.json"]
+    assert b"".join(s3.iter_chunks("s1/doc/doc.pdf", 3)) == b"%PDF-1.4"
+    assert ("bucket", "root/s1/doc/doc.pdf") in s3.client.objects
+    with pytest.raises(ValueError):
+        s3.exists("../escape")
+
+
+def test_s3_delete_prefix(s3):
+    for name in ("a", "b"):
+        s3.write_bytes(f"s1/{name}/file.json", b"{}")
+    s3.write_bytes("s10/file.json", b"{}")
+    asyncio.run(s3.adelete_prefix("s1"))
+    assert s3.list_dirs() == ["s10"]
+
+
+def test_s3_workspace_uploads_changes_but_not_the_version_file(s3):
+    s3.write_bytes("s1/doc/doc.pdf", b"pdf")
+    s3.write_bytes("s1/session_template.json", b"{}")
+    versions.bump_stored(s3, "s1")
+
+    with s3.workspace("s1", "doc") as session_dir:
+        assert (session_dir / "doc" / "doc.pdf").read_bytes() == b"pdf"
+        (session_dir / "doc" / "code1_output.txt").write_text("text", encoding="utf-8")
+        assert versions.bump(session_dir, ["a"]) == 2
+        # Another process bumps meanwhile; the scratch copy must not overwrite it
+        versions.bump_stored(s3, "s1")
+
+    assert s3.exists("s1/doc/code1_output.txt")
+    state = versions.load(s3, "s1")
+    assert state["version"] == 3
+    assert versions.changed_since(state, 1) == {"a"}
+
+
+def test_s3_concurrent_version_bumps(s3):
+    def bump_many():
+        for _ in range(20):
+            versions.bump_stored(s3, "s1", ["x"])
+
+    threads = [threading.Thread(target=bump_many) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert versions.load(s3, "s1")["version"] == 80
+
+
+def test_s3_update_gives_up_under_constant_conflicts(s3, monkeypatch):
+    monkeypatch.setattr(storage, "UPDATE_ATTEMPTS", 3)
+    monkeypatch.setattr(storage.time, "sleep", lambda seconds: None)
+    s3.write_bytes("s1/counter.json", b"0")
+
+    writes = iter(range(1, 100))
+
+    def racing(old):
+        s3.write_bytes("s1/counter.json", str(next(writes)).encode())  # another writer wins every time
+        return b"mine"
+
+    with pytest.raises(RuntimeError):
+        s3.update("s1/counter.json", racing)
+
+
+def test_local_storage_matches_s3(tmp_path):
+    local = storage.LocalStorage(tmp_path)
+    local.write_stream("s1/doc/doc.pdf", io.BytesIO(b"pdf"))
+    assert local.exists("s1/doc/doc.pdf") and local.list_dirs() == ["s1"]
+    assert json.loads(local.update("s1/n.json", lambda old: b"1")) == 1
+    assert local.update("s1/n.json", lambda old: str(int(old) + 1).encode()) == b"2"
+
+
+@pytest.mark.parametrize("key", [".", "./", "", "a/../..", "/etc"])
+def test_keys_resolving_to_the_root_are_rejected(tmp_path, s3, key):
+    local = storage.LocalStorage(tmp_path / "root")
+    local.write_bytes("s1/file.json", b"{}")
+    for backend in (local, s3):
+        with pytest.raises(ValueError):
+            backend.delete_prefix(key)
+        with pytest.raises(ValueError):
+            asyncio.run(backend.adelete_prefix(key))
+    assert local.exists("s1/file.json")
+    with pytest.raises(ValueError):
+        local.local_path(".")
@@ -0,0 +1,65 @@
+# tests/test_templates.py
+import json
+import os
+
+import pytest
+
+from backend import storage, templates
+
+
+@pytest.fixture
+def template_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(templates, "TEMPLATES_DIR", tmp_path)
+    folder = tmp_path / "w9"
+    folder.mkdir()
+
+    def write(form, mandatory=None):
+        (folder / "form_keys.json").write_text(json.dumps(form), encoding="utf-8")
+        if mandatory is not None:
+            (folder / "mandatory.json").write_text(json.dumps(mandatory), encoding="utf-8")
+        stat = (folder / "form_keys.json").stat()
+        # Distinct mtime even on coarse-grained filesystems
+        os.utime(folder / "form_keys.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    return write
+
+
+def test_template_is_compiled_once(template_dir):
+    template_dir({"Name": {"value": "", "description": "Legal name"}})
+    first = templates.get_template("w9")
+    assert templates.get_template("w9") is first
+    assert first.prompt_block == "- Name: Legal name\n"
+    assert "w9" in templates.list_templates()
+
+
+def test_changed_file_recompiles(template_dir):
+    template_dir({"Name": {"value": ""}})
+    first = templates.get_template("w9")
+    template_dir({"Name": {"value": ""}, "TIN": {"value": ""}})
+    second = templates.get_template("w9")
+    assert second is not first and [f["path"] for f in second.fields] == ["Name", "TIN"]
+
+
+def test_touched_but_identical_file_keeps_the_compiled_template(template_dir):
+    template_dir({"Name": {"value": ""}})
+    first = templates.get_template("w9")
+    template_dir({"Name": {"value": ""}})
+    assert templates.get_template("w9") is first
+
+
+def test_mandatory_change_recompiles(template_dir):
+    template_dir({"Name": {"value": ""}}, mandatory={})
+    first = templates.get_template("w9")
+    template_dir({"Name": {"value": ""}}, mandatory={"Individual": ["Name"]})
+    assert templates.get_template("w9").mandatory == {"Individual": ["Name"]} and first.mandatory == {}
+
+
+def test_session_binding(tmp_path, template_dir):
+    template_dir({"Name": {"value": ""}})
+    store = storage.LocalStorage(tmp_path / "sessions")
+    templates.bind_session(store, "s1", "w9")
+    assert templates.session_template_id(tmp_path / "sessions" / "s1") == "w9"
+    assert templates.session_template_id(tmp_path / "sessions" / "s2") == templates.DEFAULT_TEMPLATE
+    with pytest.raises(ValueError):
+        templates.get_template("../w9")
+    with pytest.raises(FileNotFoundError):
+        templates.bind_session(store, "s3", "missing")
@@ -0,0 +1,37 @@
+# tests/test_versions.py
+import multiprocessing
+
+from backend import storage, versions
+
+
+def _bump_many(session_dir, n):
+    for _ in range(n):
+        versions.bump(session_dir, ["a.b"])
+
+
+def test_bump_records_changes(tmp_path):
+    assert versions.bump(tmp_path, ["x", "y"]) == 1
+    assert versions.bump(tmp_path) == 2
+    state = versions.read(tmp_path)
+    assert state["version"] == 2 and state["id"]
+    assert versions.changed_since(state, 0) == {"x", "y"}
+    assert versions.changed_since(state, 2) == set()
+
+
+def test_concurrent_bumps_across_processes(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_bump_many, args=(str(tmp_path), 25)) for _ in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    assert all(proc.exitcode == 0 for proc in procs)
+    assert versions.read(tmp_path)["version"] == 100
+
+
+def test_bump_stored_local(tmp_path):
+    store = storage.LocalStorage(tmp_path)
+    assert versions.bump_stored(store, "s1") == 1
+    with store.workspace("s1") as session_dir:
+        assert versions.bump(session_dir, ["f"]) == 2
+    assert versions.load(store, "s1")["version"] == 2